@@ -1,5 +1,6 @@
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, jsonify, send_from_directory, Response, request
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
 from extensions import db, migrate, jwt
 from routes.auth import auth_bp
@@ -9,12 +10,31 @@ from routes.categories import cat_bp
 from routes.budgets import budget_bp
 from routes.currencies import currency_bp
 from routes.settings import settings_bp
+from routes.files import files_bp
+from routes.sync import sync_bp
+from routes.events import events_bp
+from routes.bootstrap import bootstrap_bp
+import metrics
+import events
+import routing
+import embedded  # noqa: F401  (registers SQLite engine listeners)
+import json_provider
+import compression
+import shards
+import hmac
 import os
+import time
 import traceback
 
 def create_app():
+    started = time.perf_counter()
     app = Flask(__name__, static_folder="static")
     app.config.from_object(Config)
+    json_provider.init_app(app)
+
+    # Trust X-Forwarded-For from nginx so request.remote_addr is the client
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
 
     # Ensure upload folder exists
     upload_folder = os.path.join(app.root_path, 'static', 'uploads')
@@ -25,6 +45,10 @@ def create_app():
     db.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
+    events.init_app(app)
+    routing.init_app(app)
+    shards.init_app(app)
+    compression.init_app(app)
     CORS(app)
 
     # Register Blueprints
@@ -35,6 +59,21 @@ def create_app():
     app.register_blueprint(budget_bp, url_prefix='/api/budgets')
     app.register_blueprint(currency_bp, url_prefix='/api/currencies')
     app.register_blueprint(settings_bp, url_prefix='/api/settings')
+    app.register_blueprint(files_bp, url_prefix='/api/files')
+    app.register_blueprint(sync_bp, url_prefix='/api/sync')
+    app.register_blueprint(events_bp, url_prefix='/api/events')
+    app.register_blueprint(bootstrap_bp, url_prefix='/api/bootstrap')
+
+    # Scrapers authenticate with METRICS_TOKEN; without one the endpoint is off
+    @app.route('/api/metrics')
+    def metrics_endpoint():
+        token = app.config['METRICS_TOKEN']
+        if not token:
+            return jsonify({"msg": "Not found"}), 404
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            return jsonify({"msg": "Unauthorized"}), 401
+        return Response(metrics.render(), mimetype='text/plain')
 
     # --- React SPA Route ---
     @app.route("/", defaults={"path": ""})
@@ -55,12 +94,14 @@ def create_app():
             "error": str(e)
         }), 500
 
+    metrics.set_gauge('app_build_seconds', round(time.perf_counter() - started, 4))
     return app
 
 if __name__ == '__main__':
     app = create_app()
     app.run(host='0.0.0.0', port=5000)
 else:
-    # Для Gunicorn
+    # Для Gunicorn: built once at import; with preload_app the master imports
+    # this module and workers inherit the app (target "app:app")
     app = create_app()
 
@@ -0,0 +1,196 @@
+"""
+Per-user, per-currency closing-balance checkpoints at month boundaries.
+
+A BalanceCheckpoint row holds the income and expense totals of everything
+dated before `period_end` in one currency. The all-time balance is the
+latest checkpoint plus the transactions dated on or after it, so reads only
+touch the current month's rows.
+
+Checkpoints are filled in by refresh() — scheduled in the background when a
+read finds them missing or stale, or for every user by running
+`python balances.py` — and invalidated whenever a transaction dated before
+a checkpoint's end is written, moved or deleted. ORM writes are covered by
+the flush hook below; bulk statements call invalidate() themselves.
+"""
+import sys
+import threading
+from datetime import datetime, date, timezone
+from sqlalchemy import event, delete, insert, func, inspect, or_
+from sqlalchemy.orm import Session
+from flask import current_app
+from extensions import db
+from models import BalanceCheckpoint, Transaction, User, UserDirectory
+import metrics
+import shards
+import tasks
+
+BALANCE_FIELDS = {'amount', 'currency', 'type', 'date'}
+
+_refreshing_lock = threading.Lock()
+_refreshing = set()
+
+def month_start(d):
+    return datetime(d.year, d.month, 1)
+
+def next_month(d):
+    return datetime(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+def invalidate(user_id, dates, session=None):
+    """Drop checkpoints that include any of the given transaction dates."""
+    # Stored dates are naive UTC
+    dates = [d.astimezone(timezone.utc).replace(tzinfo=None) if d.tzinfo else d for d in dates if d is not None]
+    if not dates:
+        return
+    (session or db.session).execute(
+        delete(BalanceCheckpoint).where(
+            BalanceCheckpoint.user_id == user_id,
+            BalanceCheckpoint.period_end > min(dates)
+        )
+    )
+
+def invalidate_from_query(user_id, query):
+    """Invalidate for every row a bulk statement on `query` is about to touch."""
+    earliest = query.with_entities(func.min(Transaction.date)).order_by(None).scalar()
+    invalidate(user_id, [earliest])
+
+@event.listens_for(Session, 'before_flush')
+def _invalidate_on_write(session, flush_context, instances):
+    dates = {}
+    for obj in session.new | session.dirty | session.deleted:
+        if not isinstance(obj, Transaction) or not obj.user_id:
+            continue
+        state = inspect(obj)
+        if obj in session.dirty and not any(state.attrs[f].history.has_changes() for f in BALANCE_FIELDS):
+            continue
+        # Old and new date: moving a row across a checkpoint affects both sides
+        old_dates = state.attrs.date.history.deleted
+        dates.setdefault(int(obj.user_id), []).extend(list(old_dates) + [obj.date])
+    for user_id, user_dates in dates.items():
+        invalidate(user_id, user_dates, session)
+
+def _parse_bucket(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(str(value)[:10])
+
+def refresh(user_id, now=None):
+    """Write checkpoints for every month boundary up to the current month. Returns the number of rows added."""
+    from routes.analytics import bucket_start_expr
+
+    until = month_start(now or datetime.utcnow())
+    shards.use(user_id)
+    # Lock the user row: writers take the same lock (sync.next_version), so a
+    # back-dated write either lands before our sums or invalidates after us
+    db.session.query(User.id).filter(User.id == user_id).with_for_update().scalar()
+
+    latest = db.session.query(func.max(BalanceCheckpoint.period_end)).filter_by(user_id=user_id).scalar()
+    if latest and latest >= until:
+        db.session.commit()
+        return 0
+
+    running = {}
+    query = Transaction.query.filter(Transaction.user_id == user_id, Transaction.date < until)
+    if latest:
+        for cp in BalanceCheckpoint.query.filter_by(user_id=user_id, period_end=latest):
+            running[cp.currency] = [cp.income, cp.expense]
+        query = query.filter(Transaction.date >= latest)
+
+    bucket_col = bucket_start_expr('month', Transaction.date).label('bucket')
+    rows = query.with_entities(
+        bucket_col, Transaction.currency, Transaction.type, func.sum(Transaction.amount)
+    ).group_by(bucket_col, Transaction.currency, Transaction.type).all()
+
+    by_month = {}
+    for bucket, currency, t_type, amount in rows:
+        by_month.setdefault(_parse_bucket(bucket), []).append((currency, t_type, amount or 0))
+    if not by_month and not running:
+        db.session.commit()
+        return 0
+
+    current = latest or min(by_month)
+    checkpoints = []
+    while current < until:
+        for currency, t_type, amount in by_month.get(current, ()):
+            entry = running.setdefault(currency, [0, 0])
+            entry[0 if t_type == 'income' else 1] += amount
+        current = next_month(current)
+        checkpoints.extend(
+            {'user_id': user_id, 'currency': currency, 'period_end': current, 'income': inc, 'expense': exp}
+            for currency, (inc, exp) in running.items()
+        )
+    if checkpoints:
+        db.session.execute(insert(BalanceCheckpoint), checkpoints)
+    db.session.commit()
+    metrics.inc('balance_checkpoints_written_total', len(checkpoints))
+    return len(checkpoints)
+
+def _refresh_job(user_id):
+    try:
+        refresh(user_id)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(user_id)
+
+def refresh_later(user_id):
+    with _refreshing_lock:
+        if user_id in _refreshing:
+            return
+        _refreshing.add(user_id)
+    tasks.submit_with_app(current_app._get_current_object(), _refresh_job, user_id)
+
+def totals(user_id):
+    """All-time {currency: {'income': x, 'expense': y}} from the latest checkpoint plus recent rows."""
+    this_month = month_start(datetime.utcnow())
+    latest = db.session.query(func.max(BalanceCheckpoint.period_end)).filter_by(user_id=user_id).scalar()
+    result = {}
+    settled = (Transaction.date < this_month).label('settled')
+    query = db.session.query(
+        Transaction.currency, Transaction.type, settled, func.sum(Transaction.amount)
+    ).filter(Transaction.user_id == user_id)
+    if latest:
+        for cp in BalanceCheckpoint.query.filter_by(user_id=user_id, period_end=latest):
+            result[cp.currency] = {'income': cp.income, 'expense': cp.expense}
+        # Undated rows are never folded into a checkpoint
+        query = query.filter(or_(Transaction.date >= latest, Transaction.date == None))
+
+    stale = False
+    for currency, t_type, is_settled, amount in query.group_by(Transaction.currency, Transaction.type, settled):
+        entry = result.setdefault(currency, {'income': 0, 'expense': 0})
+        entry['income' if t_type == 'income' else 'expense'] += amount or 0
+        stale = stale or bool(is_settled)
+
+    # Rows from past months were summed here: a checkpoint could have covered them
+    if stale:
+        metrics.inc('balance_checkpoint_misses_total')
+        refresh_later(user_id)
+    return result
+
+def balance_in_base(user_id, base_currency, rate_cache):
+    """All-time balance converted to the base currency."""
+    from routes.currencies import get_conversion_rate
+
+    balance = 0
+    for currency, t in totals(user_id).items():
+        rate = 1.0
+        if currency != base_currency:
+            k = f"{currency}_{base_currency}"
+            if k not in rate_cache:
+                rate_cache[k] = get_conversion_rate(currency, base_currency)
+            rate = rate_cache[k]
+        balance += (t['income'] - t['expense']) * rate
+    return balance
+
+def refresh_all():
+    count = 0
+    for (user_id,) in db.session.query(UserDirectory.id).order_by(UserDirectory.id).all():
+        count += refresh(user_id)
+    return count
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        print(f"Wrote {refresh_all()} balance checkpoints")
+    sys.exit(0)
@@ -0,0 +1,211 @@
+"""
+Endpoint latency benchmark for comparing database backends.
+
+    DATABASE_URL=sqlite:////data/bench.db python benchmark.py
+    DATABASE_URL=postgresql://user:password@db:5432/bench python benchmark.py
+
+Seeds a throwaway user with --transactions rows spread over --years, then
+times the main read endpoints through the Flask test client (no network,
+no gunicorn, so only the app and the database are measured) and a write
+mix from --threads concurrent threads. Point it at an empty database: the
+schema is created if missing. Rate limiting is turned off for the run.
+
+    python benchmark.py --payload 10000
+
+skips the database and measures response encoding instead: JSON
+serialization and gzip/brotli CPU time against bytes on the wire for a
+transaction list of that many rows.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+READS = (
+    ('transactions (month)', '/api/transactions/?start_date={month_start}'),
+    ('transactions (search)', '/api/transactions/?search=coffee'),
+    ('summary (year)', '/api/analytics/summary?period=year'),
+    ('summary (all)', '/api/analytics/summary?period=all'),
+    ('timeseries (month buckets, all)', '/api/analytics/timeseries?bucket=month&period=all'),
+    ('budgets', '/api/budgets/'),
+    ('sync (delta)', '/api/sync?since={token}'),
+    ('forecast', '/api/analytics/forecast?months=6'),
+)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def seed(app, client, transactions, years):
+    from sqlalchemy import insert, inspect
+    from extensions import db
+    from models import Category, Transaction, Budget
+
+    with app.app_context():
+        if not inspect(db.engine).has_table('user_directory'):
+            db.create_all()
+        if not Category.query.filter(Category.user_id == None).first():
+            db.session.add_all([Category(name='Food', type='expense'), Category(name='Salary', type='income')])
+            db.session.commit()
+        expense_id = Category.query.filter_by(user_id=None, type='expense').first().id
+        income_id = Category.query.filter_by(user_id=None, type='income').first().id
+
+    email = f"bench-{uuid.uuid4().hex[:8]}@example.com"
+    r = client.post('/api/auth/register', json={'email': email, 'password': 'bench', 'name': 'Bench'})
+    headers = {'Authorization': 'Bearer ' + r.get_json()['token']}
+
+    with app.app_context():
+        import shards
+
+        user_id = shards.find_email(email).id
+        shards.use(user_id)
+        now = datetime.utcnow()
+        words = ('coffee', 'groceries', 'rent', 'taxi', 'cinema', 'books')
+        rows = []
+        for i in range(transactions):
+            is_income = i % 20 == 0
+            amount = round(random.uniform(1, 200), 2)
+            rows.append({
+                'user_id': user_id, 'amount': amount, 'currency': 'RUB',
+                'type': 'income' if is_income else 'expense',
+                'category_id': income_id if is_income else expense_id,
+                'description': random.choice(words),
+                'date': now - timedelta(days=random.uniform(0, 365 * years)),
+                'amount_in_base': amount, 'base_rate': 1.0, 'base_currency': 'RUB',
+            })
+        for i in range(0, len(rows), 5000):
+            db.session.execute(insert(Transaction), rows[i:i + 5000])
+        db.session.add(Budget(user_id=user_id, category_id=expense_id, amount_limit=5000))
+        db.session.commit()
+    token = client.get('/api/sync', headers=headers).get_json()['token']
+    return headers, token, expense_id
+
+def time_reads(client, headers, params, rounds):
+    results = []
+    for name, url in READS:
+        url = url.format(**params)
+        client.get(url, headers=headers)  # warm caches and connections
+        samples = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            status = client.get(url, headers=headers).status_code
+            samples.append((time.perf_counter() - started) * 1000)
+            if status != 200:
+                print(f"  {name}: HTTP {status}", file=sys.stderr)
+        results.append((name, samples))
+    return results
+
+def payload_rows(count):
+    now = datetime.utcnow()
+    words = ('coffee', 'groceries', 'rent', 'taxi', 'cinema', 'books')
+    return [{
+        "id": i, "amount": round(random.uniform(1, 200), 2), "currency": "RUB",
+        "amount_in_base": round(random.uniform(1, 200), 2), "base_currency": "RUB",
+        "description": random.choice(words), "date": now - timedelta(minutes=37 * i),
+        "type": "expense", "category_id": 1 + i % 12, "category_name": "Food", "category_color": "#ef4444",
+        "tags": "work,lunch" if i % 3 == 0 else None, "attachment": None,
+    } for i in range(count)]
+
+def time_call(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+def time_payload(count, rounds):
+    from flask import Flask
+    import compression
+    from json_provider import IsoJSONProvider, OrjsonProvider, orjson
+
+    rows = payload_rows(count)
+    app = Flask(__name__)
+    providers = [('stdlib json', IsoJSONProvider(app))]
+    if orjson is not None:
+        providers.append(('orjson', OrjsonProvider(app)))
+    print(f"{count} transactions")
+    print(f"{'encoder':<24}{'ms':>10}{'bytes':>12}")
+    body = None
+    for name, provider in providers:
+        ms, body = time_call(lambda: provider.response(rows).get_data(), rounds)
+        print(f"{name:<24}{ms:>10.1f}{len(body):>12}")
+
+    levels = [('gzip', 'COMPRESS_GZIP_LEVEL', level) for level in (1, 6, 9)]
+    if compression.brotli is not None:
+        levels += [('br', 'COMPRESS_BROTLI_QUALITY', quality) for quality in (1, 4, 6, 11)]
+    print(f"{'encoding':<24}{'ms':>10}{'bytes':>12}{'ratio':>8}")
+    for encoding, key, level in levels:
+        ms, out = time_call(lambda: compression.compress(body, encoding, {key: level}), rounds)
+        print(f"{f'{encoding} {level}':<24}{ms:>10.1f}{len(out):>12}{len(body) / len(out):>8.1f}")
+
+def time_writes(app, headers, category_id, threads, per_thread):
+    errors = []
+    samples = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        for i in range(per_thread):
+            started = time.perf_counter()
+            r = client.post('/api/transactions/', json={
+                'amount': 10, 'type': 'expense', 'category_id': category_id, 'description': 'bench write',
+            }, headers=headers)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                samples.append(elapsed)
+                if r.status_code != 201:
+                    errors.append(r.status_code)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return samples, errors, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Endpoint latency benchmark")
+    parser.add_argument('--transactions', type=int, default=20000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--writes', type=int, default=25, help="writes per thread")
+    parser.add_argument('--payload', type=int, help="only benchmark encoding a list of this many transactions")
+    args = parser.parse_args()
+
+    if args.payload:
+        time_payload(args.payload, args.rounds)
+        return 0
+
+    from app import app
+
+    app.config['RATE_LIMIT_ENABLED'] = False
+    client = app.test_client()
+    with app.app_context():
+        from extensions import db
+        backend = db.engine.dialect.name
+
+    started = time.perf_counter()
+    headers, token, category_id = seed(app, client, args.transactions, args.years)
+    print(f"Backend: {backend}, {args.transactions} transactions seeded in {time.perf_counter() - started:.1f}s")
+
+    month_start = datetime.utcnow().replace(day=1).date().isoformat()
+    print(f"{'endpoint':<34}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, samples in time_reads(client, headers, {'month_start': month_start, 'token': token}, args.rounds):
+        print(f"{name:<34}{statistics.median(samples):>10.1f}{percentile(samples, 95):>10.1f}")
+
+    samples, errors, elapsed = time_writes(app, headers, category_id, args.threads, args.writes)
+    print(f"{'POST /api/transactions/':<34}{statistics.median(samples):>10.1f}{percentile(samples, 95):>10.1f}"
+          f"  ({len(samples) / elapsed:.0f} writes/s over {args.threads} threads, {len(errors)} errors)")
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""
+Columnar in-memory analytics for a user's whole transaction history.
+
+A user's transactions are loaded once into compact NumPy columns sorted by
+date: day (days since 1970-01-01), amount, category index, currency index,
+an income flag and the stored base amount. Sums, pie slices, time buckets
+and budget spend are then a handful of vectorized operations: searchsorted
+for date ranges, bincount for grouping, and the stored base amounts (see
+valuation.py) for conversion; only rows without one fall back to a
+per-currency rate vector indexed by the currency column.
+
+Rows without a date sort first with day UNDATED: like the SQL engine,
+all-time totals count them, while date ranges and time buckets skip them.
+
+Columns are cached per worker (LRU) and keyed by User.sync_version, which
+every transaction/category write and every revaluation bumps, so a cached
+copy is never stale. With ANALYTICS_CACHE_DIR set they are also written as
+.npy files and memory-mapped, so workers share one copy through the page
+cache and a restarted worker does not rebuild them.
+"""
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+import numpy as np
+from flask import current_app
+from sqlalchemy import select as sql_select, func, case, cast, extract, Integer
+from extensions import db
+from models import Transaction, User
+import metrics
+
+EPOCH = date(1970, 1, 1).toordinal()
+UNDATED = np.iinfo(np.int32).min
+ARRAYS = ('day', 'amount', 'category', 'currency', 'income', 'stored')
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+class UserColumns:
+    """One user's transactions as parallel arrays, sorted by day."""
+
+    def __init__(self, version, arrays, category_ids, currencies, base_currency):
+        self.version = version
+        self.day = arrays['day']            # int32 days since epoch, UNDATED for rows without a date
+        self.amount = arrays['amount']      # float64, original currency
+        self.category = arrays['category']  # int32 index into category_ids
+        self.currency = arrays['currency']  # int16 index into currencies
+        self.income = arrays['income']      # bool
+        self.stored = arrays['stored']      # float64 amount in base_currency, NaN while pending
+        self.category_ids = category_ids
+        self.currencies = currencies
+        self.base_currency = base_currency
+
+    def __len__(self):
+        return len(self.day)
+
+    def dated_from(self):
+        """Index of the first row with a date (undated rows sort first)."""
+        return int(np.searchsorted(self.day, UNDATED, 'right'))
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in ARRAYS}
+
+def to_day(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal() - EPOCH
+
+def from_day(day):
+    return date.fromordinal(int(day) + EPOCH)
+
+def day_expr(column):
+    """SQL expression for days since 1970-01-01, so no datetimes are built in Python."""
+    if db.engine.dialect.name == 'postgresql':
+        return cast(func.floor(extract('epoch', column) / 86400), Integer)
+    return cast(func.julianday(column) - 2440587.5, Integer)
+
+def build(user_id, version):
+    base_currency = db.session.query(User.base_currency).filter(User.id == user_id).scalar() or 'RUB'
+    day = func.coalesce(day_expr(Transaction.date), UNDATED)
+    # Stored base amounts only count while they are in the user's base currency
+    stored = case((Transaction.base_currency == base_currency, Transaction.amount_in_base))
+    rows = db.session.execute(
+        sql_select(day, Transaction.amount, Transaction.category_id, func.coalesce(Transaction.currency, 'RUB'),
+                   Transaction.type, stored)
+        .where(Transaction.user_id == user_id)
+        .order_by(day)
+    ).all()
+
+    days, amounts, category_ids, currencies, types, stored = zip(*rows) if rows else ((),) * 6
+    category_ids, category_index = np.unique(np.asarray(category_ids, dtype=np.int64), return_inverse=True)
+    currencies, currency_index = np.unique(np.asarray(currencies, dtype='U3'), return_inverse=True)
+    arrays = {
+        'day': np.asarray(days, dtype=np.int32),
+        'amount': np.asarray(amounts, dtype=np.float64),
+        'category': category_index.ravel().astype(np.int32),
+        'currency': currency_index.ravel().astype(np.int16),
+        'income': np.asarray(types, dtype=object) == 'income',
+        'stored': np.asarray([np.nan if v is None else v for v in stored], dtype=np.float64),
+    }
+    metrics.inc('columnar_builds_total')
+    return UserColumns(version, arrays, category_ids.tolist(), currencies.tolist(), base_currency)
+
+# --- Memory-mapped persistence --------------------------------------------
+
+def _user_dir(user_id):
+    cache_dir = current_app.config.get('ANALYTICS_CACHE_DIR')
+    return os.path.join(cache_dir, str(user_id)) if cache_dir else None
+
+def _load_mapped(user_id, version):
+    user_dir = _user_dir(user_id)
+    path = user_dir and os.path.join(user_dir, str(version))
+    if not path or not os.path.isdir(path):
+        return None
+    try:
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in ARRAYS}
+        category_ids = np.load(os.path.join(path, 'category_ids.npy')).tolist()
+        currencies = np.load(os.path.join(path, 'currencies.npy')).tolist()
+        base_currency = str(np.load(os.path.join(path, 'base_currency.npy')))
+    except (OSError, ValueError):
+        return None
+    return UserColumns(version, arrays, category_ids, currencies, base_currency)
+
+def _save_mapped(user_id, cols):
+    user_dir = _user_dir(user_id)
+    if not user_dir:
+        return
+    os.makedirs(user_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=user_dir, prefix='.build-')
+    try:
+        for name, array in cols.arrays().items():
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+        np.save(os.path.join(tmp, 'category_ids.npy'), np.asarray(cols.category_ids, dtype=np.int64))
+        np.save(os.path.join(tmp, 'currencies.npy'), np.asarray(cols.currencies, dtype='U3'))
+        np.save(os.path.join(tmp, 'base_currency.npy'), np.asarray(cols.base_currency, dtype='U3'))
+        os.rename(tmp, os.path.join(user_dir, str(cols.version)))
+    except OSError:
+        # Another worker published this version first
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    for entry in os.listdir(user_dir):
+        if entry != str(cols.version) and not entry.startswith('.'):
+            shutil.rmtree(os.path.join(user_dir, entry), ignore_errors=True)
+
+# --- Cache ----------------------------------------------------------------
+
+def load(user_id):
+    """Columns for the user's current data version, from cache, disk or the database."""
+    version = db.session.query(User.sync_version).filter(User.id == user_id).scalar() or 0
+    with _lock:
+        cols = _cache.get(user_id)
+        if cols is not None and cols.version == version:
+            _cache.move_to_end(user_id)
+            metrics.inc('columnar_cache_total', result='hit')
+            return cols
+
+    cols = _load_mapped(user_id, version)
+    if cols is not None:
+        metrics.inc('columnar_cache_total', result='mapped')
+    else:
+        metrics.inc('columnar_cache_total', result='miss')
+        cols = build(user_id, version)
+        _save_mapped(user_id, cols)
+
+    with _lock:
+        _cache[user_id] = cols
+        _cache.move_to_end(user_id)
+        while len(_cache) > current_app.config['ANALYTICS_CACHE_USERS']:
+            _cache.popitem(last=False)
+    return cols
+
+# --- Kernels --------------------------------------------------------------
+
+def rate_vector(cols, base_currency, rate_cache):
+    from routes.currencies import get_conversion_rate
+
+    rates = np.ones(len(cols.currencies), dtype=np.float64)
+    for i, currency in enumerate(cols.currencies):
+        if currency != base_currency:
+            k = f"{currency}_{base_currency}"
+            if k not in rate_cache:
+                rate_cache[k] = get_conversion_rate(currency, base_currency)
+            rates[i] = rate_cache[k]
+    return rates
+
+def select(cols, start=None, end=None, category_ids=None):
+    """Boolean mask of rows in [start, end) and, optionally, the given categories."""
+    lo = np.searchsorted(cols.day, to_day(start), 'left') if start else 0
+    hi = np.searchsorted(cols.day, to_day(end), 'left') if end else len(cols)
+    mask = np.zeros(len(cols), dtype=bool)
+    mask[lo:hi] = True
+    if category_ids is not None:
+        category_ids = set(category_ids)
+        wanted = [i for i, c in enumerate(cols.category_ids) if c in category_ids]
+        mask &= np.isin(cols.category, wanted)
+    return mask
+
+def in_base(cols, base_currency, rate_cache):
+    """Amounts in base currency: the stored value, converting at current rates only rows that have none."""
+    if base_currency != cols.base_currency:
+        return cols.amount * rate_vector(cols, base_currency, rate_cache)[cols.currency]
+    pending = np.isnan(cols.stored)
+    if not pending.any():
+        return np.asarray(cols.stored)
+    values = np.array(cols.stored)
+    values[pending] = cols.amount[pending] * rate_vector(cols, base_currency, rate_cache)[cols.currency[pending]]
+    return values
+
+def month_numbers(days):
+    """year * 12 + month - 1 of each day."""
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) + 1970 * 12
+
+def bucket_days(days, bucket):
+    """Start day of each row's bucket (weeks start on Monday)."""
+    d = days.astype('datetime64[D]')
+    if bucket == 'day':
+        start = d
+    elif bucket == 'week':
+        # 1970-01-01 was a Thursday
+        start = d - ((days + 3) % 7).astype('timedelta64[D]')
+    elif bucket == 'month':
+        start = d.astype('datetime64[M]').astype('datetime64[D]')
+    elif bucket == 'quarter':
+        months = d.astype('datetime64[M]').astype(np.int64)
+        start = (months - months % 3).astype('datetime64[M]').astype('datetime64[D]')
+    else:
+        start = d.astype('datetime64[Y]').astype('datetime64[D]')
+    return start.astype(np.int64)
+
+def summarize(cols, mask, values, bucket):
+    """Totals, per-category expense and per-bucket income/expense of the masked rows."""
+    income = cols.income[mask]
+    amounts = values[mask]
+    categories = cols.category[mask]
+    days = cols.day[mask]
+
+    total_income = float(amounts[income].sum())
+    total_expenses = float(amounts[~income].sum())
+
+    by_category = np.bincount(categories[~income], weights=amounts[~income], minlength=len(cols.category_ids))
+    category_totals = {cols.category_ids[i]: float(v) for i, v in enumerate(by_category) if v}
+
+    # Undated rows count in the totals but belong to no bucket
+    dated = days != UNDATED
+    income, amounts = income[dated], amounts[dated]
+    keys, inverse = np.unique(bucket_days(days[dated], bucket), return_inverse=True)
+    inverse = inverse.ravel()
+    bucket_income = np.bincount(inverse, weights=np.where(income, amounts, 0), minlength=len(keys))
+    bucket_expense = np.bincount(inverse, weights=np.where(income, 0, amounts), minlength=len(keys))
+    buckets = {
+        from_day(k): {'income': float(i), 'expense': float(e)}
+        for k, i, e in zip(keys, bucket_income, bucket_expense)
+    }
+    return total_income, total_expenses, category_totals, buckets
+
+def spent(cols, values, start, end, category_ids):
+    """Budget spend: like budgets.month_spent, every transaction in the categories counts."""
+    return float(values[select(cols, start, end, category_ids)].sum())
@@ -0,0 +1,74 @@
+import gzip
+import time
+from flask import request
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Response compression for the API.
+#
+# Responses under /api/ with a compressible mimetype (COMPRESS_MIMETYPES)
+# and at least COMPRESS_MIN_SIZE bytes are compressed with the best
+# encoding the client accepts: brotli (when installed) or gzip, honouring
+# q-values in Accept-Encoding. Small bodies are left alone, since they
+# gain little and still cost CPU. Streamed responses (SSE, files) and
+# responses that already carry a Content-Encoding pass through
+# untouched. Levels are deliberately moderate (COMPRESS_GZIP_LEVEL,
+# COMPRESS_BROTLI_QUALITY): past them the extra CPU buys only a few
+# percent of bytes on JSON.
+
+def encodings():
+    """Encodings this worker can produce, in order of preference."""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def negotiate():
+    """Best encoding for the current request, or None for identity."""
+    best = request.accept_encodings.best_match(encodings())
+    return best if best and request.accept_encodings[best] > 0 else None
+
+def compress(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'], mode=brotli.MODE_TEXT)
+    return gzip.compress(data, compresslevel=config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+def _compressible(response, config):
+    return (
+        200 <= response.status_code < 300 and response.status_code not in (204, 206)
+        and not response.direct_passthrough
+        and not response.is_streamed
+        and 'Content-Encoding' not in response.headers
+        and response.mimetype in config['COMPRESS_MIMETYPES']
+        and (response.content_length or 0) >= config['COMPRESS_MIN_SIZE']
+    )
+
+def init_app(app):
+    @app.after_request
+    def _compress_response(response):
+        config = app.config
+        if not config['COMPRESS_ENABLED'] or not request.path.startswith('/api/'):
+            return response
+        if not _compressible(response, config):
+            return response
+        # Whether or not this response is compressed, caches must key on the header
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate()
+        if encoding is None:
+            return response
+
+        started = time.perf_counter()
+        data = response.get_data()
+        compressed = compress(data, encoding, config)
+        metrics.inc('compression_seconds_total', time.perf_counter() - started, encoding=encoding)
+        metrics.inc('compression_bytes_total', len(data), encoding=encoding, stage='in')
+        metrics.inc('compression_bytes_total', len(compressed), encoding=encoding, stage='out')
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        # A different byte representation of the same resource
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
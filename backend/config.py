@@ -1,7 +1,169 @@
 import os
+from sqlalchemy.pool import NullPool
+
+def _named_values(value, cast):
+    """Parse "name=value,name=value" settings keyed by endpoint or blueprint name."""
+    return {
+        name.strip(): cast(v)
+        for name, v in (item.split('=', 1) for item in value.split(',') if '=' in item)
+    }
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'default-secret')
     SQLALCHEMY_DATABASE_URI = os.environ.get("SQLALCHEMY_DATABASE_URI") or os.environ.get("DATABASE_URL")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Engine pool. With DB_PGBOUNCER=1 PgBouncer (transaction mode) does the
+    # pooling: connections are not kept open here and no session state is set
+    DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER') == '1'
+    if DB_PGBOUNCER:
+        SQLALCHEMY_ENGINE_OPTIONS = {'poolclass': NullPool}
+    elif (SQLALCHEMY_DATABASE_URI or '').startswith('postgres'):
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+        }
+    else:
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+    # statement_timeout (ms, 0 = none) set per transaction during requests;
+    # DB_STATEMENT_TIMEOUTS overrides it per blueprint or endpoint, e.g.
+    # "analytics=15000,settings.export_pdf=60000"
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    DB_STATEMENT_TIMEOUTS = _named_values(os.environ.get('DB_STATEMENT_TIMEOUTS', ''), int)
+    # LISTEN/NOTIFY needs a session-mode connection; point this past PgBouncer
+    DATABASE_DIRECT_URL = os.environ.get('DATABASE_DIRECT_URL')
+
+    # Read replica for read-only routes (see routing.py)
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    # User-id shards besides the default database, as "name=url,name=url" (see shards.py)
+    SHARD_URLS = _named_values(os.environ.get('SHARD_URLS', ''), str)
+    # Shards that receive new users (default: all, least loaded first)
+    SHARD_NEW_USERS = [name for name in os.environ.get('SHARD_NEW_USERS', '').split(',') if name]
+    SHARD_DIRECTORY_TTL = float(os.environ.get('SHARD_DIRECTORY_TTL', 5))
+    SQLALCHEMY_BINDS = dict(SHARD_URLS, **({'replica': DATABASE_REPLICA_URL} if DATABASE_REPLICA_URL else {}))
+    DATABASE_REPLICA_ROUTES = set(filter(None, os.environ.get(
+        'DATABASE_REPLICA_ROUTES',
+        'analytics,stats,bootstrap,transactions.get_transactions,settings.export_data,settings.export_pdf'
+    ).split(',')))
+    DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get('DATABASE_REPLICA_STICKY_SECONDS', 5))
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'jwt-secret')
+
+    # Bearer token required by /api/metrics (the endpoint is disabled without one)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Per-worker LRU of user profiles carried in JWT claims
+    PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 1024))
+
+    # Number of trusted reverse proxies in front of the app. Only set it when
+    # clients cannot reach the app directly, or X-Forwarded-For is spoofable
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0))
+
+    # Password hashing pool and login throttling. Method as accepted by
+    # werkzeug's generate_password_hash; older hashes are upgraded on login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_DEPTH = int(os.environ.get('PASSWORD_HASH_QUEUE_DEPTH', 8))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+    LOGIN_WINDOW_SECONDS = int(os.environ.get('LOGIN_WINDOW_SECONDS', 300))
+    LOGIN_MAX_ATTEMPTS_PER_EMAIL = int(os.environ.get('LOGIN_MAX_ATTEMPTS_PER_EMAIL', 5))
+    LOGIN_MAX_ATTEMPTS_PER_IP = int(os.environ.get('LOGIN_MAX_ATTEMPTS_PER_IP', 20))
+
+    # Upper bound on operations accepted by POST /api/transactions/batch
+    BATCH_MAX_OPERATIONS = int(os.environ.get('BATCH_MAX_OPERATIONS', 1000))
+
+    # Upload storage: 'local' (uploads volume) or 's3' (S3-compatible bucket)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    STORAGE_S3_BUCKET = os.environ.get('STORAGE_S3_BUCKET', 'uploads')
+    STORAGE_S3_ENDPOINT = os.environ.get('STORAGE_S3_ENDPOINT')
+    # Hand downloads to nginx via X-Accel-Redirect; only behind the nginx
+    # config that maps STORAGE_ACCEL_PREFIX (docker-compose), else bodies are empty
+    STORAGE_X_ACCEL = os.environ.get('STORAGE_X_ACCEL', '0') == '1'
+    STORAGE_ACCEL_PREFIX = os.environ.get('STORAGE_ACCEL_PREFIX', '/protected-uploads')
+
+    # Bounding-box sizes (px) of thumbnails rendered for image uploads
+    THUMBNAIL_SIZES = [int(s) for s in os.environ.get('THUMBNAIL_SIZES', '128,512,1024').split(',')]
+    # Larger images are served as uploaded instead of being decoded for a thumbnail
+    THUMBNAIL_MAX_PIXELS = int(os.environ.get('THUMBNAIL_MAX_PIXELS', 50_000_000))
+
+    # Server-sent events: 'postgres' (LISTEN/NOTIFY across workers) or 'local' (in-process)
+    EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND') or (
+        'postgres' if (SQLALCHEMY_DATABASE_URI or '').startswith('postgres') else 'local'
+    )
+    # Each open stream holds a gthread worker thread until it ends, so streams
+    # per worker are capped below GUNICORN_THREADS, keeping SSE_RESERVED_THREADS
+    # free for regular requests. Many dashboards want a separate events
+    # service (see docker-compose.yml) with more threads.
+    SSE_RESERVED_THREADS = int(os.environ.get('SSE_RESERVED_THREADS', 4))
+    SSE_MAX_STREAMS = int(os.environ.get(
+        'SSE_MAX_STREAMS', max(0, int(os.environ.get('GUNICORN_THREADS', 8)) - SSE_RESERVED_THREADS)
+    ))
+    SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+    SSE_MAX_SECONDS = int(os.environ.get('SSE_MAX_SECONDS', 300))
+    # Lifetime of the single-purpose tokens /events/stream takes in its URL
+    SSE_TOKEN_SECONDS = int(os.environ.get('SSE_TOKEN_SECONDS', 60))
+
+    # Analytics engine: 'sql' (per-request queries) or 'columnar' (cached NumPy columns, see columnar.py)
+    ANALYTICS_ENGINE = os.environ.get('ANALYTICS_ENGINE', 'sql')
+    ANALYTICS_CACHE_USERS = int(os.environ.get('ANALYTICS_CACHE_USERS', 64))
+    # Optional directory for memory-mapped column files shared by workers
+    ANALYTICS_CACHE_DIR = os.environ.get('ANALYTICS_CACHE_DIR')
+
+    # Token-bucket limits on expensive endpoints, per user (see ratelimit.py).
+    # Backend: 'postgres' (shared by all workers) or 'local' (in-process)
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND') or (
+        'postgres' if (SQLALCHEMY_DATABASE_URI or '').startswith('postgres') else 'local'
+    )
+    RATE_LIMIT_CAPACITY = float(os.environ.get('RATE_LIMIT_CAPACITY', 60))
+    RATE_LIMIT_REFILL_PER_SECOND = float(os.environ.get('RATE_LIMIT_REFILL_PER_SECOND', 1))
+    # Per-endpoint cost overrides, e.g. "settings.export_pdf=30,analytics.get_summary=5"
+    RATE_LIMIT_COSTS = _named_values(os.environ.get('RATE_LIMIT_COSTS', ''), float)
+    # Requests costing at least this much go through the per-worker admission gate
+    RATE_LIMIT_HEAVY_COST = float(os.environ.get('RATE_LIMIT_HEAVY_COST', 10))
+    ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 2))
+    ADMISSION_QUEUE_DEPTH = int(os.environ.get('ADMISSION_QUEUE_DEPTH', 4))
+    ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 5))
+    ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 2))
+
+    # SQLite for single-node installs (see embedded.py)
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', '1') == '1'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 65536))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000))
+
+    # Response encoding (see json_provider.py, compression.py)
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'auto')
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') == '1'
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_MIMETYPES = set(os.environ.get('COMPRESS_MIMETYPES', 'application/json,text/csv,text/plain').split(','))
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+    # Rows per fetch/write in streamed listings (?stream=1)
+    STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))
+
+    # /api/bootstrap runs its parts on a per-worker thread pool, each with its
+    # own DB connection; on by default where the driver releases the GIL (Postgres)
+    BOOTSTRAP_PARALLEL = os.environ.get('BOOTSTRAP_PARALLEL', '1' if (SQLALCHEMY_DATABASE_URI or '').startswith('postgres') else '0') == '1'
+    BOOTSTRAP_WORKERS = int(os.environ.get('BOOTSTRAP_WORKERS', 3))
+
+    # Exchange-rate providers (see fx.py)
+    FX_TIMEOUT = float(os.environ.get('FX_TIMEOUT', 3))
+    FX_FETCH_WORKERS = int(os.environ.get('FX_FETCH_WORKERS', 8))
+    FX_RATES_URL = os.environ.get('FX_RATES_URL', 'https://open.er-api.com/v6/latest/{base}')
+    FX_HISTORY_URL = os.environ.get('FX_HISTORY_URL', 'https://api.frankfurter.app/{start}..{end}?from={base}&to={target}')
+    # Circuit breaker per provider: open after this many failures in a row, retry after the delay
+    FX_BREAKER_FAILURES = int(os.environ.get('FX_BREAKER_FAILURES', 3))
+    FX_BREAKER_OPEN_SECONDS = float(os.environ.get('FX_BREAKER_OPEN_SECONDS', 30))
+    # Provider answers are cached per worker; failures and unknown currencies for FX_NEGATIVE_TTL
+    FX_RATES_TTL = float(os.environ.get('FX_RATES_TTL', 600))
+    FX_NEGATIVE_TTL = float(os.environ.get('FX_NEGATIVE_TTL', 60))
+    # Longest a request waits on a provider call; a slower call finishes in the background
+    FX_WAIT_SECONDS = float(os.environ.get('FX_WAIT_SECONDS', 3))
+    # Stored history is refetched at most this often per pair while it lags today
+    CURRENCY_HISTORY_REFRESH_SECONDS = int(os.environ.get('CURRENCY_HISTORY_REFRESH_SECONDS', 3600))
+    CURRENCY_HISTORY_MAX_TARGETS = int(os.environ.get('CURRENCY_HISTORY_MAX_TARGETS', 20))
+    CURRENCY_CONVERT_MAX_ITEMS = int(os.environ.get('CURRENCY_CONVERT_MAX_ITEMS', 1000))
@@ -0,0 +1,83 @@
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import scoped_session
+from config import Config
+
+# SQLite as a production backend for small single-node installs.
+#
+# Every SQLite connection is switched to WAL (readers never block the
+# writer and vice versa) with the SQLITE_* pragmas from config.py, and a
+# unicode-aware lower() so ilike() matches Cyrillic text the way Postgres
+# does. Transactions are started explicitly: BEGIN IMMEDIATE for write
+# requests and background jobs, so concurrent writers queue on the
+# database lock (up to SQLITE_BUSY_TIMEOUT_MS) from the start instead of
+# failing with "database is locked" when a read transaction tries to
+# upgrade; plain BEGIN for GET requests, which only read. The few GET
+# paths that do write (storing fetched exchange rates and rate history)
+# call begin_write() first, so that unit of work runs IMMEDIATE as well.
+# Connections that only read can opt out anywhere with
+# .execution_options(sqlite_begin='DEFERRED'); side lookups made while a
+# session holds the write lock (the shard directory) must, or they would
+# wait on their own thread's lock. Listeners are registered on the Engine
+# class, so every SQLite engine (app, shards, startup.py) gets them.
+# Postgres engines are left alone.
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+def _is_sqlite(dbapi_connection):
+    return type(dbapi_connection).__module__.startswith('sqlite3')
+
+def _lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    if not _is_sqlite(dbapi_connection):
+        return
+    # Let SQLAlchemy emit BEGIN itself (see _begin) instead of pysqlite
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    if Config.SQLITE_WAL:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    if Config.SQLITE_SYNCHRONOUS in SYNCHRONOUS_MODES:
+        cursor.execute(f"PRAGMA synchronous={Config.SQLITE_SYNCHRONOUS}")
+    # Negative cache_size is in KiB
+    cursor.execute(f"PRAGMA cache_size=-{int(Config.SQLITE_CACHE_SIZE_KB)}")
+    cursor.execute(f"PRAGMA mmap_size={int(Config.SQLITE_MMAP_SIZE)}")
+    cursor.execute(f"PRAGMA busy_timeout={int(Config.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+    # Built-in lower() only folds ASCII
+    dbapi_connection.create_function('lower', 1, _lower, deterministic=True)
+
+def _reads_deferred():
+    return has_request_context() and request.method not in WRITE_METHODS
+
+@event.listens_for(Engine, 'begin')
+def _begin(conn):
+    if conn.dialect.name != 'sqlite':
+        return
+    mode = conn.get_execution_options().get('sqlite_begin')
+    if mode is None:
+        mode = 'DEFERRED' if _reads_deferred() else 'IMMEDIATE'
+    conn.exec_driver_sql(f"BEGIN {mode}")
+
+def begin_write(session):
+    """
+    Run the session's next unit of work under BEGIN IMMEDIATE when it would
+    otherwise start DEFERRED (a GET request about to write). The read
+    transaction so far is ended first: upgrading it could fail at once with
+    "database is locked" if another writer committed since it began.
+    """
+    if not _reads_deferred():
+        return
+    if isinstance(session, scoped_session):
+        session = session()
+    bind = session.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+    if session.in_transaction():
+        session.commit()
+    session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
@@ -1,27 +1,17 @@
 #!/bin/sh
+set -e
 
-# Wait for DB to be fully ready
-echo "Waiting for PostgreSQL..."
-sleep 3
+export STARTUP_STARTED_AT="$(date +%s.%N)"
 
 # Ensure static folder exists and is writable
 mkdir -p /app/static
 chmod 777 /app/static
 
-# Initialize migrations folder if not exists
-if [ ! -d "migrations" ]; then
-    echo "Initializing migrations..."
-    flask db init
-fi
+# Wait for the database and apply migrations only when behind head.
+# Schema changes ship as committed revisions under migrations/versions.
+echo "Running startup checks..."
+python startup.py
 
-# Attempt to generate a migration for any schema changes
-echo "Generating migrations..."
-flask db migrate -m "Schema update"
-
-# Apply migrations
-echo "Applying migrations..."
-flask db upgrade
-
-# Start Gunicorn
+# Start Gunicorn (app is built once in the master, see gunicorn.conf.py)
 echo "Starting Server..."
-exec gunicorn --bind 0.0.0.0:5000 "app:create_app()"
+exec gunicorn -c gunicorn.conf.py "app:app"
@@ -0,0 +1,328 @@
+import json
+import queue
+import select
+import threading
+import time
+from datetime import datetime
+from flask import current_app, g, has_request_context
+from sqlalchemy import case, create_engine, event, func, inspect, text
+from sqlalchemy.pool import NullPool
+from sqlalchemy.orm import Session
+from extensions import db
+from models import Transaction, Budget, Category, User
+import metrics
+import shards
+import tasks
+
+# Server-sent events for budget and balance changes.
+#
+# Writes record what changed on the session (ORM changes automatically in
+# after_flush, bulk statements via emit() and emit_changes()). Once the
+# response has been sent,
+# the request thread turns them into small per-user events (transaction,
+# balance delta, budget threshold crossings), reading spend right after its
+# own commit, and publishes them through the backend: "local"
+# dispatches in-process (single worker, tests), "postgres" goes through
+# LISTEN/NOTIFY so every worker's SSE streams see every event.
+
+CHANNEL = 'finance_events'
+BUDGET_THRESHOLDS = (80, 100)
+TRACKED_FIELDS = ('amount', 'currency', 'type', 'category_id', 'date')
+
+class Broker:
+    """Per-worker fan-out from published events to the open SSE streams."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, user_id, limit=None):
+        """A queue receiving the user's events, or None if `limit` streams are already open."""
+        q = queue.Queue(maxsize=100)
+        with self._lock:
+            # Counted under the same lock as the add, so concurrent connects can't overshoot
+            if limit is not None and sum(len(s) for s in self._subscribers.values()) >= limit:
+                return None
+            self._subscribers.setdefault(user_id, set()).add(q)
+        metrics.inc('sse_subscriptions_total')
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def stream_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def dispatch(self, user_id, evt):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for q in subscribers:
+            try:
+                q.put_nowait(evt)
+            except queue.Full:
+                # Slow client: drop rather than block the publisher
+                metrics.inc('sse_events_dropped_total')
+
+broker = Broker()
+
+class LocalBackend:
+    def __init__(self, broker):
+        self.broker = broker
+
+    def start(self):
+        pass
+
+    def publish(self, user_id, evt):
+        self.broker.dispatch(user_id, evt)
+
+class PostgresBackend:
+    """Cross-worker delivery via NOTIFY; each worker runs one LISTEN thread."""
+
+    def __init__(self, broker, engine):
+        self.broker = broker
+        self.engine = engine
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._listen_forever, name='pg-listen', daemon=True).start()
+
+    def publish(self, user_id, evt):
+        payload = json.dumps({'u': user_id, 'e': evt})
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {'channel': CHANNEL, 'payload': payload})
+            conn.commit()
+
+    def _listen_forever(self):
+        import psycopg2
+
+        dsn = self.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        while True:
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f"LISTEN {CHANNEL}")
+                while True:
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        message = json.loads(notify.payload)
+                        self.broker.dispatch(message['u'], message['e'])
+            except Exception as e:
+                print(f"Event listener error: {e}")
+                metrics.inc('event_listener_errors_total')
+                time.sleep(1)
+
+def get_backend():
+    backend = current_app.extensions.get('events_backend')
+    if backend is None:
+        name = current_app.config['EVENTS_BACKEND']
+        if name == 'postgres':
+            engine = db.engine
+            if current_app.config['DATABASE_DIRECT_URL']:
+                engine = create_engine(current_app.config['DATABASE_DIRECT_URL'], poolclass=NullPool)
+            backend = PostgresBackend(broker, engine)
+        else:
+            backend = LocalBackend(broker)
+        current_app.extensions['events_backend'] = backend
+    return backend
+
+def publish(user_id, evt_type, data):
+    get_backend().publish(user_id, {'type': evt_type, 'data': data})
+    metrics.inc('events_published_total', type=evt_type)
+
+# --- Change capture -------------------------------------------------------
+
+def emit(user_id, evt_type, data):
+    """Queue an event on the current session; published only if it commits."""
+    db.session.info.setdefault('pending_events', []).append(('raw', int(user_id), evt_type, data))
+
+def emit_changes(user_id, changes):
+    """
+    Queue the balance and budget effects of a bulk write. `changes` is a list
+    of {'old': values, 'new': values} with the TRACKED_FIELDS, None for created
+    or deleted rows. No per-row transaction events are sent for these; the
+    caller emits one transactions_changed summary.
+    """
+    if changes:
+        db.session.info.setdefault('pending_events', []).append(('rows', int(user_id), None, changes))
+
+def values_of(row):
+    return {field: getattr(row, field) for field in TRACKED_FIELDS}
+
+def query_changes(query, new_values=None):
+    """
+    Changes for emit_changes() of a bulk UPDATE setting `new_values`, or of a
+    DELETE when None, over the transactions in `query`; call before running
+    it. Amounts are summed in SQL per type, currency, category and whether
+    the row is in the current month, which is all balances and budgets need.
+    """
+    now = datetime.utcnow()
+    month_start = datetime(now.year, now.month, 1)
+    month_end = datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+    in_month = case(((Transaction.date >= month_start) & (Transaction.date < month_end), 1), else_=0).label('in_month')
+    rows = query.with_entities(
+        Transaction.type, Transaction.currency, Transaction.category_id, in_month, func.sum(Transaction.amount)
+    ).order_by(None).group_by(Transaction.type, Transaction.currency, Transaction.category_id, in_month).all()
+
+    changes = []
+    for t_type, currency, category_id, current_month, amount in rows:
+        old = {'amount': amount or 0, 'currency': currency, 'type': t_type,
+               'category_id': category_id, 'date': now if current_month else None}
+        new = None if new_values is None else dict(old, **{k: v for k, v in new_values.items() if k in TRACKED_FIELDS})
+        changes.append({'old': old, 'new': new})
+    return changes
+
+def _snapshot(obj, state, use_old):
+    values = {}
+    for field in TRACKED_FIELDS:
+        attr = state.attrs[field]
+        if use_old and attr.history.deleted:
+            values[field] = attr.history.deleted[0]
+        else:
+            values[field] = getattr(obj, field)
+    return values
+
+@event.listens_for(Session, 'after_flush')
+def _capture_transaction_changes(session, flush_context):
+    pending = session.info.setdefault('pending_events', [])
+    for obj in session.new:
+        if isinstance(obj, Transaction):
+            pending.append(('txn', int(obj.user_id), 'created', {'id': obj.id, 'old': None, 'new': _snapshot(obj, inspect(obj), False)}))
+    for obj in session.dirty:
+        if isinstance(obj, Transaction) and session.is_modified(obj, include_collections=False):
+            state = inspect(obj)
+            pending.append(('txn', int(obj.user_id), 'updated', {'id': obj.id, 'old': _snapshot(obj, state, True), 'new': _snapshot(obj, state, False)}))
+    for obj in session.deleted:
+        if isinstance(obj, Transaction):
+            pending.append(('txn', int(obj.user_id), 'deleted', {'id': obj.id, 'old': _snapshot(obj, inspect(obj), True), 'new': None}))
+
+@event.listens_for(Session, 'after_commit')
+def _publish_after_commit(session):
+    pending = session.info.pop('pending_events', None)
+    if not pending:
+        return
+    if has_request_context():
+        g.setdefault('committed_events', []).extend(pending)
+        return
+    try:
+        app = current_app._get_current_object()
+    except RuntimeError:
+        return
+    tasks.submit_with_app(app, process_changes, pending)
+
+def init_app(app):
+    @app.after_request
+    def _process_after_response(response):
+        pending = g.pop('committed_events', None)
+        if pending:
+            def run():
+                with app.app_context():
+                    try:
+                        process_changes(pending)
+                    except Exception as e:
+                        print(f"Event processing error: {e}")
+                    finally:
+                        db.session.remove()
+            response.call_on_close(run)
+        return response
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('pending_events', None)
+
+# --- Event derivation ------------------------------------------------------
+
+def _in_current_month(values, now):
+    d = values['date']
+    return d is not None and d.year == now.year and d.month == now.month
+
+def process_changes(pending):
+    from routes.budgets import budget_category_ids, month_spent
+    from routes.currencies import get_conversion_rate
+
+    by_user = {}
+    for item in pending:
+        by_user.setdefault(item[1], []).append(item)
+
+    now = datetime.utcnow()
+    for user_id, items in by_user.items():
+        shards.use(user_id)
+        user = User.query.get(user_id)
+        if not user:
+            continue
+        base_currency = user.base_currency or 'RUB'
+        rate_cache = {}
+
+        def to_base(values):
+            if values['currency'] == base_currency:
+                return values['amount']
+            k = f"{values['currency']}_{base_currency}"
+            if k not in rate_cache:
+                rate_cache[k] = get_conversion_rate(values['currency'], base_currency)
+            return values['amount'] * rate_cache[k]
+
+        balance_delta = 0
+        month_expense_delta = {}  # category_id -> current-month expense change
+        for kind, _, op, data in items:
+            if kind == 'raw':
+                publish(user_id, op, data)
+                continue
+            if kind == 'txn':
+                publish(user_id, 'transaction', {'op': op, 'id': data['id']})
+                changes = (data,)
+            else:
+                changes = data
+            for change in changes:
+                for values, sign in ((change['old'], -1), (change['new'], 1)):
+                    if values is None:
+                        continue
+                    amount = to_base(values)
+                    balance_delta += sign * (amount if values['type'] == 'income' else -amount)
+                    if values['type'] == 'expense' and _in_current_month(values, now):
+                        cat_id = int(values['category_id'])
+                        month_expense_delta[cat_id] = month_expense_delta.get(cat_id, 0) + sign * amount
+
+        if balance_delta:
+            publish(user_id, 'balance', {'delta': round(balance_delta, 2), 'currency': base_currency})
+
+        if not month_expense_delta:
+            continue
+        # Budgets cover their category and its direct children
+        parents = {c.parent_id for c in Category.query.filter(Category.id.in_(month_expense_delta)) if c.parent_id}
+        budgets = Budget.query.filter(
+            Budget.user_id == user_id, Budget.archived == False,
+            Budget.category_id.in_(set(month_expense_delta) | parents)
+        ).all()
+        for b in budgets:
+            if b.amount_limit <= 0:
+                continue
+            cat_ids = budget_category_ids(b.category_id)
+            delta = sum(month_expense_delta.get(c, 0) for c in cat_ids)
+            if not delta:
+                continue
+            spent = month_spent(user_id, cat_ids, base_currency, rate_cache, now)
+            before = (spent - delta) / b.amount_limit * 100
+            after = spent / b.amount_limit * 100
+            for threshold in BUDGET_THRESHOLDS:
+                if before < threshold <= after:
+                    publish(user_id, 'budget', {
+                        'budget_id': b.id,
+                        'category_id': b.category_id,
+                        'threshold': threshold,
+                        'percentage': round(after, 1),
+                        'spent': round(spent, 2),
+                        'limit': b.amount_limit,
+                    })
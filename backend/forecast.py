@@ -0,0 +1,130 @@
+"""
+Cash-flow forecast from a user's monthly history.
+
+Works on aggregated monthly series (category x income/expense x month)
+built from the columnar engine's cached columns, never on raw rows:
+
+- a series is *recurring* when it was present in each of the last
+  RECURRING_MONTHS months with little variation (rent, salary,
+  subscriptions); its level is the recent median;
+- for everything else the level is the trailing 12-month mean;
+- once there are two full years of history, the level is scaled by a
+  per-calendar-month seasonal index.
+
+Results are cached per worker, keyed by the user's data version
+(User.sync_version), base currency and horizon.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+import numpy as np
+import balances
+import columnar
+
+RECURRING_MONTHS = 3
+RECURRING_MAX_CV = 0.2
+TRAILING_MONTHS = 12
+CACHE_SIZE = 256
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+def month_number(d):
+    return d.year * 12 + d.month - 1
+
+def month_date(n):
+    return date(n // 12, n % 12 + 1, 1)
+
+def monthly_series(cols, values, first, last):
+    """
+    (series keys, matrix) with one row per (category index, is_income) seen
+    in months [first, last) and one column per month, in base currency.
+    """
+    months = columnar.month_numbers(cols.day)
+    mask = (months >= first) & (months < last)
+    n_months = last - first
+    n_series = len(cols.category_ids) * 2
+    series = cols.category[mask].astype(np.int64) * 2 + cols.income[mask]
+    flat = series * n_months + (months[mask] - first)
+    matrix = np.bincount(flat, weights=values[mask], minlength=n_series * n_months).reshape(n_series, n_months)
+    present = np.flatnonzero(matrix.any(axis=1))
+    return present, matrix[present]
+
+def project(matrix, first, target_months):
+    """(forecast matrix series x target months, recurring flags) from a history starting at month `first`."""
+    n_series, history = matrix.shape
+
+    recent = matrix[:, -RECURRING_MONTHS:]
+    recurring = np.zeros(n_series, dtype=bool)
+    if history >= RECURRING_MONTHS:
+        mean = recent.mean(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cv = recent.std(axis=1) / mean
+        recurring = (recent > 0).all(axis=1) & (cv <= RECURRING_MAX_CV)
+    level = np.median(recent, axis=1) if history else np.zeros(n_series)
+
+    trailing = matrix[:, -TRAILING_MONTHS:].mean(axis=1) if history else np.zeros(n_series)
+    seasonal = np.ones((n_series, 12))
+    full_years = history // 12
+    if full_years >= 2:
+        # Last whole years only, so every calendar month has the same weight
+        span = matrix[:, history - full_years * 12:]
+        calendar = (np.arange(history - full_years * 12, history) + first) % 12
+        by_calendar = np.zeros((n_series, 12))
+        for c in range(12):
+            by_calendar[:, c] = span[:, calendar == c].mean(axis=1)
+        overall = span.mean(axis=1, keepdims=True)
+        seasonal = np.divide(by_calendar, overall, out=np.ones_like(by_calendar), where=overall > 0)
+
+    # Recurring series keep their recent level, the rest their trailing mean;
+    # both follow the seasonal pattern (a flat 1 for non-seasonal series)
+    base = np.where(recurring, level, trailing)
+    projected = base[:, None] * seasonal[:, np.asarray(target_months) % 12]
+    return projected, recurring
+
+def compute(user_id, base_currency, horizon, now=None):
+    cols = columnar.load(user_id)
+    # History runs up to the last complete month; the forecast starts next
+    # month, from today's balance. The month is part of the key: a cached
+    # forecast would otherwise keep its old months after the turn of a month
+    current = month_number(now or datetime.utcnow())
+    key = (cols.version, base_currency, horizon, current)
+    with _lock:
+        cached = _cache.get(user_id)
+        if cached and cached[0] == key:
+            _cache.move_to_end(user_id)
+            return cached[1]
+
+    rate_cache = {}
+    values = columnar.in_base(cols, base_currency, rate_cache)
+    oldest = cols.dated_from()
+    first = min(month_number(columnar.from_day(cols.day[oldest])), current) if oldest < len(cols) else current
+    present, matrix = monthly_series(cols, values, first, current)
+    targets = np.arange(current + 1, current + 1 + horizon)
+    projected, recurring = project(matrix, first, targets)
+
+    is_income = (present % 2).astype(bool)
+    income = projected[is_income].sum(axis=0)
+    expense = projected[~is_income].sum(axis=0)
+    balance = balances.balance_in_base(user_id, base_currency, rate_cache) + np.cumsum(income - expense)
+
+    result = {
+        "months": [
+            {"key": month_date(int(targets[k])).isoformat(), "income": round(float(income[k]), 2),
+             "expense": round(float(expense[k]), 2), "net": round(float(income[k] - expense[k]), 2),
+             "balance": round(float(balance[k]), 2)}
+            for k in range(horizon)
+        ],
+        "categories": [
+            {"category_id": cols.category_ids[int(s) // 2], "type": 'income' if s % 2 else 'expense',
+             "recurring": bool(recurring[i]), "values": [round(float(v), 2) for v in projected[i]]}
+            for i, s in enumerate(present)
+        ],
+        "history_months": int(current - first),
+    }
+    with _lock:
+        _cache[user_id] = (key, result)
+        _cache.move_to_end(user_id)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
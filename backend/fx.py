@@ -0,0 +1,225 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import date
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+import metrics
+
+# Remote exchange-rate provider calls.
+#
+# All calls go through one requests.Session per worker, so connections
+# (and TLS sessions) to the providers are kept alive between requests.
+# Fetching the history of several pairs runs the calls concurrently on a
+# small per-worker pool (FX_FETCH_WORKERS), so N pairs cost about one
+# round trip instead of N. Functions here never touch the database and
+# can run outside the app context; results are stored by the caller.
+#
+# Each provider sits behind a circuit breaker: FX_BREAKER_FAILURES failed
+# calls in a row (errors, timeouts, 5xx/429) open it, and for
+# FX_BREAKER_OPEN_SECONDS every call is answered "unavailable" at once
+# without touching the network. After that one trial call is let through;
+# success closes the breaker, failure opens it again. Answers are cached:
+# latest rates per base for FX_RATES_TTL, and failures or currencies the
+# provider doesn't know for FX_NEGATIVE_TTL, so an unknown pair costs one
+# call per TTL, not one per request. Concurrent lookups of the same base
+# share one call, and callers wait for it at most FX_WAIT_SECONDS (the
+# call carries on and fills the cache for the next request). Breakers and
+# caches are per worker. Provider URLs are settings, so tests can point
+# them at a local fake server.
+
+RATES_PROVIDER = 'er-api'
+HISTORY_PROVIDER = 'frankfurter'
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._trial = False
+
+    def allow(self, reset_after):
+        """Whether a call may go out now (claims the single trial call when half-open)."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= reset_after:
+                self._set(HALF_OPEN)
+                self._trial = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record(self, ok, threshold):
+        with self._lock:
+            if ok:
+                self.failures = 0
+                if self.state != CLOSED:
+                    self._set(CLOSED)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= threshold:
+                self.opened_at = time.monotonic()
+                if self.state != OPEN:
+                    self._set(OPEN)
+
+    def _set(self, state):
+        self.state = state
+        metrics.inc('fx_breaker_transitions_total', provider=self.name, state=state)
+        metrics.set_gauge('fx_breaker_open', 0 if state == CLOSED else 1, provider=self.name)
+
+_lock = threading.Lock()
+_session = None
+_pool = None
+_pid = None
+_config = None
+_breakers = {}
+_cache = {}
+_inflight = {}
+_MISSING = object()
+
+def _get():
+    global _session, _pool, _pid, _config, _breakers, _cache, _inflight
+    # Threads and sockets don't survive fork, so everything is created lazily per worker
+    if _pid != os.getpid():
+        with _lock:
+            if _pid != os.getpid():
+                _config = current_app.config
+                workers = _config['FX_FETCH_WORKERS']
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+                _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fx')
+                _breakers = {name: CircuitBreaker(name) for name in (RATES_PROVIDER, HISTORY_PROVIDER)}
+                _cache = {}
+                _inflight = {}
+                _pid = os.getpid()
+    return _session, _pool
+
+def breaker(provider):
+    _get()
+    return _breakers[provider]
+
+def get_json(provider, url):
+    """
+    GET `url` from `provider` through its breaker. Returns (status, body)
+    for any HTTP answer the provider gave, or None if the call failed or
+    was short-circuited.
+    """
+    session, _ = _get()
+    cb = _breakers[provider]
+    if not cb.allow(_config['FX_BREAKER_OPEN_SECONDS']):
+        metrics.inc('fx_requests_total', provider=provider, result='short_circuit')
+        return None
+
+    started = time.perf_counter()
+    try:
+        resp = session.get(url, timeout=_config['FX_TIMEOUT'])
+        status = resp.status_code
+        body = resp.json() if status == 200 else None
+    except Exception as e:
+        print(f"FX provider {provider} error: {e}")
+        cb.record(False, _config['FX_BREAKER_FAILURES'])
+        metrics.inc('fx_requests_total', provider=provider, result='timeout' if isinstance(e, requests.Timeout) else 'error')
+        return None
+    finally:
+        metrics.inc('fx_request_seconds_total', time.perf_counter() - started, provider=provider)
+
+    # 4xx other than 429 is about the request (unknown currency), not the provider's health
+    healthy = status < 500 and status != 429
+    cb.record(healthy, _config['FX_BREAKER_FAILURES'])
+    metrics.inc('fx_requests_total', provider=provider, result=str(status))
+    return (status, body) if healthy else None
+
+def _cached(key):
+    with _lock:
+        entry = _cache.get(key)
+    if entry is None or entry[0] <= time.monotonic():
+        return _MISSING
+    return entry[1]
+
+def _remember(key, value):
+    ttl = _config['FX_RATES_TTL'] if value is not None else _config['FX_NEGATIVE_TTL']
+    with _lock:
+        _cache[key] = (time.monotonic() + ttl, value)
+        # Opportunistic cleanup of expired entries
+        if len(_cache) > 1000:
+            now = time.monotonic()
+            for stale in [k for k, (expires, _) in _cache.items() if expires <= now]:
+                del _cache[stale]
+
+def _single_flight(key, fn):
+    """Run fn on the pool, shared by concurrent callers with the same key; None if it outlasts FX_WAIT_SECONDS."""
+    _, pool = _get()
+    with _lock:
+        future = _inflight.get(key)
+        if future is None:
+            future = pool.submit(fn)
+            _inflight[key] = future
+            future.add_done_callback(lambda f: _inflight.pop(key, None))
+    try:
+        return future.result(timeout=_config['FX_WAIT_SECONDS'])
+    except FutureTimeout:
+        metrics.inc('fx_wait_timeouts_total')
+        return None
+
+def _load_latest(base):
+    answer = get_json(RATES_PROVIDER, _config['FX_RATES_URL'].format(base=base))
+    rates = None
+    if answer and answer[1]:
+        rates = answer[1].get('rates') or None
+    _remember(('latest', base), rates)
+    return rates
+
+def latest_rates(base):
+    """{target: rate} from the latest-rates provider for `base`, None if unavailable or unknown."""
+    _get()
+    key = ('latest', base)
+    rates = _cached(key)
+    if rates is not _MISSING:
+        metrics.inc('fx_cache_total', result='hit' if rates is not None else 'negative_hit')
+        return rates
+    metrics.inc('fx_cache_total', result='miss')
+    return _single_flight(key, lambda: _load_latest(base))
+
+def latest_rate(source, target):
+    """source->target from the provider (direct, then the inverse of target's rates), None if unknown."""
+    rate = (latest_rates(source) or {}).get(target)
+    if rate:
+        return rate
+    inverse = (latest_rates(target) or {}).get(source)
+    if inverse and inverse > 0:
+        return 1.0 / inverse
+    return None
+
+def fetch_history(base, target, start, end):
+    """Daily base->target rates between two dates as [(date, rate)] oldest first, None if unavailable."""
+    _get()
+    key = ('history', base, target, start, end)
+    if _cached(key) is None:
+        # The provider recently failed or doesn't know this pair
+        metrics.inc('fx_cache_total', result='negative_hit')
+        return None
+    url = _config['FX_HISTORY_URL'].format(start=start.isoformat(), end=end.isoformat(), base=base, target=target)
+    answer = get_json(HISTORY_PROVIDER, url)
+    rates = answer[1].get('rates', {}) if answer and answer[1] else {}
+    points = sorted((date.fromisoformat(day), values[target]) for day, values in rates.items() if values.get(target))
+    if not points:
+        _remember(key, None)
+        return None
+    return points
+
+def fetch_histories(base, targets, start, end):
+    """{target: fetch_history(...)} for several targets, fetched concurrently."""
+    _, pool = _get()
+    futures = {target: pool.submit(fetch_history, base, target, start, end) for target in targets}
+    return {target: future.result() for target, future in futures.items()}
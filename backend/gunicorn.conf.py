@@ -0,0 +1,29 @@
+import gc
+import os
+import time
+
+import metrics
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+# Threads let long-lived SSE streams (/api/events/stream) coexist with
+# regular requests in the same worker; each stream holds one thread, so
+# config.py caps streams per worker below this thread count
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Build the app once in the master; workers share it copy-on-write.
+preload_app = True
+
+def when_ready(server):
+    # Move everything allocated during import/app setup to the permanent
+    # generation so the collector never touches (and un-shares) those pages
+    # in forked workers.
+    gc.collect()
+    gc.freeze()
+
+    container_started = os.environ.get('STARTUP_STARTED_AT')
+    if container_started:
+        elapsed = time.time() - float(container_started)
+        metrics.set_gauge('app_startup_seconds', round(elapsed, 3))
+        server.log.info(f"Startup completed in {elapsed:.3f}s")
@@ -0,0 +1,61 @@
+from datetime import date, datetime, timezone
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON encoding for jsonify() and every API response.
+#
+# With orjson installed (JSON_PROVIDER=auto or orjson) responses are
+# serialized by OrjsonProvider, several times faster than the stdlib on
+# the big transaction lists and analytics payloads; otherwise (or with
+# JSON_PROVIDER=stdlib) IsoJSONProvider. Both write datetimes the same
+# way, as ISO 8601 with naive values treated as UTC
+# ("2026-10-01T12:30:00+00:00"), so output does not depend on what is
+# installed. Parsing request bodies is unchanged.
+
+def _datetime_iso(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+class IsoJSONProvider(DefaultJSONProvider):
+    """Flask's stdlib provider, with ISO 8601 dates instead of HTTP dates."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, datetime):
+            return _datetime_iso(o)
+        if isinstance(o, date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+class OrjsonProvider(IsoJSONProvider):
+    """orjson for dumps/response; anything orjson can't encode natively (Decimal, ...) goes through default()."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # json.dumps-style arguments (indent, cls, ...) only the stdlib understands
+            return super().dumps(obj, **kwargs)
+        return self._dumpb(obj).decode()
+
+    def _dumpb(self, obj):
+        option = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if self._app.debug and self.compact is None or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumpb(obj) + b"\n", mimetype=self.mimetype)
+
+def init_app(app):
+    choice = app.config['JSON_PROVIDER']
+    if choice == 'orjson' and orjson is None:
+        print("JSON_PROVIDER=orjson but orjson is not installed, using the stdlib encoder")
+    provider_class = OrjsonProvider if orjson is not None and choice in ('auto', 'orjson') else IsoJSONProvider
+    app.json = provider_class(app)
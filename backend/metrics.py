@@ -0,0 +1,44 @@
+import threading
+
+# Minimal in-process metrics registry, rendered in Prometheus text format
+# by the /api/metrics route. Values set in the gunicorn master before fork
+# (e.g. startup time) are inherited by every worker.
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def get(name, **labels):
+    key = _key(name, labels)
+    with _lock:
+        return _counters.get(key, _gauges.get(key))
+
+def _format(name, labels, value):
+    if labels:
+        label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+        return f"{name}{{{label_str}}} {value}"
+    return f"{name} {value}"
+
+def render():
+    lines = []
+    with _lock:
+        for kind, store in (('counter', _counters), ('gauge', _gauges)):
+            seen = set()
+            for (name, labels), value in sorted(store.items(), key=lambda kv: kv[0]):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} {kind}")
+                    seen.add(name)
+                lines.append(_format(name, labels, value))
+    return "\n".join(lines) + "\n"
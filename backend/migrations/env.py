@@ -2,6 +2,8 @@ import logging
 from logging.config import fileConfig
 
 from flask import current_app
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
 
 from alembic import context
 
@@ -15,7 +17,14 @@ fileConfig(config.config_file_name)
 logger = logging.getLogger('alembic.env')
 
 
+# `flask db upgrade -x url=...` migrates another database with the same
+# schema, e.g. a user shard (see shards.py and startup.py)
+override_url = context.get_x_argument(as_dictionary=True).get('url')
+
+
 def get_engine():
+    if override_url:
+        return create_engine(override_url, poolclass=NullPool)
     try:
         # this works with Flask-SQLAlchemy<3 and Alchemical
         return current_app.extensions['migrate'].db.get_engine()
@@ -90,9 +99,20 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # Date partitions of transaction (and their index) are managed by
+    # partitions.py, not by the models; keep autogenerate from dropping them
+    def include_name(name, type_, parent_names):
+        if type_ == 'table':
+            return not name.startswith('transaction_')
+        if type_ == 'index':
+            return name != 'ix_transaction_user_date'
+        return True
+
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_name") is None:
+        conf_args["include_name"] = include_name
 
     connectable = get_engine()
 
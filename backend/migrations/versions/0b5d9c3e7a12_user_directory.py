@@ -0,0 +1,45 @@
+"""User directory and sync floor
+
+Revision ID: 0b5d9c3e7a12
+Revises: f3a7d1c9e285
+Create Date: 2026-10-19 19:12:40.518304
+
+Existing users are registered in the directory on the default shard.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b5d9c3e7a12'
+down_revision = 'f3a7d1c9e285'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_directory',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.String(length=120), nullable=False),
+    sa.Column('shard', sa.String(length=32), server_default='default', nullable=False),
+    sa.Column('status', sa.String(length=16), server_default='active', nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email')
+    )
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sync_floor', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute('INSERT INTO user_directory (id, email) SELECT id, email FROM "user"')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "SELECT setval(pg_get_serial_sequence('user_directory', 'id'), "
+            "COALESCE((SELECT max(id) FROM user_directory), 0) + 1, false)"
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('sync_floor')
+
+    op.drop_table('user_directory')
@@ -16,9 +16,13 @@ branch_labels = None
 depends_on = None
 
 
+# SQLite reflects the foreign keys without names; name them the way Postgres did
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+
 def upgrade():
     # ### commands auto generated by Alembic - please adjust! ###
-    with op.batch_alter_table('exchange_rate', schema=None) as batch_op:
+    with op.batch_alter_table('exchange_rate', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
         batch_op.add_column(sa.Column('is_manual', sa.Boolean(), nullable=True))
         batch_op.drop_constraint(batch_op.f('exchange_rate_target_currency_fkey'), type_='foreignkey')
         batch_op.drop_constraint(batch_op.f('exchange_rate_base_currency_fkey'), type_='foreignkey')
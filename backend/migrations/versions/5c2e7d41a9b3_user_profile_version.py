@@ -0,0 +1,26 @@
+"""User profile version
+
+Revision ID: 5c2e7d41a9b3
+Revises: 1a15eb10b20a
+Create Date: 2026-10-19 10:12:41.532018
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e7d41a9b3'
+down_revision = '1a15eb10b20a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('profile_version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('profile_version')
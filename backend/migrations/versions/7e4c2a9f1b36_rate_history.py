@@ -0,0 +1,32 @@
+"""Stored daily rate history
+
+Revision ID: 7e4c2a9f1b36
+Revises: 0b5d9c3e7a12
+Create Date: 2026-10-19 21:04:17.662913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e4c2a9f1b36'
+down_revision = '0b5d9c3e7a12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rate_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('base_currency', sa.String(length=3), nullable=False),
+    sa.Column('target_currency', sa.String(length=3), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('rate', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('base_currency', 'target_currency', 'date', name='uq_rate_history_pair_date')
+    )
+
+
+def downgrade():
+    op.drop_table('rate_history')
@@ -0,0 +1,34 @@
+"""Balance checkpoints
+
+Revision ID: d9e3b5a7c104
+Revises: b71e3c9d5f20
+Create Date: 2026-10-19 16:20:37.905512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9e3b5a7c104'
+down_revision = 'b71e3c9d5f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('balance_checkpoint',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('period_end', sa.DateTime(), nullable=False),
+    sa.Column('income', sa.Float(), nullable=False),
+    sa.Column('expense', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'period_end', 'currency', name='uq_balance_checkpoint_user_period')
+    )
+
+
+def downgrade():
+    op.drop_table('balance_checkpoint')
@@ -0,0 +1,38 @@
+"""Stored base-currency amount of transactions
+
+Revision ID: e2b6c8d4f913
+Revises: d9e3b5a7c104
+Create Date: 2026-10-19 17:03:48.221760
+
+Rows already in their owner's base currency are filled in here; the rest
+stay NULL (converted on read) until `python valuation.py` revalues them.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b6c8d4f913'
+down_revision = 'd9e3b5a7c104'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('amount_in_base', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('base_rate', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('base_currency', sa.String(length=3), nullable=True))
+
+    op.execute(
+        'UPDATE "transaction" SET amount_in_base = amount, base_rate = 1, base_currency = currency '
+        'WHERE currency = (SELECT base_currency FROM "user" WHERE "user".id = "transaction".user_id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_column('base_currency')
+        batch_op.drop_column('base_rate')
+        batch_op.drop_column('amount_in_base')
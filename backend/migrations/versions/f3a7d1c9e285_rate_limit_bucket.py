@@ -0,0 +1,32 @@
+"""Rate limit buckets
+
+Revision ID: f3a7d1c9e285
+Revises: e2b6c8d4f913
+Create Date: 2026-10-19 18:05:12.430981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a7d1c9e285'
+down_revision = 'e2b6c8d4f913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rate_limit_bucket',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('tokens', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    # Limiter state is disposable: skip the WAL, it is rewritten on every guarded request
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE rate_limit_bucket SET UNLOGGED')
+
+
+def downgrade():
+    op.drop_table('rate_limit_bucket')
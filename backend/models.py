@@ -8,6 +8,11 @@ class User(db.Model):
     name = db.Column(db.String(80), nullable=True)
     avatar = db.Column(db.String(256), nullable=True)
     base_currency = db.Column(db.String(3), default='RUB')
+    profile_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Last row version handed out for delta sync (see sync.py)
+    sync_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Sync tokens below this need a full re-sync (row ids changed, e.g. moved to another shard)
+    sync_floor = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     transactions = db.relationship('Transaction', backref='user', lazy=True)
@@ -27,6 +32,16 @@ class ExchangeRate(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_manual = db.Column(db.Boolean, default=False)
 
+class RateHistory(db.Model):
+    # Daily provider rates behind the currency history charts (see routes/currencies.py)
+    id = db.Column(db.Integer, primary_key=True)
+    base_currency = db.Column(db.String(3), nullable=False)
+    target_currency = db.Column(db.String(3), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    rate = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('base_currency', 'target_currency', 'date', name='uq_rate_history_pair_date'),)
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
@@ -35,11 +50,15 @@ class Category(db.Model):
     icon = db.Column(db.String(50), default='Circle')
     parent_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     children = db.relationship('Category', backref=db.backref('parent', remote_side=[id]), lazy=True)
     transactions = db.relationship('Transaction', backref='category', lazy=True)
     budgets = db.relationship('Budget', backref='category', lazy=True)
 
+    __table_args__ = (db.Index('ix_category_user_version', 'user_id', 'version'),)
+
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Float, nullable=False)
@@ -51,6 +70,14 @@ class Transaction(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     attachment = db.Column(db.String(256), nullable=True)
     tags = db.Column(db.String(256), nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Amount in the owner's base currency at write/revaluation time (see valuation.py)
+    amount_in_base = db.Column(db.Float, nullable=True)
+    base_rate = db.Column(db.Float, nullable=True)
+    base_currency = db.Column(db.String(3), nullable=True)
+
+    __table_args__ = (db.Index('ix_transaction_user_version', 'user_id', 'version'),)
 
 class Budget(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -60,4 +87,51 @@ class Budget(db.Model):
     start_date = db.Column(db.DateTime, nullable=True)
     end_date = db.Column(db.DateTime, nullable=True)
     archived = db.Column(db.Boolean, default=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
\ No newline at end of file
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_budget_user_version', 'user_id', 'version'),)
+
+class StoredFile(db.Model):
+    # Content-addressed upload blob: key is "<sha256>.<ext>"
+    key = db.Column(db.String(80), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Tombstone(db.Model):
+    # Deleted synced rows, so delta sync can tell clients what to drop
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    entity = db.Column(db.String(20), nullable=False)  # 'transaction', 'category', 'budget'
+    entity_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_tombstone_user_version', 'user_id', 'version'),)
+
+class BalanceCheckpoint(db.Model):
+    # Income/expense totals of everything dated before period_end, per currency (see balances.py)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    currency = db.Column(db.String(3), nullable=False)
+    period_end = db.Column(db.DateTime, nullable=False)
+    income = db.Column(db.Float, nullable=False, default=0)
+    expense = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'period_end', 'currency', name='uq_balance_checkpoint_user_period'),)
+
+class RateLimitBucket(db.Model):
+    # Token buckets shared by all workers (see ratelimit.py); UNLOGGED on Postgres
+    key = db.Column(db.String(64), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+class UserDirectory(db.Model):
+    # Global user id/email -> shard map on the default database (see shards.py)
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    shard = db.Column(db.String(32), nullable=False, default='default', server_default='default')
+    status = db.Column(db.String(16), nullable=False, default='active', server_default='active')
@@ -0,0 +1,259 @@
+"""
+Optional range partitioning of the transaction table by date (Postgres only).
+
+A partitioned table is a parent with one child per year or month, plus a
+DEFAULT partition that catches anything outside the created ranges, so
+inserts never fail.
+
+Converting is a command of its own rather than a migration. It copies
+every row into a new table while holding an exclusive lock, so reads and
+writes of transactions wait for as long as the copy takes; an operator
+should pick when that happens. Migrations, by contrast, run on their own
+at every container start. Tying the layout to TRANSACTION_PARTITIONING at
+migration time would also let the same revision leave different layouts
+behind on different databases, depending on what the variable happened to
+be when each one was upgraded. The commands are:
+
+    python partitions.py status
+    python partitions.py convert [year|month]   (default: TRANSACTION_PARTITIONING)
+    python partitions.py unconvert
+    python partitions.py                        (create upcoming partitions; cron)
+
+Each command runs against the default database and every shard in
+SHARD_URLS, and is idempotent: convert leaves a table that is already
+partitioned alone, and unconvert leaves a plain table alone. The layout in
+place is read back from the catalog (the partition names carry the
+granularity), never from the environment. Partitions for the next
+TRANSACTION_PARTITIONS_AHEAD periods are created on every container start
+(see startup.py), which also warns when TRANSACTION_PARTITIONING asks for a
+layout the table doesn't have. Rows that landed in the default partition
+move into their partition when it is created.
+
+Queries only benefit when they filter on a date range
+(`date >= start AND date < end`); extract()-style filters scan every
+partition. SQLite keeps the single table.
+"""
+import os
+import sys
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+GRANULARITIES = ('year', 'month')
+PARENT = 'transaction'
+DEFAULT_PARTITION = 'transaction_default'
+
+def get_granularity():
+    granularity = os.environ.get('TRANSACTION_PARTITIONING', '').strip().lower()
+    return granularity if granularity in GRANULARITIES else None
+
+def get_periods_ahead():
+    return int(os.environ.get('TRANSACTION_PARTITIONS_AHEAD', 3))
+
+def is_supported(conn):
+    return conn.dialect.name == 'postgresql'
+
+def is_partitioned(conn):
+    if not is_supported(conn):
+        return False
+    return bool(conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {'name': PARENT}).scalar())
+
+def existing_partitions(conn):
+    return set(conn.execute(text(
+        "SELECT child.relname FROM pg_inherits i "
+        "JOIN pg_class parent ON parent.oid = i.inhparent "
+        "JOIN pg_class child ON child.oid = i.inhrelid "
+        "WHERE parent.relname = :name AND pg_table_is_visible(parent.oid)"
+    ), {'name': PARENT}).scalars())
+
+def layout(conn):
+    """'year' or 'month' when the table is partitioned, None for the plain table."""
+    if not is_partitioned(conn):
+        return None
+    names = existing_partitions(conn)
+    for granularity, prefix in (('month', 'transaction_m'), ('year', 'transaction_y')):
+        if any(name.startswith(prefix) for name in names):
+            return granularity
+    return get_granularity()
+
+def period_start(d, granularity):
+    return date(d.year, 1, 1) if granularity == 'year' else date(d.year, d.month, 1)
+
+def next_period(d, granularity):
+    if granularity == 'year':
+        return date(d.year + 1, 1, 1)
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+def partition_name(start, granularity):
+    if granularity == 'year':
+        return f"transaction_y{start.year}"
+    return f"transaction_m{start.year}_{start.month:02d}"
+
+def partition_ranges(first, last, granularity):
+    """(name, start, end) for every period from the one containing `first` through the one containing `last`."""
+    start = period_start(first, granularity)
+    while start <= last:
+        end = next_period(start, granularity)
+        yield partition_name(start, granularity), start, end
+        start = end
+
+def _create_partition(conn, name, start, end):
+    # Bounds are dates we computed, never user input
+    conn.execute(text(f'CREATE TABLE {name} (LIKE "{PARENT}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    # LIKE copies the parent's column order, so whole rows move as they are
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE date >= '{start}' AND date < '{end}' RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ))
+    conn.execute(text(f"ALTER TABLE \"{PARENT}\" ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+
+def ensure_partitions(conn, granularity, ahead, since=None):
+    """Create missing partitions from `since` (default: today) through `ahead` periods from now."""
+    today = datetime.utcnow().date()
+    last = today
+    for _ in range(ahead):
+        last = next_period(period_start(last, granularity), granularity)
+    existing = existing_partitions(conn)
+    created = []
+    for name, start, end in partition_ranges(min(since or today, today), last, granularity):
+        if name not in existing:
+            _create_partition(conn, name, start, end)
+            created.append(name)
+    return created
+
+def _indexes(conn, table):
+    """(name, unique, "USING ... (columns)") of the table's indexes other than the primary key."""
+    return conn.execute(text(
+        "SELECT i.relname, x.indisunique, substring(pg_get_indexdef(i.oid) from ' USING .*$') "
+        "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+        "WHERE x.indrelid = CAST(:table AS regclass) AND NOT x.indisprimary ORDER BY i.relname"
+    ), {'table': table}).all()
+
+def _foreign_keys(conn, table):
+    return conn.execute(text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = CAST(:table AS regclass) AND contype = 'f' ORDER BY conname"
+    ), {'table': table}).all()
+
+def _rebuild(conn, old_name, partition_clause, primary_key, skip_indexes=()):
+    """
+    Rename the transaction table to `old_name` and create a new one in its
+    place with the same columns, defaults, foreign keys and indexes (LIKE
+    copies whatever later migrations added). The caller copies the rows over
+    and drops `old_name`.
+    """
+    conn.execute(text(f'ALTER TABLE "{PARENT}" RENAME TO {old_name}'))
+    conn.execute(text(f'ALTER TABLE {old_name} RENAME CONSTRAINT transaction_pkey TO {old_name}_pkey'))
+    indexes = _indexes(conn, old_name)
+    for name, _, _ in indexes:
+        # Index names are per schema; the old ones go with the old table anyway
+        conn.execute(text(f'DROP INDEX {name}'))
+    conn.execute(text('ALTER SEQUENCE transaction_id_seq OWNED BY NONE'))
+
+    conn.execute(text(
+        f'CREATE TABLE "{PARENT}" (LIKE {old_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS){partition_clause}'
+    ))
+    conn.execute(text(f'ALTER TABLE "{PARENT}" ADD CONSTRAINT transaction_pkey PRIMARY KEY ({primary_key})'))
+    for name, definition in _foreign_keys(conn, old_name):
+        conn.execute(text(f'ALTER TABLE "{PARENT}" ADD CONSTRAINT {name} {definition}'))
+    for name, unique, using in indexes:
+        if name not in skip_indexes:
+            conn.execute(text(f'CREATE {"UNIQUE " if unique else ""}INDEX {name} ON "{PARENT}" {using}'))
+
+def convert(conn, granularity, ahead):
+    """Turn the plain transaction table into a partitioned one, moving existing rows."""
+    # The partition key is part of the primary key, so it cannot be NULL
+    conn.execute(text(f'UPDATE "{PARENT}" SET date = COALESCE(updated_at, now()) WHERE date IS NULL'))
+    _rebuild(conn, 'transaction_unpartitioned', ' PARTITION BY RANGE (date)', 'id, date')
+    conn.execute(text(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF "{PARENT}" DEFAULT'))
+
+    oldest = conn.execute(text('SELECT min(date) FROM transaction_unpartitioned')).scalar()
+    ensure_partitions(conn, granularity, ahead, since=oldest.date() if oldest else None)
+
+    # LIKE keeps the column order, so whole rows move as they are
+    conn.execute(text(f'INSERT INTO "{PARENT}" SELECT * FROM transaction_unpartitioned'))
+    conn.execute(text('DROP TABLE transaction_unpartitioned'))
+    conn.execute(text(f'ALTER SEQUENCE transaction_id_seq OWNED BY "{PARENT}".id'))
+    # Partitioned indexes cascade to every partition; this one serves the pruned range scans
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_transaction_user_date ON "{PARENT}" (user_id, date)'))
+
+def unconvert(conn):
+    """Back to a single plain table."""
+    _rebuild(conn, 'transaction_partitioned', '', 'id', skip_indexes=('ix_transaction_user_date',))
+    conn.execute(text(f'ALTER TABLE "{PARENT}" ALTER COLUMN date DROP NOT NULL'))
+    conn.execute(text(f'INSERT INTO "{PARENT}" SELECT * FROM transaction_partitioned'))
+    conn.execute(text('DROP TABLE transaction_partitioned CASCADE'))
+    conn.execute(text(f'ALTER SEQUENCE transaction_id_seq OWNED BY "{PARENT}".id'))
+
+def maintain(engine):
+    """Create upcoming partitions if the table is partitioned. Returns the new partition names."""
+    with engine.begin() as conn:
+        granularity = layout(conn)
+        if not granularity:
+            return []
+        return ensure_partitions(conn, granularity, get_periods_ahead())
+
+def mismatch(engine):
+    """A warning when TRANSACTION_PARTITIONING asks for a layout the table doesn't have, else None."""
+    wanted = get_granularity()
+    with engine.connect() as conn:
+        if not is_supported(conn):
+            return None
+        current = layout(conn)
+    if wanted and current != wanted:
+        return (f"TRANSACTION_PARTITIONING={wanted} but the transaction table is "
+                f"{'partitioned by ' + current if current else 'not partitioned'}; "
+                f"run 'python partitions.py convert' (unconvert first to change granularity)")
+    return None
+
+def run(command, engine, granularity=None):
+    """One partitions.py command against one database; returns a status line."""
+    with engine.begin() as conn:
+        if not is_supported(conn):
+            return "not Postgres, single table"
+        current = layout(conn)
+        if command == 'status':
+            return f"partitioned by {current}" if current else "not partitioned"
+        if command == 'convert':
+            if current:
+                return f"already partitioned by {current}"
+            convert(conn, granularity, get_periods_ahead())
+            return f"converted, partitioned by {granularity}"
+        if command == 'unconvert':
+            if not current:
+                return "already a plain table"
+            unconvert(conn)
+            return "converted back to a plain table"
+    created = maintain(engine)
+    return f"created partitions: {', '.join(created)}" if created else "partitions up to date"
+
+COMMANDS = ('maintain', 'status', 'convert', 'unconvert')
+
+if __name__ == '__main__':
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import NullPool
+    from config import Config
+
+    args = sys.argv[1:]
+    command = args[0] if args else 'maintain'
+    granularity = args[1] if len(args) > 1 else get_granularity()
+    if command not in COMMANDS:
+        print(f"usage: python partitions.py [{'|'.join(COMMANDS)}] [year|month]", file=sys.stderr)
+        sys.exit(2)
+    if command == 'convert' and granularity not in GRANULARITIES:
+        print("convert needs a granularity: year or month (or TRANSACTION_PARTITIONING)", file=sys.stderr)
+        sys.exit(2)
+
+    url = os.environ.get("SQLALCHEMY_DATABASE_URI") or os.environ.get("DATABASE_URL")
+    if not url:
+        print("DATABASE_URL is not set", file=sys.stderr)
+        sys.exit(1)
+    for name, db_url in [('default', url), *Config.SHARD_URLS.items()]:
+        engine = create_engine(db_url, poolclass=NullPool)
+        try:
+            print(f"{name}: {run(command, engine, granularity)}")
+        finally:
+            engine.dispose()
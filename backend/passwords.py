@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import lru_cache
+from flask import current_app, jsonify
+from werkzeug.security import generate_password_hash, check_password_hash
+import metrics
+
+# Password hashing runs on a small per-worker thread pool (hashlib's scrypt
+# and pbkdf2 release the GIL) with a hard cap on queued jobs, so a login
+# burst is rejected early instead of tying up every gunicorn worker; a hash
+# that outlasts PASSWORD_HASH_TIMEOUT is reported as busy as well. Attempts
+# are throttled per email and per client IP before any hash is computed.
+
+class HashingBusy(Exception):
+    pass
+
+_pool_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_slots = None
+
+def _config(key, default):
+    try:
+        return current_app.config.get(key, default)
+    except RuntimeError:
+        return default
+
+def _get_pool():
+    global _pool, _pool_pid, _slots
+    # Threads don't survive fork, so the pool is created lazily per worker
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                workers = _config('PASSWORD_HASH_WORKERS', 2)
+                queue_depth = _config('PASSWORD_HASH_QUEUE_DEPTH', 8)
+                _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pwhash')
+                _slots = threading.BoundedSemaphore(workers + queue_depth)
+                _pool_pid = os.getpid()
+    return _pool, _slots
+
+def _run(fn, *args):
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        metrics.inc('password_hash_rejected_total')
+        raise HashingBusy()
+    try:
+        future = pool.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda f: slots.release())
+    metrics.inc('password_hash_total')
+    try:
+        return future.result(timeout=_config('PASSWORD_HASH_TIMEOUT', 10))
+    except FutureTimeout:
+        metrics.inc('password_hash_timeouts_total')
+        raise HashingBusy()
+
+def _method():
+    return _config('PASSWORD_HASH_METHOD', 'scrypt')
+
+def hash_password(password):
+    return _run(generate_password_hash, password, _method())
+
+def verify_password(pw_hash, password):
+    return _run(check_password_hash, pw_hash, password)
+
+@lru_cache(maxsize=4)
+def _stored_method(method):
+    # "scrypt" is stored as "scrypt:32768:8:1"; let werkzeug fill in its defaults
+    return generate_password_hash('', method).split('$', 1)[0]
+
+def needs_rehash(pw_hash):
+    stored = pw_hash.split('$', 1)[0]
+    current = _stored_method(_method())
+    # Never trade a memory-hard scrypt hash for pbkdf2
+    if stored.startswith('scrypt') and not current.startswith('scrypt'):
+        return False
+    return stored != current
+
+class AttemptThrottle:
+    """Sliding-window counter of failed attempts per key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._attempts = {}
+
+    def _prune(self, key, now, window):
+        attempts = self._attempts.get(key)
+        while attempts and attempts[0] <= now - window:
+            attempts.popleft()
+        if attempts is not None and not attempts:
+            del self._attempts[key]
+        return attempts
+
+    def retry_after(self, key, limit, window):
+        """Seconds until the key may try again, 0 if not blocked."""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._prune(key, now, window)
+            if attempts and len(attempts) >= limit:
+                return max(1, int(attempts[0] + window - now) + 1)
+        return 0
+
+    def record_failure(self, key, window):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(key, now, window)
+            self._attempts.setdefault(key, deque()).append(now)
+            # Opportunistic cleanup so abandoned keys don't accumulate
+            if len(self._attempts) > 10000:
+                for stale in list(self._attempts):
+                    self._prune(stale, now, window)
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+throttle = AttemptThrottle()
+
+def _throttle_keys(email, ip):
+    window = _config('LOGIN_WINDOW_SECONDS', 300)
+    return (
+        (f"email:{(email or '').strip().lower()}", _config('LOGIN_MAX_ATTEMPTS_PER_EMAIL', 5), window),
+        (f"ip:{ip}", _config('LOGIN_MAX_ATTEMPTS_PER_IP', 20), window),
+    )
+
+def check_throttle(email, ip):
+    for key, limit, window in _throttle_keys(email, ip):
+        retry_after = throttle.retry_after(key, limit, window)
+        if retry_after:
+            metrics.inc('login_throttled_total', scope=key.split(':', 1)[0])
+            return retry_after
+    return 0
+
+def record_failed_attempt(email, ip):
+    for key, _, window in _throttle_keys(email, ip):
+        throttle.record_failure(key, window)
+
+def reset_attempts(email):
+    key, _, _ = _throttle_keys(email, None)[0]
+    throttle.reset(key)
+
+def retry_response(msg, status, retry_after):
+    response = jsonify({"msg": msg})
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
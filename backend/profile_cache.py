@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+from flask import current_app
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity
+from models import User
+
+# Stable profile fields travel inside the access token as a "profile" claim
+# tagged with User.profile_version. A small per-worker LRU keeps the newest
+# version seen for each user, so a token issued before a profile change is
+# overridden in this worker without touching the user table.
+
+PROFILE_FIELDS = ('email', 'name', 'base_currency', 'avatar')
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+def _max_size():
+    try:
+        return current_app.config.get('PROFILE_CACHE_SIZE', 1024)
+    except RuntimeError:
+        return 1024
+
+def profile_from_user(user):
+    profile = {field: getattr(user, field) for field in PROFILE_FIELDS}
+    profile['base_currency'] = profile['base_currency'] or 'RUB'
+    profile['v'] = user.profile_version or 1
+    return profile
+
+def remember(user_id, profile):
+    with _lock:
+        cached = _cache.get(user_id)
+        if cached and cached['v'] > profile['v']:
+            _cache.move_to_end(user_id)
+            return cached
+        _cache[user_id] = profile
+        _cache.move_to_end(user_id)
+        while len(_cache) > _max_size():
+            _cache.popitem(last=False)
+    return profile
+
+def invalidate(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
+
+def bump_version(user):
+    """Mark the user's profile as changed; call before commit."""
+    user.profile_version = (user.profile_version or 1) + 1
+    invalidate(user.id)
+
+def issue_token(user):
+    profile = profile_from_user(user)
+    remember(user.id, profile)
+    return create_access_token(identity=str(user.id), additional_claims={"profile": profile})
+
+def current_profile():
+    """Profile of the authenticated user, without a DB query when the token carries it."""
+    user_id = int(get_jwt_identity())
+    claims = get_jwt().get('profile')
+    if claims:
+        return dict(remember(user_id, claims), id=user_id)
+
+    with _lock:
+        cached = _cache.get(user_id)
+    if cached:
+        return dict(cached, id=user_id)
+
+    # Tokens issued before profile claims existed
+    user = User.query.get(user_id)
+    return dict(remember(user_id, profile_from_user(user)), id=user_id)
@@ -0,0 +1,206 @@
+import math
+import threading
+import time
+from functools import wraps
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import text
+from extensions import db
+import metrics
+from passwords import retry_response
+
+# Guards for expensive endpoints (PDF/CSV export, all-time analytics, ...).
+#
+# Each user has one token bucket of RATE_LIMIT_CAPACITY tokens refilled at
+# RATE_LIMIT_REFILL_PER_SECOND; a guarded request spends its endpoint's cost
+# or is answered 429 with Retry-After. Buckets live in a backend: "local"
+# keeps them in-process (single worker, tests), "postgres" in the UNLOGGED
+# rate_limit_bucket table so every worker sees the same balance.
+#
+# Requests whose cost reaches RATE_LIMIT_HEAVY_COST additionally pass the
+# worker's admission gate: at most ADMISSION_MAX_CONCURRENT run at once and
+# ADMISSION_QUEUE_DEPTH may wait; anything beyond that, or waiting longer
+# than ADMISSION_QUEUE_TIMEOUT, gets 503 before any work starts, so heavy
+# requests can never occupy all of a worker's threads.
+
+def take(tokens, elapsed, capacity, rate, cost):
+    """
+    Refill a bucket holding `tokens` after `elapsed` seconds and try to spend
+    `cost`. Returns (remaining tokens, seconds until the cost fits, 0 if spent).
+    """
+    tokens = min(capacity, tokens + max(elapsed, 0) * rate)
+    # A cost above capacity would never fit; charge a full bucket instead.
+    # Negative costs are refunds and always fit
+    cost = min(cost, capacity)
+    if tokens >= cost:
+        return min(capacity, tokens - cost), 0
+    return tokens, max(1, math.ceil((cost - tokens) / rate)) if rate > 0 else 60
+
+class LocalBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def consume(self, key, cost, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens, retry_after = take(tokens, now - updated, capacity, rate, cost)
+            self._buckets[key] = (tokens, now)
+            # Opportunistic cleanup: buckets idle long enough to be full again
+            if len(self._buckets) > 10000 and rate > 0:
+                full_after = capacity / rate
+                for k, (_, t) in list(self._buckets.items()):
+                    if now - t > full_after:
+                        del self._buckets[k]
+        return retry_after
+
+class PostgresBackend:
+    """Buckets shared by all workers; each decision is one short transaction holding the row lock."""
+
+    CLEANUP_EVERY = 1000
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._calls = 0
+
+    def consume(self, key, cost, capacity, rate):
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO rate_limit_bucket (key, tokens, updated_at) VALUES (:key, :capacity, now()::timestamp) "
+                "ON CONFLICT (key) DO NOTHING"
+            ), {'key': key, 'capacity': capacity})
+            tokens, elapsed = conn.execute(text(
+                "SELECT tokens, EXTRACT(EPOCH FROM now()::timestamp - updated_at) FROM rate_limit_bucket "
+                "WHERE key = :key FOR UPDATE"
+            ), {'key': key}).one()
+            tokens, retry_after = take(tokens, float(elapsed), capacity, rate, cost)
+            conn.execute(text(
+                "UPDATE rate_limit_bucket SET tokens = :tokens, updated_at = now()::timestamp WHERE key = :key"
+            ), {'key': key, 'tokens': tokens})
+
+        self._calls += 1
+        if self._calls % self.CLEANUP_EVERY == 0 and rate > 0:
+            with self.engine.begin() as conn:
+                conn.execute(text(
+                    "DELETE FROM rate_limit_bucket WHERE updated_at < now()::timestamp - make_interval(secs => :idle)"
+                ), {'idle': capacity / rate})
+        return retry_after
+
+def get_backend():
+    backend = current_app.extensions.get('ratelimit_backend')
+    if backend is None:
+        if current_app.config['RATE_LIMIT_BACKEND'] == 'postgres':
+            backend = PostgresBackend(db.engine)
+        else:
+            backend = LocalBackend()
+        current_app.extensions['ratelimit_backend'] = backend
+    return backend
+
+class AdmissionGate:
+    """Per-worker cap on concurrently running heavy requests with a bounded wait queue."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.running = 0
+        self.waiting = 0
+
+    def enter(self, limit, depth, timeout):
+        with self._cond:
+            if self.running < limit:
+                self.running += 1
+                return 'admitted'
+            if self.waiting >= depth:
+                return 'rejected'
+            self.waiting += 1
+            try:
+                if not self._cond.wait_for(lambda: self.running < limit, timeout):
+                    return 'timeout'
+            finally:
+                self.waiting -= 1
+            self.running += 1
+            return 'queued'
+
+    def leave(self):
+        with self._cond:
+            self.running -= 1
+            self._cond.notify()
+
+gate = AdmissionGate()
+
+def _publish_gate_gauges():
+    metrics.set_gauge('admission_running', gate.running)
+    metrics.set_gauge('admission_waiting', gate.waiting)
+
+def endpoint_cost(default):
+    """Cost of the current request: RATE_LIMIT_COSTS overrides, else the route's default (a number or callable)."""
+    overrides = current_app.config['RATE_LIMIT_COSTS']
+    if request.endpoint in overrides:
+        return overrides[request.endpoint]
+    return default() if callable(default) else default
+
+def _consume(cost):
+    config = current_app.config
+    return get_backend().consume(
+        f"user:{get_jwt_identity()}", cost,
+        config['RATE_LIMIT_CAPACITY'], config['RATE_LIMIT_REFILL_PER_SECOND'],
+    )
+
+def check(cost):
+    """Spend `cost` from the current user's bucket. Returns the Retry-After seconds, 0 if allowed."""
+    try:
+        retry_after = _consume(cost)
+    except Exception as e:
+        # Fail open: a limiter outage must not take the endpoints down with it
+        print(f"Rate limiter error: {e}")
+        metrics.inc('ratelimit_decisions_total', endpoint=request.endpoint, result='error')
+        return 0
+    metrics.inc('ratelimit_decisions_total', endpoint=request.endpoint, result='limited' if retry_after else 'allowed')
+    if not retry_after:
+        metrics.inc('ratelimit_tokens_spent_total', cost, endpoint=request.endpoint)
+    return retry_after
+
+def refund(cost):
+    """Give back tokens of a request that was turned away before doing any work."""
+    # check() charged at most a full bucket (see take())
+    try:
+        _consume(-min(cost, current_app.config['RATE_LIMIT_CAPACITY']))
+    except Exception as e:
+        print(f"Rate limiter error: {e}")
+
+def limited(cost):
+    """
+    Rate-limit a view (place it below @jwt_required()). `cost` is the number
+    of tokens a request spends, or a callable computing it from the request.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            config = current_app.config
+            if not config['RATE_LIMIT_ENABLED']:
+                return fn(*args, **kwargs)
+
+            request_cost = endpoint_cost(cost)
+            if request_cost <= 0:
+                return fn(*args, **kwargs)
+            retry_after = check(request_cost)
+            if retry_after:
+                return retry_response("Too many requests, please slow down", 429, retry_after)
+            if request_cost < config['RATE_LIMIT_HEAVY_COST']:
+                return fn(*args, **kwargs)
+
+            result = gate.enter(config['ADMISSION_MAX_CONCURRENT'], config['ADMISSION_QUEUE_DEPTH'],
+                                config['ADMISSION_QUEUE_TIMEOUT'])
+            metrics.inc('admission_total', endpoint=request.endpoint, result=result)
+            if result not in ('admitted', 'queued'):
+                _publish_gate_gauges()
+                refund(request_cost)
+                return retry_response("Server is busy, please retry shortly", 503, config['ADMISSION_RETRY_AFTER'])
+            _publish_gate_gauges()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                gate.leave()
+                _publish_gate_gauges()
+        return wrapper
+    return decorator
@@ -1,134 +1,322 @@
-from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Transaction, Category, User
-from sqlalchemy import func, extract
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required
+from models import Transaction, Category
+from sqlalchemy import func, cast, Integer
 from extensions import db
-from datetime import datetime, timedelta
-from routes.currencies import get_conversion_rate
+from datetime import datetime, timedelta, date
+from routes.transactions import filter_transactions
+from profile_cache import current_profile
+import balances
+import valuation
+import columnar
+import forecast
+import ratelimit
 import calendar
 
 analytics_bp = Blueprint('analytics', __name__)
 
+BUCKETS = ('day', 'week', 'month', 'quarter', 'year')
+MAX_BUCKETS = 5000
+MAX_FORECAST_MONTHS = 36
+
+def all_time_cost(all_time, ranged):
+    """Rate-limit cost: all-time requests scan a user's whole history."""
+    return lambda: all_time if request.args.get('period') == 'all' else ranged
+
+def bucket_start_expr(bucket, column):
+    """SQL expression truncating a timestamp to the start of its bucket (weeks start on Monday)."""
+    if db.engine.dialect.name == 'postgresql':
+        return func.date_trunc(bucket, column)
+    # SQLite equivalents, returned as 'YYYY-MM-DD' text
+    if bucket == 'day':
+        return func.date(column)
+    if bucket == 'week':
+        return func.date(column, 'weekday 0', '-6 days')
+    if bucket == 'month':
+        return func.strftime('%Y-%m-01', column)
+    if bucket == 'quarter':
+        month = cast(func.strftime('%m', column), Integer)
+        return func.printf('%s-%02d-01', func.strftime('%Y', column), ((month - 1) // 3) * 3 + 1)
+    return func.strftime('%Y-01-01', column)
+
+def bucket_floor(d, bucket):
+    if bucket == 'day':
+        return d
+    if bucket == 'week':
+        return d - timedelta(days=d.weekday())
+    if bucket == 'month':
+        return d.replace(day=1)
+    if bucket == 'quarter':
+        return date(d.year, (d.month - 1) // 3 * 3 + 1, 1)
+    return date(d.year, 1, 1)
+
+def next_bucket(d, bucket):
+    if bucket == 'day':
+        return d + timedelta(days=1)
+    if bucket == 'week':
+        return d + timedelta(days=7)
+    months = {'month': 1, 'quarter': 3, 'year': 12}[bucket]
+    month_index = d.month - 1 + months
+    return date(d.year + month_index // 12, month_index % 12 + 1, 1)
+
+def bucket_label(d, bucket):
+    if bucket == 'day':
+        return d.strftime('%d %b %Y')
+    if bucket == 'week':
+        year, week, _ = d.isocalendar()
+        return f"W{week:02d} {year}"
+    if bucket == 'month':
+        return d.strftime('%b %Y')
+    if bucket == 'quarter':
+        return f"Q{(d.month - 1) // 3 + 1} {d.year}"
+    return str(d.year)
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+def period_range(period, now):
+    """[start, end) datetimes for the summary-style period names; (None, None) for all time."""
+    if period == 'month':
+        start = datetime(now.year, now.month, 1)
+        return start, datetime.combine(next_bucket(start.date(), 'month'), datetime.min.time())
+    if period == 'year':
+        return datetime(now.year, 1, 1), datetime(now.year + 1, 1, 1)
+    return None, None
+
+def bucket_totals(query, bucket, base_currency):
+    """{bucket start date: {'income': x, 'expense': y}} in base currency, from one grouped query."""
+    bucket_col = bucket_start_expr(bucket, Transaction.date).label('bucket')
+    stored, pending = valuation.sum_columns(base_currency)
+    rows = query.with_entities(
+        bucket_col, Transaction.type, Transaction.currency, stored, pending
+    ).order_by(None).group_by(bucket_col, Transaction.type, Transaction.currency).all()
+
+    totals = {}
+    rate_cache = {}
+    for bucket_value, t_type, currency, stored_sum, pending_sum in rows:
+        if bucket_value is None:
+            # Undated rows count in the totals but belong to no bucket
+            continue
+        key = _as_date(bucket_value)
+        amount = valuation.to_base(stored_sum, pending_sum, currency, base_currency, rate_cache)
+        entry = totals.setdefault(key, {'income': 0, 'expense': 0})
+        entry['income' if t_type == 'income' else 'expense'] += amount
+    return totals
+
 @analytics_bp.route('/summary', methods=['GET'])
 @jwt_required()
+@ratelimit.limited(all_time_cost(10, 2))
 def get_summary():
     try:
-        user_id = int(get_jwt_identity())
-        user = User.query.get(user_id)
-        base_currency = user.base_currency or 'RUB'
-        
-        # Filters
-        period = request.args.get('period', 'year')
-        group_by_param = request.args.get('group_by', 'month')
-        cat_filter = request.args.get('category_id')
-
-        query = Transaction.query.filter_by(user_id=user_id)
-        
-        # Logic: If category selected, include its children
-        if cat_filter and cat_filter.strip():
-            try:
-                parent_id = int(cat_filter)
-                # Helper for recursive IDs could be shared, but simple approach here:
-                # For now, just 1 level deep to avoid circular dependencies if not importing from transactions
-                children = Category.query.filter_by(parent_id=parent_id).all()
-                cat_ids = [parent_id] + [c.id for c in children]
-                query = query.filter(Transaction.category_id.in_(cat_ids))
-            except:
-                pass
-
-        now = datetime.utcnow()
-        
-        if period == 'month':
-            query = query.filter(extract('month', Transaction.date) == now.month, extract('year', Transaction.date) == now.year)
-        elif period == 'year':
-            query = query.filter(extract('year', Transaction.date) == now.year)
-        
-        transactions = query.order_by(Transaction.date.asc()).all()
-        
-        total_income = 0
-        total_expenses = 0
-        
-        chart_data_map = {} 
-        cat_totals = {} 
-
-        rate_cache = {}
-
-        for t in transactions:
-            # Currency Conversion
-            try:
-                if t.currency != base_currency:
-                    k = f"{t.currency}_{base_currency}"
-                    if k not in rate_cache:
-                        rate_cache[k] = get_conversion_rate(t.currency, base_currency)
-                    amount = t.amount * rate_cache[k]
-                else:
-                    amount = t.amount
-            except Exception as e:
-                # Fallback on error: treat as 1:1 to prevent crash
-                amount = t.amount
-                print(f"Conversion failed for txn {t.id}: {e}")
-                
-            if t.type == 'income':
+        return jsonify(summary(current_profile(), request.args, {})), 200
+    except Exception as e:
+        print(f"Analytics Error: {e}")
+        return jsonify({"msg": "Internal Server Error", "error": str(e)}), 500
+
+def summary(profile, args, rate_cache):
+    """Dashboard/analytics summary for `profile`, filtered by `args` (period, group_by, category_id, engine)."""
+    user_id = profile['id']
+    base_currency = profile['base_currency']
+
+    # Filters
+    period = args.get('period', 'year')
+    group_by_param = args.get('group_by', 'month')
+    if group_by_param not in BUCKETS:
+        group_by_param = 'month'
+    cat_filter = args.get('category_id')
+
+    # engine=columnar computes from cached NumPy columns instead of ORM rows
+    engine = args.get('engine') or current_app.config['ANALYTICS_ENGINE']
+
+    query = Transaction.query.filter_by(user_id=user_id)
+    
+    # Logic: If category selected, include its children
+    cat_ids = None
+    if cat_filter and cat_filter.strip():
+        try:
+            parent_id = int(cat_filter)
+            # Helper for recursive IDs could be shared, but simple approach here:
+            # For now, just 1 level deep to avoid circular dependencies if not importing from transactions
+            children = Category.query.filter_by(parent_id=parent_id).all()
+            cat_ids = [parent_id] + [c.id for c in children]
+            query = query.filter(Transaction.category_id.in_(cat_ids))
+        except:
+            pass
+
+    now = datetime.utcnow()
+    
+    start, end = period_range(period, now)
+    if start:
+        query = query.filter(Transaction.date >= start, Transaction.date < end)
+    
+    total_income = 0
+    total_expenses = 0
+    
+    cat_totals = {} 
+
+    if engine == 'columnar':
+        cols = columnar.load(user_id)
+        values = columnar.in_base(cols, base_currency, rate_cache)
+        mask = columnar.select(cols, start, end, cat_ids)
+        total_income, total_expenses, by_category, bucket_map = columnar.summarize(cols, mask, values, group_by_param)
+    else:
+        # Totals and per-category expense from one grouped query, summing the stored base amounts
+        stored, pending = valuation.sum_columns(base_currency)
+        rows = query.with_entities(
+            Transaction.type, Transaction.category_id, Transaction.currency, stored, pending
+        ).order_by(None).group_by(Transaction.type, Transaction.category_id, Transaction.currency).all()
+        by_category = {}
+        for t_type, cat_id, currency, stored_sum, pending_sum in rows:
+            amount = valuation.to_base(stored_sum, pending_sum, currency, base_currency, rate_cache)
+            if t_type == 'income':
                 total_income += amount
             else:
                 total_expenses += amount
-                
-                cat_name = t.category.name if t.category else "Unknown"
-                cat_color = t.category.color if t.category else "#ccc"
-                if cat_name not in cat_totals:
-                    cat_totals[cat_name] = {'value': 0, 'color': cat_color}
-                cat_totals[cat_name]['value'] += amount
-
-            # Grouping
-            if group_by_param == 'day':
-                key = t.date.strftime('%d %b')
-                sort_key = t.date.strftime('%Y%m%d')
-            else:
-                key = t.date.strftime('%b %Y')
-                sort_key = t.date.strftime('%Y%m')
+                by_category[cat_id] = by_category.get(cat_id, 0) + amount
+        # Grouping is done in SQL; keys are ISO bucket starts so days never collide across years
+        bucket_map = bucket_totals(query, group_by_param, base_currency)
+
+    categories = {c.id: c for c in Category.query.filter(Category.id.in_(by_category))}
+    for cat_id, value in by_category.items():
+        cat = categories.get(cat_id)
+        cat_name = cat.name if cat else "Unknown"
+        entry = cat_totals.setdefault(cat_name, {'value': 0, 'color': cat.color if cat else "#ccc"})
+        entry['value'] += value
+    # Only the rows actually shown are loaded
+    transactions = query.order_by(Transaction.date.desc(), Transaction.id.desc()).limit(20).all()[::-1]
 
-            if key not in chart_data_map:
-                chart_data_map[key] = {'name': key, 'income': 0, 'expense': 0, 'sort': sort_key}
+    sorted_chart_data = [
+        {"key": k.isoformat(), "name": bucket_label(k, group_by_param), "income": v['income'], "expense": v['expense']}
+        for k, v in sorted(bucket_map.items())
+    ]
+    
+    pie_data_list = [{"name": k, "value": v['value'], "color": v['color']} for k,v in cat_totals.items()]
+    pie_data_list.sort(key=lambda x: x['value'], reverse=True)
+
+    recent_txns = []
+    for t in reversed(transactions[-20:]): 
+        amt = valuation.in_base(t, base_currency, rate_cache)
             
-            if t.type == 'income':
-                chart_data_map[key]['income'] += amount
-            else:
-                chart_data_map[key]['expense'] += amount
-
-        sorted_chart_data = sorted(chart_data_map.values(), key=lambda x: x['sort'])
-        
-        pie_data_list = [{"name": k, "value": v['value'], "color": v['color']} for k,v in cat_totals.items()]
-        pie_data_list.sort(key=lambda x: x['value'], reverse=True)
-
-        recent_txns = []
-        for t in reversed(transactions[-20:]): 
-            if t.currency != base_currency:
-                k = f"{t.currency}_{base_currency}"
-                amt = t.amount * rate_cache.get(k, 1.0)
-            else:
-                amt = t.amount
-                
-            recent_txns.append({
-                "id": t.id,
-                "date": t.date,
-                "category_name": t.category.name if t.category else "Unknown",
-                "description": t.description,
-                "amount": amt,
-                "type": t.type,
-                "original_amount": t.amount,
-                "original_currency": t.currency
-            })
-
-        return jsonify({
-            "currency": base_currency,
-            "total_income": total_income,
-            "total_expenses": total_expenses,
-            "balance": total_income - total_expenses,
-            "pie_data": pie_data_list[:10],
-            "bar_data": sorted_chart_data,
-            "recent": recent_txns
-        }), 200
-        
-    except Exception as e:
-        print(f"Analytics Error: {e}")
-        return jsonify({"msg": "Internal Server Error", "error": str(e)}), 500
+        recent_txns.append({
+            "id": t.id,
+            "date": t.date,
+            "category_name": t.category.name if t.category else "Unknown",
+            "description": t.description,
+            "amount": amt,
+            "type": t.type,
+            "original_amount": t.amount,
+            "original_currency": t.currency
+        })
+
+    balance = total_income - total_expenses
+    if period == 'all' and not cat_filter:
+        # All-time balance from checkpoints rather than the summed rows
+        balance = balances.balance_in_base(user_id, base_currency, rate_cache)
+
+    return {
+        "currency": base_currency,
+        "total_income": total_income,
+        "total_expenses": total_expenses,
+        "balance": balance,
+        "pie_data": pie_data_list[:10],
+        "bar_data": sorted_chart_data,
+        "recent": recent_txns
+    }
+
+@analytics_bp.route('/timeseries', methods=['GET'])
+@jwt_required()
+@ratelimit.limited(all_time_cost(5, 1))
+def get_timeseries():
+    """
+    Income/expense per time bucket in the user's base currency.
+    Buckets are computed in SQL (one grouped query) and gap-filled in a single pass.
+    Params: bucket=day|week|month|quarter|year, period=month|year|all or
+    start_date/end_date, plus the transaction listing filters.
+    """
+    profile = current_profile()
+    user_id = profile['id']
+    base_currency = profile['base_currency']
+
+    bucket = request.args.get('bucket', 'month')
+    if bucket not in BUCKETS:
+        return jsonify({"msg": f"bucket must be one of {', '.join(BUCKETS)}"}), 400
+
+    query = filter_transactions(user_id, request.args)
+    start = end = None
+    try:
+        if request.args.get('start_date'):
+            start = datetime.fromisoformat(request.args['start_date'])
+        if request.args.get('end_date'):
+            end = datetime.fromisoformat(request.args['end_date'])
+    except ValueError:
+        return jsonify({"msg": "Invalid date"}), 400
+    if not start and not end:
+        start, end = period_range(request.args.get('period', 'year'), datetime.utcnow())
+        if start:
+            query = query.filter(Transaction.date >= start, Transaction.date < end)
+            end = end - timedelta(microseconds=1)
+
+    totals = bucket_totals(query, bucket, base_currency)
+
+    first = bucket_floor(start.date(), bucket) if start else min(totals, default=None)
+    if end:
+        last = bucket_floor(end.date(), bucket)
+    else:
+        # Open-ended ranges run to the current bucket, or the newest row if later
+        last = max([*totals, bucket_floor(datetime.utcnow().date(), bucket)])
+
+    series = []
+    current = first
+    while current is not None and current <= last:
+        if len(series) >= MAX_BUCKETS:
+            return jsonify({"msg": f"Range too large: more than {MAX_BUCKETS} buckets"}), 400
+        entry = totals.get(current, {'income': 0, 'expense': 0})
+        series.append({
+            "key": current.isoformat(),
+            "name": bucket_label(current, bucket),
+            "income": round(entry['income'], 2),
+            "expense": round(entry['expense'], 2),
+        })
+        current = next_bucket(current, bucket)
+
+    return jsonify({"currency": base_currency, "bucket": bucket, "series": series}), 200
+
+@analytics_bp.route('/forecast', methods=['GET'])
+@jwt_required()
+@ratelimit.limited(5)
+def get_forecast():
+    """
+    Projected income, expense and balance for the next `months` months
+    (default 6), overall and per category, from the monthly history.
+    """
+    profile = current_profile()
+    user_id = profile['id']
+    base_currency = profile['base_currency']
+
+    try:
+        months = int(request.args.get('months', 6))
+    except ValueError:
+        return jsonify({"msg": "months must be a number"}), 400
+    if not 1 <= months <= MAX_FORECAST_MONTHS:
+        return jsonify({"msg": f"months must be between 1 and {MAX_FORECAST_MONTHS}"}), 400
+
+    result = forecast.compute(user_id, base_currency, months)
+
+    categories = {c.id: c for c in Category.query.filter(Category.id.in_([c['category_id'] for c in result['categories']]))}
+    by_category = []
+    for entry in result['categories']:
+        cat = categories.get(entry['category_id'])
+        by_category.append(dict(entry, name=cat.name if cat else "Unknown", color=cat.color if cat else "#ccc"))
+    by_category.sort(key=lambda c: sum(c['values']), reverse=True)
+
+    months_out = [dict(m, name=bucket_label(date.fromisoformat(m['key']), 'month')) for m in result['months']]
+    return jsonify({
+        "currency": base_currency,
+        "history_months": result['history_months'],
+        "months": months_out,
+        "categories": by_category,
+    }), 200
@@ -1,27 +1,46 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from models import User
 from extensions import db
+from profile_cache import issue_token, current_profile
+import passwords
+import shards
 
 auth_bp = Blueprint('auth', __name__)
 
 @auth_bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
-    if User.query.filter_by(email=data['email']).first():
+    if shards.find_email(data['email']):
         return jsonify({"msg": "Email already registered"}), 400
     
+    try:
+        password_hash = passwords.hash_password(data['password'])
+    except passwords.HashingBusy:
+        return passwords.retry_response("Server busy, try again", 503, 1)
+
+    # The directory hands out the id and shard; its unique email settles races
+    allocated = shards.allocate(data['email'])
+    if allocated is None:
+        return jsonify({"msg": "Email already registered"}), 400
+    user_id, shard = allocated
+    shards.use_shard(shard)
+
     user = User(
+        id=user_id,
         email=data['email'],
-        password_hash=generate_password_hash(data['password']),
+        password_hash=password_hash,
         name=data.get('name', '')
     )
     db.session.add(user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        shards.release(user_id)
+        raise
     
-    # Cast user.id to string for JWT compliance
-    token = create_access_token(identity=str(user.id))
+    token = issue_token(user)
     return jsonify({
         "token": token, 
         "user": {
@@ -35,11 +54,36 @@ def register():
 @auth_bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
-    user = User.query.filter_by(email=data['email']).first()
+    ip = request.remote_addr
+
+    # Reject throttled clients before any DB lookup or hashing
+    retry_after = passwords.check_throttle(data['email'], ip)
+    if retry_after:
+        return passwords.retry_response("Too many login attempts", 429, retry_after)
+
+    entry = shards.find_email(data['email'])
+    user = None
+    if entry:
+        shards.use(entry.id)
+        user = User.query.get(entry.id)
     
-    if user and check_password_hash(user.password_hash, data['password']):
-        # Cast user.id to string for JWT compliance
-        token = create_access_token(identity=str(user.id))
+    try:
+        valid = user is not None and passwords.verify_password(user.password_hash, data['password'])
+    except passwords.HashingBusy:
+        return passwords.retry_response("Server busy, try again", 503, 1)
+
+    if valid and passwords.needs_rehash(user.password_hash):
+        # Hash parameters changed since this password was set. Best effort:
+        # the credentials are already verified, a busy pool retries next login
+        try:
+            user.password_hash = passwords.hash_password(data['password'])
+            db.session.commit()
+        except passwords.HashingBusy:
+            pass
+
+    if valid:
+        passwords.reset_attempts(data['email'])
+        token = issue_token(user)
         return jsonify({
             "token": token, 
             "user": {
@@ -50,16 +94,18 @@ def login():
             }
         }), 200
         
+    passwords.record_failed_attempt(data['email'], ip)
     return jsonify({"msg": "Invalid credentials"}), 401
 
 @auth_bp.route('/me', methods=['GET'])
 @jwt_required()
 def me():
-    user_id = get_jwt_identity()
-    user = User.query.get(int(user_id))
-    return jsonify({
-        "email": user.email, 
-        "name": user.name,
-        "currency": user.base_currency,
-        "avatar": user.avatar
-    }), 200
\ No newline at end of file
+    return jsonify(profile_json(current_profile())), 200
+
+def profile_json(profile):
+    return {
+        "email": profile['email'], 
+        "name": profile['name'],
+        "currency": profile['base_currency'],
+        "avatar": profile['avatar']
+    }
\ No newline at end of file
@@ -0,0 +1,86 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, request, jsonify, current_app, g, copy_current_request_context
+from flask_jwt_extended import jwt_required
+from profile_cache import current_profile
+from routes.auth import profile_json
+from routes.categories import category_list
+from routes.budgets import budget_list
+from routes.analytics import summary, all_time_cost
+from routes.currencies import rate_snapshot, conversion_cache
+import ratelimit
+
+bootstrap_bp = Blueprint('bootstrap', __name__)
+
+# Everything the SPA needs for first paint in one round trip: the profile
+# (/auth/me), categories, active budgets, stored rates for the user's base
+# currency and the dashboard summary (summary filters may be passed as
+# query parameters). The profile comes from the token and the rates from
+# one exchange_rate snapshot shared by every conversion; unlike
+# /currencies/rates no external API is called. With BOOTSTRAP_PARALLEL the
+# categories, budgets and summary queries run concurrently on separate
+# connections. The response carries an ETag, so an unchanged bootstrap
+# costs the client a 304 instead of the payload.
+
+_pool_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+def _get_pool():
+    global _pool, _pool_pid
+    # Threads don't survive fork, so the pool is created lazily per worker
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=current_app.config['BOOTSTRAP_WORKERS'],
+                                           thread_name_prefix='bootstrap')
+                _pool_pid = os.getpid()
+    return _pool
+
+def run_parts(parts):
+    """Call each of {name: fn} and return {name: result}, concurrently when BOOTSTRAP_PARALLEL is on."""
+    if not current_app.config['BOOTSTRAP_PARALLEL']:
+        return {name: fn() for name, fn in parts.items()}
+
+    # Each part gets a copy of this request context, hence its own app
+    # context and DB session; g carries the verified JWT and routing decisions
+    values = dict(g.__dict__)
+
+    def in_request(fn):
+        @copy_current_request_context
+        def run():
+            g.__dict__.update(values)
+            return fn()
+        return run
+
+    pool = _get_pool()
+    futures = {name: pool.submit(in_request(fn)) for name, fn in parts.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+@bootstrap_bp.route('', methods=['GET'])
+@jwt_required()
+@ratelimit.limited(all_time_cost(10, 2))
+def bootstrap():
+    profile = current_profile()
+    base_currency = profile['base_currency']
+    snapshot = rate_snapshot()
+    rate_cache = conversion_cache(snapshot, base_currency)
+    args = request.args.to_dict()
+
+    result = run_parts({
+        'categories': lambda: category_list(profile['id']),
+        'budgets': lambda: budget_list(profile, False, rate_cache),
+        'summary': lambda: summary(profile, args, rate_cache),
+    })
+    result['user'] = profile_json(profile)
+    result['rates'] = {
+        "base": base_currency,
+        "rates": {target: rate for (base, target), rate in snapshot.items() if base == base_currency},
+    }
+
+    response = jsonify(result)
+    response.add_etag()
+    # Always revalidate; the ETag makes that cheap
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
@@ -1,21 +1,47 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Budget, Category, Transaction, User
+from models import Budget, Category, Transaction
 from extensions import db
-from sqlalchemy import func, extract
+from sqlalchemy import func
 from datetime import datetime
-from routes.currencies import get_conversion_rate
+from routes.analytics import period_range
+from profile_cache import current_profile
+import valuation
+import columnar
 
 budget_bp = Blueprint('budgets', __name__)
 
+def budget_category_ids(category_id):
+    """Budget's category plus its direct children."""
+    # For deeper trees, a recursive CTE or recursive python function is needed.
+    child_cats = Category.query.filter_by(parent_id=category_id).all()
+    return [category_id] + [c.id for c in child_cats]
+
+def month_spent(user_id, cat_ids, base_currency, rate_cache, now=None):
+    """Current-month spending in the given categories, converted to base currency."""
+    now = now or datetime.utcnow()
+    # Range filter (not extract) so a date-partitioned table only scans this month
+    month_start, month_end = period_range('month', now)
+    # Sum the stored base amounts in SQL; only stale rows need a rate
+    stored, pending = valuation.sum_columns(base_currency)
+    rows = db.session.query(Transaction.currency, stored, pending).filter(
+        Transaction.category_id.in_(cat_ids),
+        Transaction.user_id == user_id,
+        Transaction.date >= month_start,
+        Transaction.date < month_end
+    ).group_by(Transaction.currency).all()
+    return sum(valuation.to_base(s, p, currency, base_currency, rate_cache) for currency, s, p in rows)
+
 @budget_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_budgets():
-    user_id = int(get_jwt_identity())
-    user = User.query.get(user_id)
-    base_currency = user.base_currency
+    return jsonify(budget_list(current_profile(), request.args.get('archived') == 'true', {})), 200
+
+def budget_list(profile, show_archived, rate_cache):
+    """The user's budgets with this month's spending in base currency."""
+    user_id = profile['id']
+    base_currency = profile['base_currency']
 
-    show_archived = request.args.get('archived') == 'true'
     query = Budget.query.filter_by(user_id=user_id)
     if not show_archived:
         query = query.filter_by(archived=False)
@@ -23,42 +49,19 @@ def get_budgets():
     budgets = query.all()
     
     result = []
-    current_month = datetime.utcnow().month
-    current_year = datetime.utcnow().year
 
-    # Cache rates to avoid repetitive API calls
-    rate_cache = {}
+    use_columnar = current_app.config['ANALYTICS_ENGINE'] == 'columnar' and budgets
+    if use_columnar:
+        # One load and one rate vector; each budget is then a masked sum
+        cols = columnar.load(user_id)
+        values = columnar.in_base(cols, base_currency, rate_cache)
+        month_start, month_end = period_range('month', datetime.utcnow())
 
     for b in budgets:
-        # 1. Find all relevant category IDs (Parent + Children)
-        # Simple recursion for 1-level deep or flat query if structure allows.
-        # Here we do a query to find immediate children. 
-        # For deeper trees, a recursive CTE or recursive python function is needed.
-        # Assuming 1-2 levels for simplicity or fetch all cats and filter.
-        
-        child_cats = Category.query.filter_by(parent_id=b.category_id).all()
-        cat_ids = [b.category_id] + [c.id for c in child_cats]
-        
-        # 2. Fetch transactions
-        # We must fetch them to convert currency in Python code
-        # SQL Sum is not enough because transactions can be in different currencies
-        txns = Transaction.query.filter(
-            Transaction.category_id.in_(cat_ids),
-            Transaction.user_id == user_id,
-            extract('month', Transaction.date) == current_month,
-            extract('year', Transaction.date) == current_year
-        ).all()
-        
-        spent = 0
-        for t in txns:
-            # Convert if needed
-            if t.currency != base_currency:
-                k = f"{t.currency}_{base_currency}"
-                if k not in rate_cache:
-                    rate_cache[k] = get_conversion_rate(t.currency, base_currency)
-                spent += t.amount * rate_cache[k]
-            else:
-                spent += t.amount
+        if use_columnar:
+            spent = columnar.spent(cols, values, month_start, month_end, budget_category_ids(b.category_id))
+        else:
+            spent = month_spent(user_id, budget_category_ids(b.category_id), base_currency, rate_cache)
 
         cat = Category.query.get(b.category_id)
         
@@ -73,7 +76,7 @@ def get_budgets():
             "archived": b.archived
         })
         
-    return jsonify(result), 200
+    return result
 
 @budget_bp.route('/', methods=['POST'])
 @jwt_required()
@@ -8,7 +8,10 @@ cat_bp = Blueprint('categories', __name__)
 @cat_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_categories():
-    user_id = int(get_jwt_identity())
+    return jsonify(category_list(int(get_jwt_identity()))), 200
+
+def category_list(user_id):
+    """The user's categories and the system ones."""
     categories = Category.query.filter((Category.user_id == user_id) | (Category.user_id == None)).all()
     
     result = []
@@ -22,7 +25,7 @@ def get_categories():
             "parent_id": c.parent_id,
             "is_system": c.user_id is None
         })
-    return jsonify(result), 200
+    return result
 
 @cat_bp.route('/', methods=['POST'])
 @jwt_required()
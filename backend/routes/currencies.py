@@ -1,16 +1,58 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required
-from models import ExchangeRate
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import ExchangeRate, RateHistory
 from extensions import db
-import requests
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import bisect
 import random
+import threading
+import time
+import embedded
+import fx
+import valuation
 
 currency_bp = Blueprint('currencies', __name__)
 
-def get_conversion_rate(source, target):
+def stored_rate(source, target):
+    """
+    Rate from the exchange_rate table (direct, then inverse), None if unknown.
+    Never calls the API, so it is safe inside a flush.
+    """
+    source = source.upper()
+    target = target.upper()
+    if source == target:
+        return 1.0
+    rate_obj = ExchangeRate.query.filter_by(base_currency=source, target_currency=target).first()
+    if rate_obj:
+        return rate_obj.rate
+    inverse = ExchangeRate.query.filter_by(base_currency=target, target_currency=source).first()
+    if inverse and inverse.rate > 0:
+        return 1.0 / inverse.rate
+    return None
+
+def rate_snapshot():
+    """All stored rates as {(base, target): rate}, read in one query."""
+    return {(r.base_currency, r.target_currency): r.rate for r in ExchangeRate.query.all()}
+
+def conversion_cache(snapshot, base_currency):
+    """
+    A valuation rate cache ("USD_RUB" keys) pre-filled from a snapshot with
+    the same direct-then-inverse lookup as stored_rate(); pairs missing from
+    it still go through get_conversion_rate() when first needed.
+    """
+    cache = {}
+    for (source, target), rate in snapshot.items():
+        if target == base_currency:
+            cache[f"{source}_{base_currency}"] = rate
+        elif source == base_currency and rate > 0:
+            cache.setdefault(f"{target}_{base_currency}", 1.0 / rate)
+    return cache
+
+def lookup_rate(source, target):
     """
-    Get conversion rate with multiple fallbacks and error handling.
+    Get conversion rate with multiple fallbacks and error handling; None when
+    no source knows the pair.
     """
     try:
         source = source.upper()
@@ -19,83 +61,63 @@ def get_conversion_rate(source, target):
         if source == target:
             return 1.0
             
-        # 1. Check DB (Direct)
+        # 1-2. Check DB (Direct, then Inverse)
         # We wrap DB calls in try-except to handle schema sync issues gracefully
         try:
-            rate_obj = ExchangeRate.query.filter_by(base_currency=source, target_currency=target).first()
+            rate = stored_rate(source, target)
         except Exception as e:
-            print(f"DB Read Error (Direct): {e}")
+            print(f"DB Read Error: {e}")
             db.session.rollback()
-            rate_obj = None
+            rate = None
+
+        if rate is not None:
+            return rate
 
-        # 2. Check DB (Inverse) 
-        if not rate_obj:
+        # 3. Fetch from API (Open Exchange Rates; cached and circuit-broken, see fx.py)
+        api_rate = (fx.latest_rates(source) or {}).get(target)
+        if api_rate:
+            # Try to save to DB, but don't crash if it fails
             try:
-                inverse = ExchangeRate.query.filter_by(base_currency=target, target_currency=source).first()
-                if inverse and inverse.rate > 0:
-                    return 1.0 / inverse.rate
-            except Exception as e:
-                print(f"DB Read Error (Inverse): {e}")
+                embedded.begin_write(db.session)
+                db.session.add(ExchangeRate(base_currency=source, target_currency=target, rate=api_rate))
+                db.session.commit()
+                # Rows left unvalued for lack of a stored rate
+                valuation.revalue_pairs_later([(source, target)], pending_only=True)
+            except Exception as db_e:
+                print(f"DB Write Error: {db_e}")
                 db.session.rollback()
 
-        if rate_obj:
-            return rate_obj.rate
+            return api_rate
 
-        # 3. Fetch from API (Open Exchange Rates)
-        try:
-            resp = requests.get(f'https://open.er-api.com/v6/latest/{source}', timeout=3)
-            if resp.status_code == 200:
-                data = resp.json()
-                api_rate = data.get('rates', {}).get(target)
-                
-                if api_rate:
-                    # Try to save to DB, but don't crash if it fails
-                    try:
-                        if rate_obj:
-                            rate_obj.rate = api_rate
-                            rate_obj.updated_at = datetime.utcnow()
-                        else:
-                            new_rate = ExchangeRate(base_currency=source, target_currency=target, rate=api_rate)
-                            db.session.add(new_rate)
-                        db.session.commit()
-                    except Exception as db_e:
-                        print(f"DB Write Error: {db_e}")
-                        db.session.rollback()
-                        
-                    return api_rate
-        except Exception as e:
-            print(f"Currency API Error: {e}")
-            
         # 4. Final Fallback - Inverse API
-        try:
-            resp = requests.get(f'https://open.er-api.com/v6/latest/{target}', timeout=3)
-            if resp.status_code == 200:
-                data = resp.json()
-                inverse_rate = data.get('rates', {}).get(source)
-                if inverse_rate and inverse_rate > 0:
-                    return 1.0 / inverse_rate
-        except:
-            pass
-
-        print(f"Could not find rate for {source}->{target}. Defaulting to 1.0")
-        return 1.0
+        inverse_rate = (fx.latest_rates(target) or {}).get(source)
+        if inverse_rate and inverse_rate > 0:
+            return 1.0 / inverse_rate
+        return None
         
     except Exception as critical_e:
         print(f"Critical Currency Error: {critical_e}")
+        return None
+
+def get_conversion_rate(source, target):
+    """lookup_rate(), defaulting to 1.0 so display paths never fail."""
+    rate = lookup_rate(source, target)
+    if rate is None:
+        print(f"Could not find rate for {source}->{target}. Defaulting to 1.0")
         return 1.0
+    return rate
 
 @currency_bp.route('/rates', methods=['GET'])
 def get_rates():
     base = request.args.get('base', 'RUB').upper()
     
-    # Attempt update from API
+    # Attempt update from API (cached per worker for FX_RATES_TTL, see fx.py)
     try:
-        resp = requests.get(f'https://open.er-api.com/v6/latest/{base}', timeout=3)
-        if resp.status_code == 200:
-            data = resp.json()
-            rates = data.get('rates', {})
-            
+        rates = fx.latest_rates(base)
+        if rates:
             targets = ['USD', 'EUR', 'RUB', 'CNY', 'GBP', 'TRY', 'KZT', 'BYN']
+            added = []
+            embedded.begin_write(db.session)
             for t in targets:
                 if t in rates:
                     try:
@@ -106,12 +128,16 @@ def get_rates():
                                 existing.updated_at = datetime.utcnow()
                         else:
                             db.session.add(ExchangeRate(base_currency=base, target_currency=t, rate=rates[t]))
+                            added.append((base, t))
                     except Exception as db_e:
                         db.session.rollback()
                         print(f"DB Error in rates loop: {db_e}")
             
             try:
                 db.session.commit()
+                # New pairs can value rows that had no rate yet; rows valued at an
+                # older rate catch up in the scheduled `python valuation.py --rates`
+                valuation.revalue_pairs_later([p for p in added if p[0] != p[1]], pending_only=True)
             except:
                 db.session.rollback()
                 
@@ -129,68 +155,218 @@ def get_rates():
     
     # If DB failed or empty, fallback to API response if available
     if not result and 'rates' in locals():
-        result = rates
+        result = rates or {}
 
     return jsonify({"base": base, "rates": result}), 200
 
+HISTORY_DAYS = 30
+
+_history_checked_lock = threading.Lock()
+_history_checked = {}
+
+def _synthetic_history(base, target, start_date, days):
+    """Fallback curve: the current rate with a small (1-2%) deterministic wobble."""
+    current_rate = get_conversion_rate(base, target)
+    # Seeded per pair for consistent charts
+    rng = random.Random(len(base) + len(target))
+    variance = current_rate * 0.02
+    points = []
+    for i in range(days):
+        d = start_date + timedelta(days=i)
+        points.append({"date": d.strftime('%Y-%m-%d'), "rate": round(current_rate + rng.uniform(-1, 1) * variance, 4)})
+    return points
+
+def _needs_fetch(base, target, days, start, end):
+    """Stored rows miss part of the window or lag today, and the pair wasn't tried lately (per worker)."""
+    if days and days[0] <= start + timedelta(days=4) and days[-1] >= end - timedelta(days=1):
+        return False
+    with _history_checked_lock:
+        checked = _history_checked.get((base, target), 0)
+    return time.time() - checked > current_app.config['CURRENCY_HISTORY_REFRESH_SECONDS']
+
+def _store_history(base, target, start, end, rows):
+    try:
+        embedded.begin_write(db.session)
+        RateHistory.query.filter(
+            RateHistory.base_currency == base, RateHistory.target_currency == target,
+            RateHistory.date >= start, RateHistory.date <= end,
+        ).delete(synchronize_session=False)
+        db.session.add_all([RateHistory(base_currency=base, target_currency=target, date=d, rate=r) for d, r in rows])
+        db.session.commit()
+    except (IntegrityError, OperationalError):
+        # Another worker stored the same window first, or the database stayed
+        # locked; the fetched rows are served either way
+        db.session.rollback()
+
+def pair_histories(base, targets, days=HISTORY_DAYS):
+    """
+    {target: (points, source)} for the last `days` days of base->target, where
+    source is 'stored', 'api' or 'synthetic'. Stored history is read in one
+    query; pairs that are missing or stale are fetched from the provider
+    concurrently and stored, and pairs the provider can't serve fall back to
+    older stored rows, else to a synthetic curve around the current rate.
+    """
+    end = date.today()
+    start = end - timedelta(days=days)
+    stored = {t: [] for t in targets}
+    for row in RateHistory.query.filter(
+        RateHistory.base_currency == base, RateHistory.target_currency.in_(targets),
+        RateHistory.date >= start, RateHistory.date <= end,
+    ).order_by(RateHistory.date):
+        stored[row.target_currency].append((row.date, row.rate))
+
+    stale = [t for t in targets if t != base and _needs_fetch(base, t, [d for d, _ in stored[t]], start, end)]
+    fetched = fx.fetch_histories(base, stale, start, end) if stale else {}
+    now = time.time()
+    with _history_checked_lock:
+        for target in stale:
+            _history_checked[(base, target)] = now
+
+    result = {}
+    for target in targets:
+        if target == base:
+            result[target] = ([{"date": (start + timedelta(days=i)).isoformat(), "rate": 1.0} for i in range(days)], 'stored')
+            continue
+        rows, source = stored[target], 'stored'
+        # Too short to chart (e.g. a pair the provider barely covers)
+        if fetched.get(target) and len(fetched[target]) > 5:
+            rows, source = fetched[target], 'api'
+            _store_history(base, target, start, end, rows)
+        if not rows:
+            result[target] = (_synthetic_history(base, target, datetime.combine(start, datetime.min.time()), days), 'synthetic')
+            continue
+        result[target] = ([{"date": d.isoformat(), "rate": r} for d, r in rows], source)
+    return result
+
 @currency_bp.route('/history', methods=['GET'])
 @jwt_required()
 def get_history():
+    """
+    ?target=USD: that pair's last 30 days as a list (the original shape).
+    ?targets=USD,EUR,...: every pair at once as {"base", "history": {target: [...]}, "sources": {...}}.
+    """
     base = request.args.get('base', 'RUB').upper()
-    target = request.args.get('target', 'USD').upper()
-    days = 30
-    
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=days)
-    
-    chart_data = []
+    if 'targets' not in request.args:
+        target = request.args.get('target', 'USD').upper()
+        return jsonify(pair_histories(base, [target])[target][0]), 200
+
+    targets = list(dict.fromkeys(t.strip().upper() for t in request.args['targets'].split(',') if t.strip()))
+    if not targets or any(len(t) != 3 for t in targets):
+        return jsonify({"msg": "targets must be a comma-separated list of currency codes"}), 400
+    if len(targets) > current_app.config['CURRENCY_HISTORY_MAX_TARGETS']:
+        return jsonify({"msg": f"At most {current_app.config['CURRENCY_HISTORY_MAX_TARGETS']} targets per request"}), 400
 
-    if base == target:
-        for i in range(days):
-            d = start_date + timedelta(days=i)
-            chart_data.append({"date": d.strftime('%Y-%m-%d'), "rate": 1.0})
-        return jsonify(chart_data), 200
+    histories = pair_histories(base, targets)
+    return jsonify({
+        "base": base,
+        "history": {t: points for t, (points, _) in histories.items()},
+        "sources": {t: source for t, (_, source) in histories.items()},
+    }), 200
 
-    # Try Frankfurter (Good history, but can fail for some pairs)
-    success = False
+def _parse_convert_item(item):
+    """Return ((amount, from, to, date or None), error message) for one /convert item."""
+    if not isinstance(item, dict):
+        return None, "Item must be an object"
     try:
-        start_str = start_date.strftime('%Y-%m-%d')
-        end_str = end_date.strftime('%Y-%m-%d')
-        # Note: Frankfurter uses 'from' not 'base'
-        url = f'https://api.frankfurter.app/{start_str}..{end_str}?from={base}&to={target}'
-        resp = requests.get(url, timeout=3)
-        if resp.status_code == 200:
-            data = resp.json()
-            rates = data.get('rates', {})
-            for date_key, rate_obj in rates.items():
-                val = rate_obj.get(target)
-                if val:
-                    chart_data.append({"date": date_key, "rate": val})
-            if len(chart_data) > 5:
-                success = True
-    except Exception as e:
-        print(f"History API Error: {e}")
+        amount = float(item.get('amount'))
+    except (TypeError, ValueError):
+        return None, "Invalid amount"
+    source = str(item.get('from') or '').upper()
+    target = str(item.get('to') or '').upper()
+    if len(source) != 3 or len(target) != 3:
+        return None, "Invalid currency"
+    on = None
+    if item.get('date'):
+        try:
+            on = date.fromisoformat(str(item['date'])[:10])
+        except ValueError:
+            return None, "Invalid date"
+    return (amount, source, target, on), None
 
-    # Fallback: Synthetic history based on current rate
-    if not success:
-        current_rate = get_conversion_rate(base, target)
-        # Seed for consistent random generation
-        random.seed(len(base) + len(target))
-        
-        # Create a small fluctuation (1-2%)
-        variance = current_rate * 0.02
-
-        for i in range(days):
-            d = start_date + timedelta(days=i)
-            # Generate a pseudo-realistic curve
-            noise = random.uniform(-1, 1) * variance
-            daily_rate = current_rate + noise
-            chart_data.append({
-                "date": d.strftime('%Y-%m-%d'), 
-                "rate": round(daily_rate, 4)
-            })
-            
-    return jsonify(chart_data), 200
+def _historical_rates(pairs, first, last):
+    """{(from, to): [(date, rate)]} of stored history (direct, or inverted) covering first-7d..last."""
+    currencies = {c for pair in pairs for c in pair}
+    direct = {}
+    for row in RateHistory.query.filter(
+        RateHistory.base_currency.in_(currencies), RateHistory.target_currency.in_(currencies),
+        RateHistory.date >= first - timedelta(days=7), RateHistory.date <= last,
+    ).order_by(RateHistory.date):
+        direct.setdefault((row.base_currency, row.target_currency), []).append((row.date, row.rate))
+    result = {}
+    for source, target in pairs:
+        if (source, target) in direct:
+            result[(source, target)] = direct[(source, target)]
+        elif (target, source) in direct:
+            result[(source, target)] = [(d, 1.0 / r) for d, r in direct[(target, source)] if r > 0]
+    return result
+
+@currency_bp.route('/convert', methods=['POST'])
+@jwt_required()
+def convert():
+    """
+    Convert many amounts in one call.
+    Body: {"items": [{"amount": 10, "from": "USD", "to": "RUB", "date": "2026-09-01"}, ...]}
+    Current rates come from one snapshot of the stored rates; dated items use
+    the stored daily rate on or up to a week before that date, else the
+    current rate (rate_date is then null). Invalid items and pairs no
+    source knows are reported in place and don't fail the others.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({"msg": "items must be a non-empty list"}), 400
+    if len(items) > current_app.config['CURRENCY_CONVERT_MAX_ITEMS']:
+        return jsonify({"msg": f"At most {current_app.config['CURRENCY_CONVERT_MAX_ITEMS']} items per request"}), 400
+
+    parsed = [_parse_convert_item(item) for item in items]
+    snapshot = rate_snapshot()
+    current = {}
+
+    def current_rate(source, target):
+        if source == target:
+            return 1.0
+        if (source, target) not in current:
+            if (source, target) in snapshot:
+                rate = snapshot[(source, target)]
+            elif snapshot.get((target, source), 0) > 0:
+                rate = 1.0 / snapshot[(target, source)]
+            else:
+                # Not stored yet: the usual lookup (provider, then stored for
+                # next time), None if no source knows the pair
+                rate = lookup_rate(source, target)
+            current[(source, target)] = rate
+        return current[(source, target)]
+
+    dated = [values for values, _ in parsed if values and values[3] and values[1] != values[2]]
+    history = {}
+    if dated:
+        history = _historical_rates({(s, t) for _, s, t, _ in dated},
+                                    min(d for *_, d in dated), max(d for *_, d in dated))
+
+    results = []
+    for index, (values, error) in enumerate(parsed):
+        if error:
+            results.append({"index": index, "status": "error", "error": error})
+            continue
+        amount, source, target, on = values
+        rate, rate_date = None, None
+        if on and source != target:
+            days = history.get((source, target), [])
+            i = bisect.bisect_right(days, (on, float('inf')))
+            if i and days[i - 1][0] >= on - timedelta(days=7):
+                rate_date, rate = days[i - 1]
+        if rate is None:
+            rate = current_rate(source, target)
+        if rate is None:
+            results.append({"index": index, "status": "error", "error": "Unknown currency pair"})
+            continue
+        results.append({
+            "index": index, "status": "ok",
+            "amount": amount, "from": source, "to": target, "date": on.isoformat() if on else None,
+            "rate": rate, "rate_date": rate_date.isoformat() if rate_date else None,
+            "converted": round(amount * rate, 2),
+        })
+    return jsonify({"results": results}), 200
 
 @currency_bp.route('/manual', methods=['POST'])
 @jwt_required()
@@ -211,6 +387,7 @@ def set_manual_rate():
             db.session.add(new_rate)
             
         db.session.commit()
+        valuation.revalue_pairs_later([(base, target)])
         return jsonify({"msg": "Rate updated manually"}), 200
     except Exception as e:
         db.session.rollback()
@@ -0,0 +1,83 @@
+from datetime import timedelta
+from flask import Blueprint, request, jsonify, Response, current_app
+from flask_jwt_extended import create_access_token, decode_token, get_jwt_identity, jwt_required
+from extensions import jwt
+import json
+import queue
+import time
+import events
+
+events_bp = Blueprint('events', __name__)
+
+# EventSource cannot set headers, so /stream takes its token in the URL,
+# where it ends up in access logs and browser history. That token is a
+# short-lived one (SSE_TOKEN_SECONDS) scoped to the stream alone, fetched
+# with the regular access token right before connecting.
+STREAM_SCOPE = 'events'
+
+@jwt.token_verification_loader
+def _not_a_stream_token(jwt_header, jwt_data):
+    # Stream tokens open /stream and nothing else
+    return jwt_data.get('scope') != STREAM_SCOPE
+
+@jwt.token_verification_failed_loader
+def _stream_token_used_elsewhere(jwt_header, jwt_data):
+    return jsonify({"msg": "Invalid token"}), 401
+
+def _format(evt_type, data):
+    return f"event: {evt_type}\ndata: {json.dumps(data)}\n\n"
+
+@events_bp.route('/token', methods=['POST'])
+@jwt_required()
+def stream_token():
+    """A token for one EventSource connection, valid for SSE_TOKEN_SECONDS."""
+    seconds = current_app.config['SSE_TOKEN_SECONDS']
+    token = create_access_token(identity=get_jwt_identity(), expires_delta=timedelta(seconds=seconds),
+                                additional_claims={'scope': STREAM_SCOPE})
+    return jsonify({"token": token, "expires_in": seconds}), 200
+
+@events_bp.route('/stream', methods=['GET'])
+def stream():
+    """
+    Server-Sent Events for the current user: transaction, balance and budget deltas.
+    Takes a stream token from POST /token as ?token=.
+    """
+    try:
+        claims = decode_token(request.args.get('token', ''))
+        user_id = int(claims['sub'])
+    except Exception:
+        return jsonify({"msg": "Invalid token"}), 401
+    if claims.get('scope') != STREAM_SCOPE:
+        return jsonify({"msg": "A stream token is required"}), 401
+
+    events.get_backend().start()
+    q = events.broker.subscribe(user_id, limit=current_app.config['SSE_MAX_STREAMS'])
+    if q is None:
+        response = jsonify({"msg": "Too many open streams"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '10'
+        return response
+
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+    # Streams end periodically so a worker thread is never pinned forever;
+    # EventSource reconnects on its own after the advertised retry delay.
+    deadline = time.monotonic() + current_app.config['SSE_MAX_SECONDS']
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while time.monotonic() < deadline:
+                try:
+                    evt = q.get(timeout=heartbeat)
+                    yield _format(evt['type'], evt['data'])
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            events.broker.unsubscribe(user_id, q)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    # Also frees the slot when the client is gone before the body is iterated
+    response.call_on_close(lambda: events.broker.unsubscribe(user_id, q))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # let nginx flush each event
+    return response
@@ -0,0 +1,11 @@
+from flask import Blueprint, request
+import storage
+
+files_bp = Blueprint('files', __name__)
+
+# Public by design: keys are content hashes (or random legacy names), and
+# <img> tags cannot send the bearer token.
+# ?size=<px> serves the closest pre-rendered thumbnail for images.
+@files_bp.route('/<path:key>', methods=['GET'])
+def get_file(key):
+    return storage.serve(key, request.args.get('size'))
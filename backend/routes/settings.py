@@ -2,14 +2,17 @@ from flask import Blueprint, request, jsonify, make_response, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import User, Transaction, Category, Budget
 from extensions import db
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from sqlalchemy import update
 import csv
 import io
 import os
-import uuid
 from datetime import datetime
 from routes.currencies import get_conversion_rate
+import profile_cache
+import passwords
+import ratelimit
+import storage
+import valuation
 from fpdf import FPDF
 
 settings_bp = Blueprint('settings', __name__)
@@ -66,6 +69,8 @@ def update_profile():
     
     if 'name' in data: 
         user.name = data['name']
+
+    revalue = False
     
     # Handle Currency Switch with Budget Recalculation
     if 'base_currency' in data and data['base_currency'] != user.base_currency:
@@ -75,26 +80,37 @@ def update_profile():
         # 1. Get conversion rate
         rate = get_conversion_rate(old_currency, new_currency)
         
-        # 2. Update all budgets
-        budgets = Budget.query.filter_by(user_id=user_id).all()
-        for b in budgets:
-            b.amount_limit = b.amount_limit * rate
+        # 2. Update all budgets in one statement
+        db.session.execute(
+            update(Budget).where(Budget.user_id == user_id)
+            .values(amount_limit=Budget.amount_limit * rate)
+            .execution_options(synchronize_session=False)
+        )
             
-        # 3. Update User
+        # 3. Update User; stored base amounts are revalued after commit
         user.base_currency = new_currency
+        revalue = True
     
     if 'new_password' in data and data['new_password']:
         if not data.get('old_password'):
              return jsonify({"msg": "Old password required to set new password"}), 400
         
-        if not check_password_hash(user.password_hash, data['old_password']):
-             return jsonify({"msg": "Incorrect old password"}), 400
-             
-        user.password_hash = generate_password_hash(data['new_password'])
+        try:
+            if not passwords.verify_password(user.password_hash, data['old_password']):
+                 return jsonify({"msg": "Incorrect old password"}), 400
+
+            user.password_hash = passwords.hash_password(data['new_password'])
+        except passwords.HashingBusy:
+            db.session.rollback()
+            return passwords.retry_response("Server busy, try again", 503, 1)
         
+    profile_cache.bump_version(user)
     db.session.commit()
+    if revalue:
+        valuation.revalue_user_later(user_id)
     return jsonify({
         "msg": "Profile updated", 
+        "token": profile_cache.issue_token(user),
         "user": {
             "name": user.name, 
             "email": user.email, 
@@ -106,23 +122,18 @@ def update_profile():
 def handle_file_upload(user, file, field_name):
     if file and allowed_file(file.filename):
         ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{field_name}_{user.id}_{uuid.uuid4().hex[:8]}.{ext}"
-        upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-        
-        if not os.path.exists(upload_folder):
-            os.makedirs(upload_folder)
-            
-        # Remove old file if exists
+        filename = storage.save_upload(file, ext)
+
+        # Drop the reference to the old file (removed once unreferenced)
         old_filename = getattr(user, field_name)
         if old_filename:
-            old_path = os.path.join(upload_folder, old_filename)
-            if os.path.exists(old_path):
-                try: os.remove(old_path)
-                except: pass
+            storage.release([old_filename])
 
-        file.save(os.path.join(upload_folder, filename))
         setattr(user, field_name, filename)
+        profile_cache.bump_version(user)
         db.session.commit()
+        if old_filename:
+            storage.collect_later([old_filename])
         return filename
     return None
 
@@ -137,11 +148,12 @@ def upload_avatar():
     
     filename = handle_file_upload(user, file, 'avatar')
     if filename:
-        return jsonify({"msg": "Avatar updated", "avatar": filename}), 200
+        return jsonify({"msg": "Avatar updated", "avatar": filename, "token": profile_cache.issue_token(user)}), 200
     return jsonify({"msg": "Invalid file type"}), 400
 
 @settings_bp.route('/import', methods=['POST'])
 @jwt_required()
+@ratelimit.limited(10)
 def import_csv():
     user_id = int(get_jwt_identity())
     
@@ -201,6 +213,7 @@ def get_filtered_transactions(user_id):
 
 @settings_bp.route('/export', methods=['GET'])
 @jwt_required()
+@ratelimit.limited(10)
 def export_data():
     user_id = int(get_jwt_identity())
     si = io.StringIO()
@@ -260,10 +273,11 @@ class CustomPDF(FPDF):
 
 @settings_bp.route('/export_pdf', methods=['GET'])
 @jwt_required()
+@ratelimit.limited(20)
 def export_pdf():
-    user_id = int(get_jwt_identity())
-    user = User.query.get(user_id)
-    base_currency = user.base_currency or 'RUB'
+    profile = profile_cache.current_profile()
+    user_id = profile['id']
+    base_currency = profile['base_currency']
     
     # Get language from query param, default to Russian if not set
     lang = request.args.get('lang', 'ru')
@@ -281,7 +295,7 @@ def export_pdf():
         pdf.set_font('Arial', '', 10)
     
     # Metadata
-    pdf.cell(0, 10, f"{texts['user']}: {user.name} ({user.email})", 0, 1)
+    pdf.cell(0, 10, f"{texts['user']}: {profile['name']} ({profile['email']})", 0, 1)
     pdf.cell(0, 10, f"{texts['date']}: {datetime.now().strftime('%Y-%m-%d')}", 0, 1)
     
     start_date = request.args.get('start_date') or 'Beginning'
@@ -309,12 +323,7 @@ def export_pdf():
     rate_cache = {}
     
     for t in transactions:
-        amount = t.amount
-        if t.currency != base_currency:
-             k = f"{t.currency}_{base_currency}"
-             if k not in rate_cache:
-                 rate_cache[k] = get_conversion_rate(t.currency, base_currency)
-             amount = t.amount * rate_cache[k]
+        amount = valuation.in_base(t, base_currency, rate_cache)
         
         if t.type == 'income': total_income += amount
         else: total_expense += amount
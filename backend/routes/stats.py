@@ -1,10 +1,11 @@
 from flask import Blueprint, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import Transaction
-from sqlalchemy import func, case, extract
+from sqlalchemy import func, case
 from extensions import db
-from datetime import datetime, timedelta
+from datetime import datetime
 import calendar
+from routes.analytics import period_range, bucket_start_expr, _as_date
 
 stats_bp = Blueprint('stats', __name__)
 
@@ -17,6 +18,7 @@ def dashboard_stats():
     now = datetime.utcnow()
     current_month = now.month
     current_year = now.year
+    month_start, month_end = period_range('month', now)
     
     # Total Balance (All time)
     income = db.session.query(func.sum(Transaction.amount)).filter_by(user_id=user_id, type='income').scalar() or 0
@@ -27,15 +29,15 @@ def dashboard_stats():
     total_income_month = db.session.query(func.sum(Transaction.amount)).filter(
         Transaction.user_id == user_id,
         Transaction.type == 'income',
-        extract('month', Transaction.date) == current_month,
-        extract('year', Transaction.date) == current_year
+        Transaction.date >= month_start,
+        Transaction.date < month_end
     ).scalar() or 0
 
     total_expense_month = db.session.query(func.sum(Transaction.amount)).filter(
         Transaction.user_id == user_id,
         Transaction.type == 'expense',
-        extract('month', Transaction.date) == current_month,
-        extract('year', Transaction.date) == current_year
+        Transaction.date >= month_start,
+        Transaction.date < month_end
     ).scalar() or 0
 
     # Recent Transactions
@@ -50,22 +52,19 @@ def dashboard_stats():
     } for t in recent]
 
     # Chart Data: Daily breakdown for the current month
+    day_col = bucket_start_expr('day', Transaction.date).label('day')
     daily_stats = db.session.query(
-        extract('day', Transaction.date).label('day'),
+        day_col,
         func.sum(case((Transaction.type == 'income', Transaction.amount), else_=0)).label('income'),
         func.sum(case((Transaction.type == 'expense', Transaction.amount), else_=0)).label('expense')
     ).filter(
         Transaction.user_id == user_id,
-        extract('month', Transaction.date) == current_month,
-        extract('year', Transaction.date) == current_year
-    ).group_by(
-        extract('day', Transaction.date)
-    ).order_by(
-        extract('day', Transaction.date)
-    ).all()
+        Transaction.date >= month_start,
+        Transaction.date < month_end
+    ).group_by(day_col).order_by(day_col).all()
 
     # Create a map for existing data
-    data_map = {int(d.day): {"income": float(d.income), "expense": float(d.expense)} for d in daily_stats}
+    data_map = {_as_date(d.day).day: {"income": float(d.income), "expense": float(d.expense)} for d in daily_stats}
 
     # Fill in all days of the month (1 to last day)
     _, last_day = calendar.monthrange(current_year, current_month)
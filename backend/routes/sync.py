@@ -0,0 +1,16 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+import sync
+
+sync_bp = Blueprint('sync', __name__)
+
+@sync_bp.route('', methods=['GET'])
+@jwt_required()
+def get_changes():
+    """Delta sync: pass the token from the previous response as ?since= (omit for a full sync)."""
+    user_id = int(get_jwt_identity())
+    try:
+        since = int(request.args.get('since') or 0)
+    except ValueError:
+        return jsonify({"msg": "Invalid sync token"}), 400
+    return jsonify(sync.changes_since(user_id, max(since, 0))), 200
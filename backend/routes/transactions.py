@@ -1,11 +1,15 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import Transaction, Category, User
 from extensions import db
+from sqlalchemy import insert, update, delete, case
 from datetime import datetime
-import os
-import uuid
-from routes.currencies import get_conversion_rate
+from profile_cache import current_profile
+import storage
+import sync
+import events
+import balances
+import valuation
 
 trans_bp = Blueprint('transactions', __name__)
 
@@ -14,6 +18,10 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def parse_txn_date(date_str):
+    # Handle potential Z suffix
+    return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+
 def get_all_child_ids(parent_id):
     """Recursively fetch all child category IDs."""
     ids = [parent_id]
@@ -22,21 +30,17 @@ def get_all_child_ids(parent_id):
         ids.extend(get_all_child_ids(child.id))
     return ids
 
-@trans_bp.route('/', methods=['GET'])
-@jwt_required()
-def get_transactions():
-    user_id = int(get_jwt_identity())
-    user = User.query.get(user_id)
-    base_currency = user.base_currency or 'RUB'
-    
+TRANSACTION_FILTERS = ('type', 'category_id', 'start_date', 'end_date', 'search')
+
+def filter_transactions(user_id, args):
+    """User's transactions narrowed by the listing filters (type, category subtree, dates, search)."""
     query = Transaction.query.filter_by(user_id=user_id)
     
-    # Filters
-    t_type = request.args.get('type')
+    t_type = args.get('type')
     if t_type and t_type != 'all':
         query = query.filter_by(type=t_type)
         
-    category_id = request.args.get('category_id')
+    category_id = args.get('category_id')
     if category_id:
         try:
             cat_id_int = int(category_id)
@@ -46,49 +50,172 @@ def get_transactions():
         except ValueError:
             pass # Invalid ID format
         
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
+    start_date = args.get('start_date')
+    end_date = args.get('end_date')
     if start_date:
         query = query.filter(Transaction.date >= start_date)
     if end_date:
         query = query.filter(Transaction.date <= end_date)
         
-    search = request.args.get('search')
+    search = args.get('search')
     if search:
         query = query.filter(Transaction.description.ilike(f'%{search}%'))
 
-    transactions = query.order_by(Transaction.date.desc()).all()
-    
-    result = []
+    return query
+
+# Listing fields (the default, in order) and the Transaction columns each one reads
+TRANSACTION_FIELDS = {
+    'id': ('id',),
+    'amount': ('amount',),
+    'currency': ('currency',),
+    'amount_in_base': ('amount', 'currency', 'amount_in_base', 'base_currency'),
+    'base_currency': (),
+    'description': ('description',),
+    'date': ('date',),
+    'type': ('type',),
+    'category_id': ('category_id',),
+    'category_name': ('category_id',),
+    'category_color': ('category_id',),
+    'tags': ('tags',),
+    'attachment': ('attachment',),
+}
+# Sent once per response in format=columnar instead of once per row
+COLUMNAR_SHARED = ('base_currency', 'category_name', 'category_color')
+
+def requested_fields(args):
+    """Fields asked for with ?fields=a,b (all by default). Raises ValueError naming unknown ones."""
+    if not args.get('fields'):
+        return list(TRANSACTION_FIELDS)
+    fields = list(dict.fromkeys(f.strip() for f in args['fields'].split(',') if f.strip()))
+    unknown = [f for f in fields if f not in TRANSACTION_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}" if unknown else "fields is empty")
+    return fields
+
+def select_fields(query, fields):
+    """Narrow the listing query to the columns `fields` read, so nothing else is fetched."""
+    columns = dict.fromkeys(c for f in fields for c in TRANSACTION_FIELDS[f]) or ('id',)
+    return query.with_entities(*(getattr(Transaction, c) for c in columns))
+
+def field_getters(fields, base_currency):
+    """(field, fn(row)) pairs; categories and rates are looked up once per response."""
     rate_cache = {}
-    
-    for t in transactions:
-        cat = Category.query.get(t.category_id)
-        
-        # Calculate amount in User's Base Currency
-        amount_in_base = t.amount
-        if t.currency != base_currency:
-             k = f"{t.currency}_{base_currency}"
-             if k not in rate_cache:
-                 rate_cache[k] = get_conversion_rate(t.currency, base_currency)
-             amount_in_base = t.amount * rate_cache[k]
-
-        result.append({
-            "id": t.id,
-            "amount": t.amount,
-            "currency": t.currency,
-            "amount_in_base": round(amount_in_base, 2),
-            "base_currency": base_currency,
-            "description": t.description,
-            "date": t.date.isoformat(),
-            "type": t.type,
-            "category_id": t.category_id,
-            "category_name": cat.name if cat else "Unknown",
-            "category_color": cat.color if cat else "#000000",
-            "tags": t.tags,
-            "attachment": t.attachment
-        })
-    return jsonify(result), 200
+    categories = {}
+
+    def category(cat_id):
+        if cat_id not in categories:
+            categories[cat_id] = Category.query.get(cat_id) if cat_id is not None else None
+        return categories[cat_id]
+
+    getters = {
+        'id': lambda t: t.id,
+        'amount': lambda t: t.amount,
+        'currency': lambda t: t.currency,
+        # Stored at write time; converted here only if stale
+        'amount_in_base': lambda t: round(valuation.in_base(t, base_currency, rate_cache), 2),
+        'base_currency': lambda t: base_currency,
+        'description': lambda t: t.description,
+        'date': lambda t: t.date.isoformat(),
+        'type': lambda t: t.type,
+        'category_id': lambda t: t.category_id,
+        'category_name': lambda t: cat.name if (cat := category(t.category_id)) else "Unknown",
+        'category_color': lambda t: cat.color if (cat := category(t.category_id)) else "#000000",
+        'tags': lambda t: t.tags,
+        'attachment': lambda t: t.attachment,
+    }
+    return [(f, getters[f]) for f in fields], category
+
+def _columnar(rows, fields, base_currency):
+    """
+    Parallel arrays, one per field, with per-response values sent once:
+    base_currency at the top and category name/color in a dictionary keyed
+    by category_id (ids without a category are left out of it).
+    """
+    wants_categories = any(f in fields for f in ('category_name', 'category_color'))
+    columns = [f for f in fields if f not in COLUMNAR_SHARED]
+    if wants_categories and 'category_id' not in columns:
+        columns.append('category_id')
+    getters, category = field_getters(columns, base_currency)
+
+    values = {f: [] for f in columns}
+    for t in rows:
+        for f, get in getters:
+            values[f].append(get(t))
+
+    result = {"count": len(rows), "columns": values}
+    if 'base_currency' in fields:
+        result["base_currency"] = base_currency
+    if wants_categories:
+        result["categories"] = {}
+        for cat_id in dict.fromkeys(values['category_id']):
+            cat = category(cat_id)
+            if cat:
+                result["categories"][cat_id] = {"name": cat.name, "color": cat.color}
+    return result
+
+def _stream_transactions(query, fields, base_currency, ndjson):
+    """
+    Encode the listing batch by batch from a yield_per cursor (server-side
+    on Postgres), so memory stays flat however long the history is and
+    the first rows go out before the last are read.
+    """
+    encode = current_app.json.dumps
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+    getters, _ = field_getters(fields, base_currency)
+
+    def generate():
+        if not ndjson:
+            yield "["
+        first = True
+        chunk = []
+        for t in query.yield_per(batch_size):
+            row = encode({f: get(t) for f, get in getters})
+            if ndjson:
+                chunk.append(row + "\n")
+            else:
+                chunk.append(row if first else "," + row)
+            first = False
+            if len(chunk) >= batch_size:
+                yield "".join(chunk)
+                chunk = []
+        yield "".join(chunk)
+        if not ndjson:
+            yield "]"
+
+    response = Response(stream_with_context(generate()),
+                        mimetype='application/x-ndjson' if ndjson else 'application/json')
+    response.headers['X-Accel-Buffering'] = 'no'  # let nginx pass batches on as they are written
+    return response
+
+@trans_bp.route('/', methods=['GET'])
+@jwt_required()
+def get_transactions():
+    profile = current_profile()
+    user_id = profile['id']
+    base_currency = profile['base_currency']
+
+    try:
+        fields = requested_fields(request.args)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    columnar = request.args.get('format') == 'columnar'
+
+    query = select_fields(filter_transactions(user_id, request.args), fields).order_by(Transaction.date.desc())
+
+    # stream=1 for full-history exports: same rows, written incrementally
+    if request.args.get('stream') == '1':
+        if columnar:
+            return jsonify({"msg": "format=columnar can't be streamed"}), 400
+        ndjson = (request.args.get('format') == 'ndjson'
+                  or request.accept_mimetypes.best == 'application/x-ndjson')
+        return _stream_transactions(query, fields, base_currency, ndjson)
+
+    rows = query.all()
+    if columnar:
+        return jsonify(_columnar(rows, fields, base_currency)), 200
+
+    getters, _ = field_getters(fields, base_currency)
+    return jsonify([{f: get(t) for f, get in getters} for t in rows]), 200
 
 @trans_bp.route('/', methods=['POST'])
 @jwt_required()
@@ -111,11 +238,15 @@ def add_transaction():
     currency = data.get('currency', 'RUB')
     tags = data.get('tags', '')
 
+    # Validate before storing the attachment, so a rejected request leaves no blob
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Invalid amount"}), 400
+
     try:
         if date_str:
-            # Handle potential Z suffix
-            date_str = date_str.replace('Z', '+00:00')
-            txn_date = datetime.fromisoformat(date_str)
+            txn_date = parse_txn_date(date_str)
         else:
             txn_date = datetime.utcnow()
     except:
@@ -124,14 +255,10 @@ def add_transaction():
     filename = None
     if file and allowed_file(file.filename):
         ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4()}.{ext}"
-        upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-        if not os.path.exists(upload_folder):
-            os.makedirs(upload_folder)
-        file.save(os.path.join(upload_folder, filename))
+        filename = storage.save_upload(file, ext)
 
     new_trans = Transaction(
-        amount=float(amount),
+        amount=amount,
         description=desc,
         date=txn_date,
         type=t_type,
@@ -159,7 +286,7 @@ def update_transaction(id):
     if 'currency' in data: trans.currency = data['currency'].upper()
     if 'date' in data and data['date']: 
          try:
-            trans.date = datetime.fromisoformat(data['date'].replace('Z', '+00:00'))
+            trans.date = parse_txn_date(data['date'])
          except: pass
     
     db.session.commit()
@@ -170,11 +297,280 @@ def update_transaction(id):
 def delete_transaction(id):
     user_id = int(get_jwt_identity())
     trans = Transaction.query.filter_by(id=id, user_id=user_id).first_or_404()
-    if trans.attachment:
-        path = os.path.join(current_app.root_path, 'static', 'uploads', trans.attachment)
-        if os.path.exists(path):
-            try: os.remove(path)
-            except: pass
+    attachment = trans.attachment
+    storage.release([attachment])
     db.session.delete(trans)
     db.session.commit()
+    storage.collect_later([attachment])
     return jsonify({"msg": "Deleted"}), 200
+
+
+BATCH_UPDATE_FIELDS = ('amount', 'description', 'category_id', 'currency', 'date')
+
+def _validate_batch_fields(item, allowed_cat_ids, creating):
+    """Return (column values, error message) for a create/update payload."""
+    values = {}
+    if 'amount' in item or creating:
+        try:
+            values['amount'] = float(item.get('amount'))
+        except (TypeError, ValueError):
+            return None, "Invalid amount"
+    if 'category_id' in item or creating:
+        try:
+            values['category_id'] = int(item.get('category_id'))
+        except (TypeError, ValueError):
+            return None, "Invalid category_id"
+        if values['category_id'] not in allowed_cat_ids:
+            return None, "Unknown category"
+    if 'currency' in item or creating:
+        currency = (item.get('currency') or 'RUB').upper()
+        if len(currency) != 3:
+            return None, "Invalid currency"
+        values['currency'] = currency
+    if item.get('date'):
+        try:
+            values['date'] = parse_txn_date(item['date'])
+        except (TypeError, ValueError):
+            return None, "Invalid date"
+    if 'description' in item:
+        values['description'] = item['description']
+    if creating:
+        if item.get('type') not in ('income', 'expense'):
+            return None, "Invalid type"
+        values['type'] = item['type']
+        values['tags'] = item.get('tags', '')
+        values.setdefault('date', datetime.utcnow())
+    return values, None
+
+@trans_bp.route('/batch', methods=['POST'])
+@jwt_required()
+def batch_transactions():
+    """
+    Apply many create/update/delete operations in one DB transaction.
+    Body: {"operations": [{"op": "create", ...}, {"op": "update", "id": 1, ...}, {"op": "delete", "id": 2}]}
+    Either every operation is applied or none is.
+    """
+    user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"msg": "operations must be a non-empty list"}), 400
+    if len(operations) > current_app.config['BATCH_MAX_OPERATIONS']:
+        return jsonify({"msg": f"At most {current_app.config['BATCH_MAX_OPERATIONS']} operations per batch"}), 400
+
+    # Resolve everything the validation needs with two queries
+    referenced_ids = set()
+    for item in operations:
+        if isinstance(item, dict) and item.get('op') in ('update', 'delete'):
+            try: referenced_ids.add(int(item.get('id')))
+            except (TypeError, ValueError): pass
+    owned = {}
+    if referenced_ids:
+        rows = db.session.query(
+            Transaction.id, Transaction.attachment, Transaction.date, Transaction.amount, Transaction.currency,
+            Transaction.type, Transaction.category_id
+        ).filter(Transaction.user_id == user_id, Transaction.id.in_(referenced_ids)).all()
+        owned = {r.id: r.attachment for r in rows}
+        owned_dates = {r.id: r.date for r in rows}
+        owned_amounts = {r.id: (r.amount, r.currency) for r in rows}
+        owned_values = {r.id: events.values_of(r) for r in rows}
+    allowed_cat_ids = {c.id for c in db.session.query(Category.id).filter(
+        (Category.user_id == user_id) | (Category.user_id == None)
+    )}
+
+    creates, updates, delete_ids = [], [], []
+    results = []
+    has_errors = False
+    touched = set()
+
+    for index, item in enumerate(operations):
+        op = item.get('op') if isinstance(item, dict) else None
+        error = None
+        if op == 'create':
+            values, error = _validate_batch_fields(item, allowed_cat_ids, creating=True)
+            if not error:
+                values['user_id'] = user_id
+                creates.append((index, values))
+        elif op in ('update', 'delete'):
+            try:
+                txn_id = int(item.get('id'))
+            except (TypeError, ValueError):
+                txn_id = None
+            if txn_id not in owned:
+                error = "Transaction not found"
+            elif txn_id in touched:
+                error = "Transaction referenced twice"
+            elif op == 'update':
+                fields = {k: item[k] for k in BATCH_UPDATE_FIELDS if k in item}
+                values, error = _validate_batch_fields(fields, allowed_cat_ids, creating=False)
+                if not error:
+                    values['id'] = txn_id
+                    updates.append((index, values))
+            else:
+                delete_ids.append((index, txn_id))
+            if txn_id is not None:
+                touched.add(txn_id)
+        else:
+            error = "op must be one of create, update, delete"
+
+        if error:
+            has_errors = True
+        results.append({"index": index, "op": op, "status": "error" if error else "ok", "error": error})
+
+    if has_errors:
+        return jsonify({"msg": "Validation failed, nothing was applied", "results": results}), 400
+
+    try:
+        # Bulk statements bypass the ORM flush hook, so stamp sync versions here
+        version = sync.next_version(user_id)
+        for _, values in creates + updates:
+            sync.stamp(values, version)
+        base_currency = db.session.query(User.base_currency).filter(User.id == user_id).scalar() or 'RUB'
+        rate_cache = {}
+        for _, values in creates:
+            valuation.stamp(values, base_currency, rate_cache)
+        for _, values in updates:
+            if 'amount' in values or 'currency' in values:
+                amount, currency = owned_amounts[values['id']]
+                values.setdefault('amount', amount)
+                values.setdefault('currency', currency)
+                valuation.stamp(values, base_currency, rate_cache)
+        balances.invalidate(user_id,
+            [values.get('date') for _, values in creates + updates]
+            + [owned_dates[values['id']] for _, values in updates if balances.BALANCE_FIELDS & values.keys()]
+            + [owned_dates[txn_id] for _, txn_id in delete_ids])
+
+        if creates:
+            new_ids = db.session.scalars(
+                insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True),
+                [values for _, values in creates]
+            ).all()
+            for (index, _), new_id in zip(creates, new_ids):
+                results[index].update(status="created", id=new_id)
+        if updates:
+            db.session.execute(update(Transaction), [values for _, values in updates])
+            for index, values in updates:
+                results[index].update(status="updated", id=values['id'])
+        if delete_ids:
+            db.session.execute(
+                delete(Transaction).where(
+                    Transaction.user_id == user_id,
+                    Transaction.id.in_([txn_id for _, txn_id in delete_ids])
+                )
+            )
+            for index, txn_id in delete_ids:
+                results[index].update(status="deleted", id=txn_id)
+            sync.record_deletes(user_id, 'transaction', [txn_id for _, txn_id in delete_ids], version)
+            storage.release([owned[txn_id] for _, txn_id in delete_ids])
+        # Balance and budget effects, as the single-item endpoints produce
+        events.emit_changes(user_id,
+            [{'old': None, 'new': {f: values[f] for f in events.TRACKED_FIELDS}} for _, values in creates]
+            + [{'old': owned_values[values['id']],
+                'new': dict(owned_values[values['id']], **{f: values[f] for f in events.TRACKED_FIELDS if f in values})}
+               for _, values in updates]
+            + [{'old': owned_values[txn_id], 'new': None} for _, txn_id in delete_ids])
+        events.emit(user_id, 'transactions_changed', {
+            'created': len(creates), 'updated': len(updates), 'deleted': len(delete_ids)
+        })
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Batch failed, nothing was applied", "error": str(e)}), 500
+
+    # Files are only removed once the rows are definitely gone
+    storage.collect_later([owned[txn_id] for _, txn_id in delete_ids])
+
+    for r in results:
+        r.pop('error')
+    return jsonify({"msg": "Batch applied", "results": results}), 200
+
+
+def _bulk_request():
+    """Filters come from the query string (same names as the listing), options from the JSON body."""
+    data = request.get_json(silent=True) or {}
+    args = {k: request.args.get(k) for k in TRANSACTION_FILTERS if request.args.get(k)}
+    dry_run = bool(data.get('dry_run')) or request.args.get('dry_run') in ('1', 'true')
+    return data, args, dry_run
+
+@trans_bp.route('/bulk/recategorize', methods=['POST'])
+@jwt_required()
+def bulk_recategorize():
+    user_id = int(get_jwt_identity())
+    data, args, dry_run = _bulk_request()
+
+    try:
+        target_id = int(data.get('category_id'))
+    except (TypeError, ValueError):
+        return jsonify({"msg": "category_id is required"}), 400
+    target = Category.query.filter(
+        Category.id == target_id,
+        (Category.user_id == user_id) | (Category.user_id == None)
+    ).first()
+    if not target:
+        return jsonify({"msg": "Unknown category"}), 400
+
+    query = filter_transactions(user_id, args)
+    if dry_run:
+        return jsonify({"matched": query.count(), "dry_run": True}), 200
+
+    events.emit_changes(user_id, events.query_changes(query, {'category_id': target_id}))
+    values = sync.stamp({'category_id': target_id}, sync.next_version(user_id))
+    count = query.update(values, synchronize_session=False)
+    events.emit(user_id, 'transactions_changed', {'updated': count})
+    db.session.commit()
+    return jsonify({"msg": "Transactions recategorized", "matched": count}), 200
+
+@trans_bp.route('/bulk/retag', methods=['POST'])
+@jwt_required()
+def bulk_retag():
+    user_id = int(get_jwt_identity())
+    data, args, dry_run = _bulk_request()
+
+    tags = (data.get('tags') or '').strip()
+    mode = data.get('mode', 'replace')
+    if mode not in ('replace', 'append'):
+        return jsonify({"msg": "mode must be replace or append"}), 400
+    if mode == 'append' and not tags:
+        return jsonify({"msg": "tags are required"}), 400
+
+    query = filter_transactions(user_id, args)
+    if dry_run:
+        return jsonify({"matched": query.count(), "dry_run": True}), 200
+
+    if mode == 'replace':
+        new_value = tags
+    else:
+        new_value = case(
+            ((Transaction.tags == None) | (Transaction.tags == ''), tags),
+            else_=Transaction.tags + ',' + tags
+        )
+    values = sync.stamp({'tags': new_value}, sync.next_version(user_id))
+    count = query.update(values, synchronize_session=False)
+    events.emit(user_id, 'transactions_changed', {'updated': count})
+    db.session.commit()
+    return jsonify({"msg": "Transactions retagged", "matched": count}), 200
+
+@trans_bp.route('/bulk/delete', methods=['POST'])
+@jwt_required()
+def bulk_delete():
+    user_id = int(get_jwt_identity())
+    data, args, dry_run = _bulk_request()
+
+    # Refuse to wipe the whole history by accident
+    if not args and not data.get('all'):
+        return jsonify({"msg": "At least one filter is required (or pass all=true)"}), 400
+
+    query = filter_transactions(user_id, args)
+    if dry_run:
+        return jsonify({"matched": query.count(), "dry_run": True}), 200
+
+    attachments = [a for (a,) in query.filter(Transaction.attachment != None).with_entities(Transaction.attachment)]
+    balances.invalidate_from_query(user_id, query)
+    events.emit_changes(user_id, events.query_changes(query))
+    sync.record_deletes_from_query(user_id, 'transaction', query, sync.next_version(user_id))
+    count = query.delete(synchronize_session=False)
+    events.emit(user_id, 'transactions_changed', {'deleted': count})
+    storage.release(attachments)
+    db.session.commit()
+    storage.collect_later(attachments)
+    return jsonify({"msg": "Transactions deleted", "matched": count}), 200
@@ -0,0 +1,134 @@
+import threading
+import time
+from flask import current_app, g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+import metrics
+
+# Read-replica routing and per-route statement timeouts for db.session.
+#
+# With DATABASE_REPLICA_URL set, GET requests to the routes listed in
+# DATABASE_REPLICA_ROUTES (blueprint or endpoint names) run their plain
+# SELECTs on the "replica" bind. Everything else stays on the primary:
+# flushes, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE, text() statements,
+# and every read in a session after it has done one of those.
+#
+# Read-your-writes: a successful write request by a user pins that user's
+# reads to the primary for DATABASE_REPLICA_STICKY_SECONDS, both in the
+# worker (by user id) and through a cookie, so the pin holds whichever
+# worker serves the next request.
+#
+# With SHARD_URLS set, statements on user tables first go to the user's
+# shard (see shards.py); replica routing applies to the default database.
+#
+# Statement timeouts are applied with SET LOCAL at the start of each
+# transaction, which also works behind PgBouncer in transaction mode.
+
+REPLICA_BIND = 'replica'
+STICKY_COOKIE = 'db_primary_until'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_sticky_lock = threading.Lock()
+_sticky = {}
+
+def _user_id():
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+def _route_names():
+    return (request.blueprint, request.endpoint)
+
+def _is_sticky():
+    now = time.time()
+    try:
+        if float(request.cookies.get(STICKY_COOKIE, 0)) > now:
+            return True
+    except ValueError:
+        pass
+    user_id = _user_id()
+    if user_id is None:
+        return False
+    with _sticky_lock:
+        return _sticky.get(user_id, 0) > now
+
+def use_replica():
+    """Whether reads of the current request may go to the replica (decided once per request)."""
+    if not has_request_context():
+        return False
+    decision = g.get('db_use_replica')
+    if decision is None:
+        routes = current_app.config['DATABASE_REPLICA_ROUTES']
+        decision = (
+            request.method == 'GET'
+            and any(name in routes for name in _route_names() if name)
+            and not _is_sticky()
+        )
+        g.db_use_replica = decision
+        metrics.inc('db_route_total', target='replica' if decision else 'primary')
+    return decision
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engines = self._db.engines
+        is_read = (
+            not self._flushing
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+        )
+        if bind is None and current_app.config['SHARD_URLS']:
+            import shards
+
+            # User tables go to the user's shard; the "default" shard continues below
+            shard = shards.route(self, mapper, clause, is_write=self._flushing or isinstance(clause, UpdateBase)
+                                 or (isinstance(clause, Select) and not is_read))
+            if shard not in (None, shards.DEFAULT_SHARD):
+                return engines[shard]
+        if bind is None and REPLICA_BIND in engines and not self.info.get('primary'):
+            if is_read and use_replica():
+                return engines[REPLICA_BIND]
+            if not is_read and (self._flushing or clause is not None):
+                # Anything after a write or lock in this session must see it
+                self.info['primary'] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def statement_timeout():
+    """Timeout (ms) for the current request: the most specific DB_STATEMENT_TIMEOUTS entry, else the default."""
+    config = current_app.config
+    timeouts = config['DB_STATEMENT_TIMEOUTS']
+    for name in reversed(_route_names()):
+        if name in timeouts:
+            return timeouts[name]
+    return config['DB_STATEMENT_TIMEOUT_MS']
+
+@event.listens_for(RoutingSession, 'after_begin')
+def _set_statement_timeout(session, transaction, connection):
+    if not has_request_context() or connection.dialect.name != 'postgresql':
+        return
+    timeout = statement_timeout()
+    if timeout:
+        connection.execute(text(f"SET LOCAL statement_timeout = {int(timeout)}"))
+
+def init_app(app):
+    @app.after_request
+    def _pin_writers_to_primary(response):
+        if (REPLICA_BIND not in app.config['SQLALCHEMY_BINDS']
+                or request.method not in WRITE_METHODS or response.status_code >= 400):
+            return response
+        until = time.time() + app.config['DATABASE_REPLICA_STICKY_SECONDS']
+        user_id = _user_id()
+        if user_id is not None:
+            with _sticky_lock:
+                _sticky[user_id] = until
+                # Opportunistic cleanup so users who stopped writing don't accumulate
+                if len(_sticky) > 10000:
+                    now = time.time()
+                    for stale in [k for k, v in _sticky.items() if v <= now]:
+                        del _sticky[stale]
+        response.set_cookie(STICKY_COOKIE, f"{until:.3f}", max_age=app.config['DATABASE_REPLICA_STICKY_SECONDS'],
+                            httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,356 @@
+"""
+User-id sharding across several databases.
+
+The default database holds the global tables (user directory, exchange
+rates, stored files, rate-limit buckets) and is itself the shard named
+"default". SHARD_URLS adds more shards as Flask-SQLAlchemy binds. A user
+lives entirely on one shard: the user row and all of their categories,
+transactions, budgets, tombstones and balance checkpoints.
+
+user_directory (on the default database) maps every user id and email to
+its shard. User ids are allocated there, so they are unique across
+shards, and login/registration resolve emails through it. db.session
+picks the shard per session (see routing.py): the authenticated user's
+during requests, or whatever use()/use_shard() selected in background
+jobs and commands. Statements on user tables with no shard selected are
+refused rather than silently run on the default database.
+
+Currencies and system categories are reference data: maintained on the
+default database and copied, with their ids, to every shard by
+sync_reference_data() (run by startup.py).
+
+`python shards.py move USER_ID SHARD` moves one user between shards while
+the app is running: the user is marked as moving and their writes get 503
+(reads keep working), the data is copied in one transaction on the
+target, the directory switches over and the source rows are deleted.
+Row ids are allocated anew on the target, so the move raises the user's
+sync floor and clients do one full re-sync.
+"""
+import argparse
+import sys
+import threading
+import time
+from flask import current_app, has_request_context
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import Table, select, insert, update, delete, func, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import visitors
+from extensions import db
+from models import User, Category, Currency, Transaction, Budget, Tombstone, BalanceCheckpoint, UserDirectory
+import metrics
+
+DEFAULT_SHARD = 'default'
+ACTIVE = 'active'
+MOVING = 'moving'
+SHARDED_TABLES = frozenset(('user', 'transaction', 'budget', 'tombstone', 'balance_checkpoint'))
+# Present on every shard; without a selected shard they are read from the default database
+REFERENCE_TABLES = frozenset(('category', 'currency'))
+COPY_CHUNK_SIZE = 1000
+
+class NoShardSelected(RuntimeError):
+    pass
+
+class UserMoving(Exception):
+    pass
+
+_lock = threading.Lock()
+_directory = {}
+
+def names():
+    return [DEFAULT_SHARD] + list(current_app.config['SHARD_URLS'])
+
+def is_sharded():
+    return bool(current_app.config['SHARD_URLS'])
+
+def engine(name):
+    return db.engine if name == DEFAULT_SHARD else db.engines[name]
+
+# --- Directory ------------------------------------------------------------
+
+def lookup(user_id):
+    """(shard, status) of a user, cached per worker for SHARD_DIRECTORY_TTL seconds."""
+    now = time.monotonic()
+    with _lock:
+        cached = _directory.get(user_id)
+    if cached and cached[2] > now:
+        return cached[0], cached[1]
+
+    # Read-only: may run while this thread's session holds the SQLite write lock
+    with db.engine.connect().execution_options(sqlite_begin='DEFERRED') as conn:
+        row = conn.execute(
+            select(UserDirectory.shard, UserDirectory.status).where(UserDirectory.id == user_id)
+        ).first()
+    shard, status = row if row else (DEFAULT_SHARD, ACTIVE)
+    metrics.inc('shard_directory_lookups_total')
+    with _lock:
+        _directory[user_id] = (shard, status, now + current_app.config['SHARD_DIRECTORY_TTL'])
+        if len(_directory) > 10000:
+            for stale in [k for k, v in _directory.items() if v[2] <= now]:
+                del _directory[stale]
+    return shard, status
+
+def find_email(email):
+    """Directory row (id, shard, status) for an email, or None."""
+    with db.engine.connect().execution_options(sqlite_begin='DEFERRED') as conn:
+        return conn.execute(
+            select(UserDirectory.id, UserDirectory.shard, UserDirectory.status)
+            .where(UserDirectory.email == email)
+        ).first()
+
+def place(conn):
+    """Shard for a new user: the one in SHARD_NEW_USERS (default: all shards) with the fewest users."""
+    candidates = current_app.config['SHARD_NEW_USERS'] or names()
+    counts = dict(conn.execute(
+        select(UserDirectory.shard, func.count()).group_by(UserDirectory.shard)
+    ).all())
+    return min(candidates, key=lambda name: counts.get(name, 0))
+
+def allocate(email):
+    """Reserve a user id and shard for a new email. Returns (user_id, shard), or None if the email is taken."""
+    try:
+        with db.engine.begin() as conn:
+            shard = place(conn)
+            user_id = conn.execute(
+                insert(UserDirectory).values(email=email, shard=shard, status=ACTIVE)
+            ).inserted_primary_key[0]
+    except IntegrityError:
+        return None
+    return user_id, shard
+
+def release(user_id):
+    """Undo allocate() when creating the user failed."""
+    with db.engine.begin() as conn:
+        conn.execute(delete(UserDirectory).where(UserDirectory.id == user_id))
+
+def _set_directory(user_id, **values):
+    with db.engine.begin() as conn:
+        conn.execute(update(UserDirectory).where(UserDirectory.id == user_id).values(**values))
+    with _lock:
+        _directory.pop(user_id, None)
+
+# --- Session routing ------------------------------------------------------
+
+def use(user_id, session=None):
+    """Route the session to the shard of `user_id`."""
+    session = session or db.session
+    session.info['shard'] = lookup(user_id)[0]
+    session.info['shard_user'] = user_id
+    return session.info['shard']
+
+def use_shard(name, session=None):
+    """Route the session to a shard regardless of user (whole-shard jobs)."""
+    session = session or db.session
+    session.info['shard'] = name
+    session.info['shard_user'] = None
+
+def _session_shard(session):
+    if 'shard' not in session.info and has_request_context():
+        try:
+            identity = get_jwt_identity()
+        except RuntimeError:
+            identity = None
+        if identity is not None:
+            use(int(identity), session)
+    return session.info.get('shard'), session.info.get('shard_user')
+
+def _tables(mapper, clause):
+    if mapper is not None:
+        return {mapper.local_table.name} if hasattr(mapper, 'local_table') else {mapper.__table__.name}
+    if clause is not None:
+        return {t.name for t in visitors.iterate(clause) if isinstance(t, Table)}
+    return set()
+
+def route(session, mapper, clause, is_write):
+    """Shard a statement must run on, or None for the default database."""
+    tables = _tables(mapper, clause)
+    sharded = tables & SHARDED_TABLES
+    if not sharded and not tables & REFERENCE_TABLES:
+        return None
+    name, user_id = _session_shard(session)
+    if name is None:
+        if sharded:
+            raise NoShardSelected(f"No shard selected for a statement on {', '.join(sorted(sharded))}")
+        return None
+    if is_write and user_id is not None and lookup(user_id)[1] == MOVING:
+        metrics.inc('shard_writes_rejected_total')
+        raise UserMoving(user_id)
+    return name
+
+def init_app(app):
+    from passwords import retry_response
+
+    @app.errorhandler(UserMoving)
+    def _user_moving(e):
+        retry_after = int(app.config['SHARD_DIRECTORY_TTL'] * 2) + 1
+        return retry_response("Your data is being moved, please retry shortly", 503, retry_after)
+
+# --- Reference data -------------------------------------------------------
+
+def _upsert_by_id(conn, table, rows, key, guard=None):
+    written = 0
+    for row in rows:
+        condition = table.c[key] == row[key]
+        if guard is not None:
+            condition = condition & guard
+        if conn.execute(update(table).where(condition).values(**row)).rowcount:
+            written += 1
+        elif conn.execute(select(table.c[key]).where(table.c[key] == row[key])).first():
+            print(f"Reference {table.name} {row[key]} conflicts with a user row on {conn.engine.url.database}, skipped")
+        else:
+            conn.execute(insert(table).values(**row))
+            written += 1
+    return written
+
+def sync_reference_data(source, targets):
+    """Copy currencies and system categories from the default database to every other shard."""
+    with source.connect() as conn:
+        currencies = [dict(r) for r in conn.execute(select(Currency.__table__)).mappings()]
+        # Parents before children
+        categories = [dict(r) for r in conn.execute(
+            select(Category.__table__).where(Category.user_id == None)
+            .order_by(Category.parent_id.is_not(None), Category.id)
+        ).mappings()]
+
+    category = Category.__table__
+    for target in targets:
+        with target.begin() as conn:
+            _upsert_by_id(conn, Currency.__table__, currencies, 'code')
+            _upsert_by_id(conn, category, categories, 'id', guard=category.c.user_id == None)
+            if conn.dialect.name == 'postgresql':
+                # Explicit ids don't advance the sequence; keep new user categories clear of them
+                conn.execute(text(
+                    "SELECT setval(pg_get_serial_sequence('category', 'id'), "
+                    "GREATEST((SELECT max(id) FROM category), 1))"
+                ))
+    return len(currencies), len(categories)
+
+# --- Moving users ---------------------------------------------------------
+
+def _copy_user(user_id, source, target):
+    """Copy one user's rows in a single target transaction. Returns {table: rows}."""
+    counts = {}
+    with source.connect() as src, target.begin() as dst:
+        user = dict(src.execute(select(User.__table__).where(User.id == user_id)).mappings().one())
+        # Everything copied carries the new version; clients older than it re-sync in full
+        version = user['sync_version'] + 1
+        user.update(sync_version=version, sync_floor=version)
+        dst.execute(insert(User.__table__).values(**user))
+
+        # New category ids; parents are inserted before their children
+        category_ids = {}
+        pending = [dict(r) for r in src.execute(
+            select(Category.__table__).where(Category.user_id == user_id).order_by(Category.id)
+        ).mappings()]
+        own = {c['id'] for c in pending}
+        while pending:
+            ready = [c for c in pending if c['parent_id'] not in own or c['parent_id'] in category_ids]
+            if not ready:
+                raise RuntimeError(f"Category cycle for user {user_id}")
+            pending = [c for c in pending if c not in ready]
+            for c in ready:
+                old_id = c.pop('id')
+                c.update(parent_id=category_ids.get(c['parent_id'], c['parent_id']), version=version)
+                category_ids[old_id] = dst.execute(insert(Category.__table__).values(**c)).inserted_primary_key[0]
+        counts['category'] = len(category_ids)
+
+        for model in (Transaction, Budget):
+            columns = [c for c in model.__table__.columns if c.name != 'id']
+            result = src.execution_options(stream_results=True).execute(
+                select(*columns).where(model.user_id == user_id).order_by(model.id)
+            ).mappings()
+            counts[model.__tablename__] = 0
+            while True:
+                rows = result.fetchmany(COPY_CHUNK_SIZE)
+                if not rows:
+                    break
+                dst.execute(insert(model.__table__), [
+                    dict(r, category_id=category_ids.get(r['category_id'], r['category_id']), version=version)
+                    for r in rows
+                ])
+                counts[model.__tablename__] += len(rows)
+
+        checkpoints = [
+            dict(r) for r in src.execute(
+                select(*[c for c in BalanceCheckpoint.__table__.columns if c.name != 'id'])
+                .where(BalanceCheckpoint.user_id == user_id)
+            ).mappings()
+        ]
+        if checkpoints:
+            dst.execute(insert(BalanceCheckpoint.__table__), checkpoints)
+        counts['balance_checkpoint'] = len(checkpoints)
+        # Tombstones refer to the old ids; the forced full re-sync makes them moot
+    return counts
+
+def purge_user(user_id, target):
+    """Delete one user's rows from a shard."""
+    with target.begin() as conn:
+        for model in (Transaction, Budget, Tombstone, BalanceCheckpoint):
+            conn.execute(delete(model.__table__).where(model.user_id == user_id))
+        conn.execute(delete(Category.__table__).where(Category.user_id == user_id, Category.parent_id != None))
+        conn.execute(delete(Category.__table__).where(Category.user_id == user_id))
+        conn.execute(delete(User.__table__).where(User.id == user_id))
+
+def _has_user(user_id, target):
+    with target.connect().execution_options(sqlite_begin='DEFERRED') as conn:
+        return conn.execute(select(User.id).where(User.id == user_id)).first() is not None
+
+def move_user(user_id, target_name, log=print):
+    """Move a user to another shard while the app keeps serving their reads."""
+    if target_name not in names():
+        raise ValueError(f"Unknown shard {target_name}")
+    with db.engine.connect().execution_options(sqlite_begin='DEFERRED') as conn:
+        row = conn.execute(select(UserDirectory.shard).where(UserDirectory.id == user_id)).first()
+    if row is None:
+        raise ValueError(f"User {user_id} is not in the directory")
+    source_name = row[0]
+    # Workers may keep a directory entry for this long
+    drain = current_app.config['SHARD_DIRECTORY_TTL'] + 1
+
+    if source_name != target_name:
+        _set_directory(user_id, status=MOVING)
+        log(f"User {user_id}: writes paused, waiting {drain:.0f}s for workers to notice")
+        time.sleep(drain)
+        try:
+            started = time.perf_counter()
+            counts = _copy_user(user_id, engine(source_name), engine(target_name))
+            log(f"User {user_id}: copied {counts} to {target_name} in {time.perf_counter() - started:.1f}s")
+            _set_directory(user_id, shard=target_name)
+            # Keep writes paused until no worker routes this user to the source anymore
+            time.sleep(drain)
+        finally:
+            _set_directory(user_id, status=ACTIVE)
+        metrics.inc('shard_moves_total')
+
+    # Also cleans up after a move that was interrupted before its last step
+    for name in names():
+        if name != target_name and _has_user(user_id, engine(name)):
+            purge_user(user_id, engine(name))
+            log(f"User {user_id}: removed from {name}")
+
+def user_counts():
+    with db.engine.connect().execution_options(sqlite_begin='DEFERRED') as conn:
+        return dict(conn.execute(select(UserDirectory.shard, func.count()).group_by(UserDirectory.shard)).all())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="User shards")
+    commands = parser.add_subparsers(dest='command', required=True)
+    move = commands.add_parser('move', help="move one user to another shard")
+    move.add_argument('user_id', type=int)
+    move.add_argument('shard')
+    commands.add_parser('sync-reference', help="copy currencies and system categories to every shard")
+    commands.add_parser('status', help="users per shard")
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.command == 'move':
+            move_user(args.user_id, args.shard)
+        elif args.command == 'sync-reference':
+            others = [engine(name) for name in names() if name != DEFAULT_SHARD]
+            print("Copied %d currencies and %d system categories" % sync_reference_data(db.engine, others))
+        else:
+            counts = user_counts()
+            for name in names():
+                print(f"{name}: {counts.get(name, 0)} users")
+    sys.exit(0)
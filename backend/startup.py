@@ -0,0 +1,106 @@
+"""
+Container startup: wait until the database accepts connections, then apply
+migrations only if the database is behind the migration scripts, and create
+upcoming transaction partitions when the table is partitioned. With
+SHARD_URLS set every shard gets the same treatment, and currencies and
+system categories are copied to the shards afterwards.
+
+Runs before gunicorn so that workers never race on schema changes. The Flask
+app is only imported when an upgrade is actually needed, which keeps the
+common "already up to date" path to a single DB round-trip.
+"""
+import os
+import sys
+import time
+
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+import embedded  # noqa: F401  (registers SQLite engine listeners)
+import partitions
+from config import Config
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+def get_database_url():
+    return os.environ.get("SQLALCHEMY_DATABASE_URI") or os.environ.get("DATABASE_URL")
+
+def wait_for_db(engine, timeout=30.0, interval=0.1):
+    """Poll the database until a trivial query succeeds or the timeout expires."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return
+        except Exception as e:
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"Database not ready after {timeout}s: {e}")
+            time.sleep(interval)
+            interval = min(interval * 2, 1.0)
+
+def needs_upgrade(engine):
+    script_heads = set(ScriptDirectory(MIGRATIONS_DIR).get_heads())
+    with engine.connect() as conn:
+        current_heads = set(MigrationContext.configure(conn).get_current_heads())
+    return current_heads != script_heads
+
+def run_upgrade(url=None):
+    from flask_migrate import upgrade
+    from app import app
+
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_DIR, x_arg=[f"url={url}"] if url else None)
+
+def prepare(name, engine, url=None):
+    """Migrate one database and create its upcoming partitions."""
+    if needs_upgrade(engine):
+        print(f"Applying migrations ({name})...")
+        run_upgrade(url)
+    else:
+        print(f"Schema is up to date ({name})")
+
+    created = partitions.maintain(engine)
+    if created:
+        print(f"Created transaction partitions ({name}): {', '.join(created)}")
+    warning = partitions.mismatch(engine)
+    if warning:
+        print(f"WARNING ({name}): {warning}", file=sys.stderr)
+
+def main():
+    started = time.perf_counter()
+    url = get_database_url()
+    if not url:
+        print("DATABASE_URL is not set", file=sys.stderr)
+        return 1
+
+    timeout = float(os.environ.get('DB_WAIT_TIMEOUT', 30))
+    engine = create_engine(url, poolclass=NullPool)
+    shard_engines = {name: create_engine(shard_url, poolclass=NullPool) for name, shard_url in Config.SHARD_URLS.items()}
+    try:
+        wait_for_db(engine, timeout=timeout)
+        for shard_engine in shard_engines.values():
+            wait_for_db(shard_engine, timeout=timeout)
+        print(f"Database ready in {time.perf_counter() - started:.3f}s")
+
+        prepare('default', engine)
+        for name, shard_engine in shard_engines.items():
+            prepare(name, shard_engine, Config.SHARD_URLS[name])
+
+        if shard_engines:
+            import shards
+
+            copied = shards.sync_reference_data(engine, shard_engines.values())
+            print("Copied %d currencies and %d system categories to the shards" % copied)
+    finally:
+        engine.dispose()
+        for shard_engine in shard_engines.values():
+            shard_engine.dispose()
+
+    print(f"Startup checks finished in {time.perf_counter() - started:.3f}s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
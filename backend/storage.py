@@ -0,0 +1,257 @@
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import tempfile
+from collections import Counter
+from flask import current_app, make_response, send_file
+from sqlalchemy import update, delete
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import StoredFile
+import tasks
+import thumbnails
+
+# Content-addressed upload storage. Files are keyed by "<sha256>.<ext>", so
+# identical uploads are stored once; StoredFile.ref_count tracks how many
+# rows (transactions, avatars) point at a key and unreferenced blobs are
+# garbage-collected in the background after commit.
+#
+# Uploads and the collector meet on the StoredFile row: an upload takes its
+# reference before writing the blob, and the collector unlinks the blob
+# before committing the row's deletion. Whichever gets the row first holds
+# its lock (the database lock on SQLite) until commit, so an upload either
+# keeps the blob alive or writes it again after it was removed.
+#
+# Behind nginx (STORAGE_X_ACCEL=1) downloads never stream through a Python
+# worker: /api/files/<key> answers with X-Accel-Redirect and nginx serves the
+# bytes from an internal location. Without it the app sends the file itself.
+#
+# Keys stored before this module existed are plain unique filenames in the
+# uploads root ("legacy" keys); they have no StoredFile row and are deleted
+# directly when released.
+
+CHUNK_SIZE = 64 * 1024
+CAS_KEY_RE = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]{1,5}$')
+# Originals plus derived blobs such as thumbnails ("<sha256>_<size>.<ext>")
+BLOB_KEY_RE = re.compile(r'^[0-9a-f]{64}(_\d+)?\.[a-z0-9]{1,5}$')
+SAFE_KEY_RE = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,255}$')
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+def is_cas_key(key):
+    return bool(CAS_KEY_RE.match(key))
+
+def is_blob_key(key):
+    return bool(BLOB_KEY_RE.match(key))
+
+class LocalStorage:
+    """Blobs on the local filesystem, sharded as ab/cd/<key>."""
+
+    def __init__(self, root, accel_prefix):
+        self.root = root
+        self.accel_prefix = accel_prefix.rstrip('/')
+        os.makedirs(self.root, exist_ok=True)
+
+    def relpath(self, key):
+        if is_blob_key(key):
+            return f"{key[:2]}/{key[2:4]}/{key}"
+        return key
+
+    def path(self, key):
+        return os.path.join(self.root, self.relpath(key))
+
+    def temp_file(self):
+        # Same filesystem as the final location so put() is an atomic rename
+        return tempfile.NamedTemporaryFile(dir=self.root, prefix='.upload-', delete=False)
+
+    def put(self, tmp_path, key):
+        final_path = self.path(key)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+            return False
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+        return True
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def accel_location(self, key):
+        return f"{self.accel_prefix}/{self.relpath(key)}"
+
+    def send(self, key):
+        return send_file(self.path(key), mimetype=mimetypes.guess_type(key)[0], max_age=31536000, conditional=True)
+
+class S3Storage:
+    """
+    Blobs in an S3-compatible bucket (AWS, MinIO, or a local stand-in).
+    nginx proxies the internal accel location to the bucket endpoint, so app
+    nodes need no shared volume.
+    """
+
+    def __init__(self, bucket, endpoint_url, accel_prefix, tmp_dir):
+        import boto3  # optional dependency, only needed for this backend
+
+        self.bucket = bucket
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.accel_prefix = accel_prefix.rstrip('/')
+        self.tmp_dir = tmp_dir
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def temp_file(self):
+        return tempfile.NamedTemporaryFile(dir=self.tmp_dir, prefix='.upload-', delete=False)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def put(self, tmp_path, key):
+        try:
+            if self.exists(key):
+                return False
+            content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+            self.client.upload_file(tmp_path, self.bucket, key, ExtraArgs={'ContentType': content_type})
+            return True
+        finally:
+            os.remove(tmp_path)
+
+    def open(self, key):
+        # Seekable copy: readers such as Pillow need random access
+        return io.BytesIO(self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read())
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def accel_location(self, key):
+        return f"{self.accel_prefix}/{key}"
+
+    def send(self, key):
+        with self.open(key) as body:
+            response = make_response(body.read())
+        response.headers['Content-Type'] = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE
+        return response
+
+def get_storage():
+    storage = current_app.extensions.get('storage')
+    if storage is None:
+        config = current_app.config
+        if config['STORAGE_BACKEND'] == 's3':
+            storage = S3Storage(
+                config['STORAGE_S3_BUCKET'],
+                config['STORAGE_S3_ENDPOINT'],
+                config['STORAGE_ACCEL_PREFIX'],
+                os.path.join(current_app.root_path, 'static', 'uploads', '.tmp'),
+            )
+        else:
+            storage = LocalStorage(
+                config.get('UPLOAD_FOLDER') or os.path.join(current_app.root_path, 'static', 'uploads'),
+                config['STORAGE_ACCEL_PREFIX'],
+            )
+        current_app.extensions['storage'] = storage
+    return storage
+
+def _acquire(key, size, content_type):
+    updated = db.session.execute(
+        update(StoredFile).where(StoredFile.key == key).values(ref_count=StoredFile.ref_count + 1)
+    ).rowcount
+    if updated:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(StoredFile(key=key, size=size, content_type=content_type, ref_count=1))
+    except IntegrityError:
+        # Another request inserted the same blob concurrently
+        db.session.execute(
+            update(StoredFile).where(StoredFile.key == key).values(ref_count=StoredFile.ref_count + 1)
+        )
+
+def save_upload(file, ext):
+    """
+    Stream an uploaded file to storage in chunks while hashing it and take a
+    reference on the resulting key. The caller commits.
+    """
+    storage = get_storage()
+    digest = hashlib.sha256()
+    size = 0
+    with storage.temp_file() as tmp:
+        while True:
+            chunk = file.stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            tmp.write(chunk)
+            size += len(chunk)
+        tmp_path = tmp.name
+
+    key = f"{digest.hexdigest()}.{ext.lower()}"
+    # Reference first: the collector can't remove the blob while we hold it
+    _acquire(key, size, file.mimetype or mimetypes.guess_type(key)[0])
+    storage.put(tmp_path, key)
+    thumbnails.generate_later(key)
+    return key
+
+def release(keys):
+    """Drop one reference per occurrence of each key. The caller commits, then calls collect_later."""
+    for key, count in Counter(k for k in keys if k and is_cas_key(k)).items():
+        db.session.execute(
+            update(StoredFile).where(StoredFile.key == key).values(ref_count=StoredFile.ref_count - count)
+        )
+
+def collect_garbage(keys):
+    storage = get_storage()
+    for key in set(k for k in keys if k):
+        if not is_cas_key(key):
+            storage.delete(key)
+            continue
+        deleted = db.session.execute(
+            delete(StoredFile).where(StoredFile.key == key, StoredFile.ref_count <= 0)
+        ).rowcount
+        if deleted:
+            # Still holding the row: a concurrent upload of the same content
+            # waits for this commit and then writes the blob again
+            storage.delete(key)
+            thumbnails.delete_all(storage, key)
+        db.session.commit()
+
+def collect_later(keys):
+    """Delete blobs whose last reference went away; call after commit."""
+    keys = [k for k in keys if k]
+    if keys:
+        tasks.submit_with_app(current_app._get_current_object(), collect_garbage, keys)
+
+def serve(key, size=None):
+    if not SAFE_KEY_RE.match(key):
+        return make_response(("Not found", 404))
+    storage = get_storage()
+    if size:
+        size = thumbnails.pick_size(size)
+        # Falls back to the original for non-images and undecodable files
+        key = (size and thumbnails.ensure(storage, key, size)) or key
+    if not current_app.config['STORAGE_X_ACCEL']:
+        if not storage.exists(key):
+            return make_response(("Not found", 404))
+        return storage.send(key)
+
+    response = make_response('')
+    response.headers['X-Accel-Redirect'] = storage.accel_location(key)
+    response.headers['Content-Type'] = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+    if is_blob_key(key):
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE
+        response.headers['ETag'] = f'"{key.split(".", 1)[0]}"'
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
@@ -0,0 +1,145 @@
+from datetime import datetime
+from sqlalchemy import event, update, insert, select, literal
+from sqlalchemy.orm import Session
+from extensions import db
+from models import User, Transaction, Category, Budget, Tombstone
+
+# Delta sync bookkeeping. Every write to a user's transactions, categories
+# or budgets stamps the rows with the next value of User.sync_version, and
+# deletions leave a Tombstone with that version. Bumping the counter locks
+# the user row until commit, so one user's writes commit in version order
+# and "everything with version > token" never skips a row.
+#
+# ORM writes are stamped automatically in before_flush; bulk statements
+# (batch API, filter-based bulk ops) must call next_version() and stamp
+# their rows explicitly.
+
+SYNCED_MODELS = {Transaction: 'transaction', Category: 'category', Budget: 'budget'}
+
+def next_version(user_id, session=None):
+    # The mapper routes the connection to the user's database (see routing.py)
+    connection = (session or db.session).connection(bind_arguments={'mapper': User})
+    return connection.execute(
+        update(User).where(User.id == user_id)
+        .values(sync_version=User.sync_version + 1)
+        .returning(User.sync_version)
+    ).scalar_one()
+
+def stamp(values, version):
+    values['version'] = version
+    values['updated_at'] = datetime.utcnow()
+    return values
+
+def record_deletes(user_id, entity, ids, version):
+    if ids:
+        db.session.execute(insert(Tombstone), [
+            {'user_id': user_id, 'entity': entity, 'entity_id': entity_id, 'version': version}
+            for entity_id in ids
+        ])
+
+def record_deletes_from_query(user_id, entity, query, version):
+    """Tombstone every row a bulk DELETE is about to remove, in one INSERT ... SELECT."""
+    model = query.column_descriptions[0]['entity']
+    rows = query.with_entities(
+        literal(user_id), literal(entity), model.id, literal(version)
+    ).order_by(None).statement
+    db.session.execute(
+        insert(Tombstone).from_select(['user_id', 'entity', 'entity_id', 'version'], rows)
+    )
+
+@event.listens_for(Session, 'before_flush')
+def _stamp_synced_rows(session, flush_context, instances):
+    changed = [
+        obj for obj in session.new | session.dirty
+        if type(obj) in SYNCED_MODELS and obj.user_id
+        and (obj in session.new or session.is_modified(obj, include_collections=False))
+    ]
+    deleted = [obj for obj in session.deleted if type(obj) in SYNCED_MODELS and obj.user_id]
+    if not changed and not deleted:
+        return
+
+    versions = {}
+    for user_id in {int(obj.user_id) for obj in changed + deleted}:
+        versions[user_id] = next_version(user_id, session)
+
+    now = datetime.utcnow()
+    for obj in changed:
+        obj.version = versions[int(obj.user_id)]
+        obj.updated_at = now
+    for obj in deleted:
+        session.add(Tombstone(
+            user_id=obj.user_id, entity=SYNCED_MODELS[type(obj)],
+            entity_id=obj.id, version=versions[int(obj.user_id)]
+        ))
+
+def serialize_transaction(t):
+    return {
+        "id": t.id,
+        "amount": t.amount,
+        "currency": t.currency,
+        "description": t.description,
+        "date": t.date.isoformat() if t.date else None,
+        "type": t.type,
+        "category_id": t.category_id,
+        "tags": t.tags,
+        "attachment": t.attachment,
+        "version": t.version,
+    }
+
+def serialize_category(c):
+    return {
+        "id": c.id,
+        "name": c.name,
+        "type": c.type,
+        "color": c.color,
+        "icon": c.icon,
+        "parent_id": c.parent_id,
+        "is_system": c.user_id is None,
+        "version": c.version,
+    }
+
+def serialize_budget(b):
+    return {
+        "id": b.id,
+        "category_id": b.category_id,
+        "limit": b.amount_limit,
+        "period": b.period,
+        "start_date": b.start_date.isoformat() if b.start_date else None,
+        "end_date": b.end_date.isoformat() if b.end_date else None,
+        "archived": b.archived,
+        "version": b.version,
+    }
+
+def changes_since(user_id, since):
+    """Rows changed after version `since` plus tombstones, and the token to use next time."""
+    # Read the counter first: rows committed meanwhile are returned again next time, never skipped
+    token, floor = db.session.query(User.sync_version, User.sync_floor).filter_by(id=user_id).first() or (0, 0)
+    if since < floor:
+        # Row ids changed since this token was issued (e.g. the user moved shards)
+        since = 0
+
+    def changed(model):
+        return model.query.filter(model.user_id == user_id, model.version > since).order_by(model.version).all()
+
+    categories = changed(Category)
+    if since == 0:
+        # Initial sync also ships the shared system categories
+        categories = Category.query.filter(Category.user_id == None).all() + categories
+
+    deleted = {'transactions': [], 'categories': [], 'budgets': []}
+    if since > 0:
+        tombstones = db.session.execute(
+            select(Tombstone.entity, Tombstone.entity_id)
+            .where(Tombstone.user_id == user_id, Tombstone.version > since)
+        ).all()
+        for entity, entity_id in tombstones:
+            deleted[entity + 's' if entity != 'category' else 'categories'].append(entity_id)
+
+    return {
+        "token": str(token),
+        "full": since == 0,
+        "transactions": [serialize_transaction(t) for t in changed(Transaction)],
+        "categories": [serialize_category(c) for c in categories],
+        "budgets": [serialize_budget(b) for b in changed(Budget)],
+        "deleted": deleted,
+    }
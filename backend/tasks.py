@@ -0,0 +1,42 @@
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# Fire-and-forget background work (file cleanup, thumbnails, ...) on a small
+# per-worker thread pool. Jobs that touch the database must push their own
+# app context; use submit_with_app for that.
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+def _get_pool():
+    global _pool, _pool_pid
+    # Threads don't survive fork, so the pool is created lazily per worker
+    if _pool is None or _pool_pid != os.getpid():
+        with _lock:
+            if _pool is None or _pool_pid != os.getpid():
+                workers = int(os.environ.get('BACKGROUND_WORKERS', 2))
+                _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bg')
+                _pool_pid = os.getpid()
+    return _pool
+
+def _run(name, fn, args, kwargs):
+    try:
+        fn(*args, **kwargs)
+        metrics.inc('background_tasks_total', task=name, status='ok')
+    except Exception:
+        metrics.inc('background_tasks_total', task=name, status='error')
+        print(f"Background task {name} failed: {traceback.format_exc()}")
+
+def submit(fn, *args, **kwargs):
+    return _get_pool().submit(_run, fn.__name__, fn, args, kwargs)
+
+def submit_with_app(app, fn, *args, **kwargs):
+    def with_context(*a, **kw):
+        with app.app_context():
+            return fn(*a, **kw)
+    with_context.__name__ = fn.__name__
+    return submit(with_context, *args, **kwargs)
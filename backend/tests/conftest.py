@@ -0,0 +1,163 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads its settings from the environment when config.py is first
+# imported, so the test database, upload folder and fake provider URLs are
+# set before anything from the backend is imported. Provider URLs point at
+# a closed local port: tests never reach the real exchange-rate APIs.
+TMP_DIR = tempfile.mkdtemp(prefix='finance-tests-')
+os.environ.pop('SQLALCHEMY_DATABASE_URI', None)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMP_DIR, 'test.db')
+os.environ['UPLOAD_FOLDER'] = os.path.join(TMP_DIR, 'uploads')
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret-that-is-long-enough-for-hs256'
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+os.environ['FX_RATES_URL'] = 'http://127.0.0.1:9/latest/{base}'
+os.environ['FX_HISTORY_URL'] = 'http://127.0.0.1:9/{start}..{end}?from={base}&to={target}'
+for name in ('SHARD_URLS', 'DATABASE_REPLICA_URL', 'TRANSACTION_PARTITIONING', 'METRICS_TOKEN'):
+    os.environ.pop(name, None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_emails = itertools.count()
+
+@pytest.fixture(scope='session')
+def app():
+    from flask.testing import FlaskClient
+    from app import app
+    from extensions import db
+    from models import Category
+
+    class Client(FlaskClient):
+        # Buffered responses are closed before open() returns, which runs their
+        # call_on_close hooks (SSE event processing) as a real server would
+        def open(self, *args, buffered=True, **kwargs):
+            return super().open(*args, buffered=buffered, **kwargs)
+
+    app.test_client_class = Client
+    app.config.update(TESTING=True, UPLOAD_FOLDER=os.environ['UPLOAD_FOLDER'], RATE_LIMIT_ENABLED=False)
+    with app.app_context():
+        db.create_all()
+        if not Category.query.filter(Category.user_id == None).first():
+            db.session.add_all([Category(name='Food', type='expense'), Category(name='Salary', type='income')])
+            db.session.commit()
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+class User:
+    def __init__(self, id, email, token):
+        self.id = id
+        self.email = email
+        self.token = token
+        self.headers = {'Authorization': 'Bearer ' + token}
+
+@pytest.fixture
+def make_user(client):
+    """Register a fresh user (each test gets its own data) and return it with auth headers."""
+    def make(base_currency=None):
+        email = f"user{next(_emails)}-{os.getpid()}@example.com"
+        r = client.post('/api/auth/register', json={'email': email, 'password': 'secret', 'name': 'Test'})
+        assert r.status_code == 201, r.get_json()
+        with client.application.app_context():
+            import shards
+
+            user = User(shards.find_email(email).id, email, r.get_json()['token'])
+        if base_currency:
+            r = client.put('/api/settings/profile', json={'base_currency': base_currency}, headers=user.headers)
+            assert r.status_code == 200, r.get_json()
+            user.token = r.get_json().get('token', user.token)
+            user.headers = {'Authorization': 'Bearer ' + user.token}
+        return user
+    return make
+
+@pytest.fixture
+def user(make_user):
+    return make_user()
+
+@pytest.fixture
+def categories(app):
+    """Ids of the system expense and income categories."""
+    from models import Category
+
+    with app.app_context():
+        expense = Category.query.filter_by(user_id=None, type='expense').first().id
+        income = Category.query.filter_by(user_id=None, type='income').first().id
+    return {'expense': expense, 'income': income}
+
+@pytest.fixture
+def add_transaction(client, categories):
+    """Create a transaction through the API and return its id."""
+    def add(user, amount=100, type='expense', date='2024-03-15T12:00:00', **fields):
+        body = dict(amount=amount, type=type, date=date, category_id=categories[type], **fields)
+        r = client.post('/api/transactions/', json=body, headers=user.headers)
+        assert r.status_code == 201, r.get_json()
+        return r.get_json()['id']
+    return add
+
+@pytest.fixture
+def inline_tasks(monkeypatch):
+    """Run background jobs (tasks.submit) inline, so their effects are visible when the request returns."""
+    from concurrent.futures import Future
+    import tasks
+
+    def submit(fn, *args, **kwargs):
+        tasks._run(fn.__name__, fn, args, kwargs)
+        future = Future()
+        future.set_result(None)
+        return future
+
+    monkeypatch.setattr(tasks, 'submit', submit)
+
+@pytest.fixture
+def build_app(app, monkeypatch, tmp_path):
+    """
+    A second app built from Config overrides, on fresh SQLite files: binds
+    (replica, shards) are fixed when an app is created. Per-worker caches
+    keyed by user id are swapped out, since ids restart in the new databases.
+    """
+    from collections import OrderedDict
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import NullPool
+    import app as app_module
+    import columnar, forecast, profile_cache, routing, shards
+    from config import Config
+    from extensions import db
+
+    for module, name, empty in ((columnar, '_cache', OrderedDict), (forecast, '_cache', OrderedDict),
+                                (profile_cache, '_cache', OrderedDict), (routing, '_sticky', dict),
+                                (shards, '_directory', dict)):
+        monkeypatch.setattr(module, name, empty())
+
+    def build(replica=False, shard_names=(), **overrides):
+        """Returns (app, {database name: url}) for the primary, the replica and the shards."""
+        names = ['primary'] + (['replica'] if replica else []) + list(shard_names)
+        urls = {name: 'sqlite:///' + str(tmp_path / f'{name}.db') for name in names}
+        shard_urls = {name: urls[name] for name in shard_names}
+        overrides = dict(
+            SQLALCHEMY_DATABASE_URI=urls['primary'], DATABASE_REPLICA_URL=urls.get('replica'), SHARD_URLS=shard_urls,
+            SQLALCHEMY_BINDS=dict(shard_urls, **({'replica': urls['replica']} if replica else {})), **overrides)
+        for name, value in overrides.items():
+            monkeypatch.setattr(Config, name, value)
+        for url in urls.values():
+            engine = create_engine(url, poolclass=NullPool)
+            db.metadata.create_all(engine)
+            engine.dispose()
+
+        other = app_module.create_app()
+        other.test_client_class = app.test_client_class
+        other.config.update(TESTING=True, UPLOAD_FOLDER=os.environ['UPLOAD_FOLDER'], RATE_LIMIT_ENABLED=False)
+        with other.app_context():
+            from models import Category
+
+            db.session.add_all([Category(name='Food', type='expense'), Category(name='Salary', type='income')])
+            db.session.commit()
+            if Config.SHARD_URLS:
+                shards.sync_reference_data(db.engine, [db.engines[name] for name in Config.SHARD_URLS])
+        return other, urls
+    return build
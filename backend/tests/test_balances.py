@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import pytest
+
+import balances
+from extensions import db
+from models import BalanceCheckpoint
+
+@pytest.fixture
+def ctx(app):
+    """Run a call in its own app context, so requests in between get their own session."""
+    def run(fn, *args, **kwargs):
+        with app.app_context():
+            return fn(*args, **kwargs)
+    return run
+
+def _checkpoints(user):
+    return {(cp.period_end, cp.currency): (cp.income, cp.expense)
+            for cp in BalanceCheckpoint.query.filter_by(user_id=user.id)}
+
+def _set_latest_income(user, income):
+    latest = db.session.query(db.func.max(BalanceCheckpoint.period_end)).filter_by(user_id=user.id).scalar()
+    BalanceCheckpoint.query.filter_by(user_id=user.id, period_end=latest).update({'income': income})
+    db.session.commit()
+
+def _dashboard_balance(client, user):
+    return client.get('/api/analytics/summary?period=all', headers=user.headers).get_json()['balance']
+
+def test_refresh_writes_running_month_end_totals(ctx, user, add_transaction):
+    add_transaction(user, amount=100, type='income', date='2024-01-10T12:00:00')
+    add_transaction(user, amount=30, date='2024-02-05T12:00:00')
+    add_transaction(user, amount=5, date='2024-02-20T12:00:00', currency='EUR')
+
+    written = ctx(balances.refresh, user.id, now=datetime(2024, 4, 2))
+    checkpoints = ctx(_checkpoints, user)
+    assert written == len(checkpoints) == 5
+    assert checkpoints[(datetime(2024, 2, 1), 'RUB')] == (100, 0)
+    assert checkpoints[(datetime(2024, 3, 1), 'RUB')] == (100, 30)
+    assert checkpoints[(datetime(2024, 4, 1), 'EUR')] == (0, 5)
+    # Idempotent until the next month starts
+    assert ctx(balances.refresh, user.id, now=datetime(2024, 4, 20)) == 0
+
+def test_totals_read_the_latest_checkpoint(ctx, client, user, add_transaction):
+    add_transaction(user, amount=100, type='income', date='2024-01-10T12:00:00')
+    add_transaction(user, amount=40, date=datetime.utcnow().isoformat())
+    ctx(balances.refresh, user.id)
+    assert ctx(balances.totals, user.id) == {'RUB': {'income': 100, 'expense': 40}}
+
+    # Settled months come from the checkpoint, not the rows
+    ctx(_set_latest_income, user, 1000)
+    assert ctx(balances.totals, user.id)['RUB']['income'] == 1000
+
+def test_back_dated_writes_invalidate_later_checkpoints(ctx, client, user, add_transaction, inline_tasks):
+    add_transaction(user, amount=100, type='income', date='2024-01-10T12:00:00')
+    moved = add_transaction(user, amount=20, date='2024-05-10T12:00:00')
+    ctx(balances.refresh, user.id)
+    assert _dashboard_balance(client, user) == 80
+
+    add_transaction(user, amount=10, date='2024-03-01T12:00:00')
+    assert all(period_end <= datetime(2024, 3, 1) for period_end, _ in ctx(_checkpoints, user))
+    assert _dashboard_balance(client, user) == 70
+
+    ctx(balances.refresh, user.id)
+    r = client.put(f'/api/transactions/{moved}', json={'date': '2024-02-01T12:00:00'}, headers=user.headers)
+    assert r.status_code == 200
+    assert all(period_end <= datetime(2024, 2, 1) for period_end, _ in ctx(_checkpoints, user))
+    assert _dashboard_balance(client, user) == 70
+
+    ctx(balances.refresh, user.id)
+    client.delete(f'/api/transactions/{moved}', headers=user.headers)
+    assert _dashboard_balance(client, user) == 90
+
+def test_bulk_delete_invalidates(ctx, client, user, add_transaction):
+    add_transaction(user, amount=100, type='income', date='2024-01-10T12:00:00')
+    add_transaction(user, amount=25, date='2024-02-10T12:00:00', description='refund me')
+    ctx(balances.refresh, user.id)
+
+    r = client.post('/api/transactions/bulk/delete?search=refund', json={}, headers=user.headers)
+    assert r.get_json()['matched'] == 1
+    assert all(period_end <= datetime(2024, 2, 1) for period_end, _ in ctx(_checkpoints, user))
+    assert ctx(balances.totals, user.id) == {'RUB': {'income': 100, 'expense': 0}}
+
+def test_stale_checkpoints_refresh_in_background(ctx, client, user, add_transaction, inline_tasks):
+    add_transaction(user, amount=100, type='income', date='2024-01-10T12:00:00')
+    assert ctx(_checkpoints, user) == {}
+    assert _dashboard_balance(client, user) == 100
+    assert ctx(_checkpoints, user)
@@ -0,0 +1,57 @@
+def _batch(client, user, operations):
+    return client.post('/api/transactions/batch', json={'operations': operations}, headers=user.headers)
+
+def _amounts(client, user):
+    rows = client.get('/api/transactions/', headers=user.headers).get_json()
+    return {row['id']: row['amount'] for row in rows}
+
+def test_batch_applies_create_update_delete(client, user, categories, add_transaction):
+    keep = add_transaction(user, amount=10)
+    drop = add_transaction(user, amount=20)
+
+    r = _batch(client, user, [
+        {'op': 'create', 'amount': 5, 'type': 'expense', 'category_id': categories['expense'], 'date': '2024-03-01'},
+        {'op': 'update', 'id': keep, 'amount': 11},
+        {'op': 'delete', 'id': drop},
+    ])
+    assert r.status_code == 200, r.get_json()
+    results = r.get_json()['results']
+    assert [res['status'] for res in results] == ['created', 'updated', 'deleted']
+
+    amounts = _amounts(client, user)
+    assert amounts[keep] == 11
+    assert drop not in amounts
+    assert amounts[results[0]['id']] == 5
+
+def test_batch_with_an_invalid_item_applies_nothing(client, user, categories, add_transaction):
+    txn = add_transaction(user, amount=10)
+
+    r = _batch(client, user, [
+        {'op': 'update', 'id': txn, 'amount': 99},
+        {'op': 'create', 'amount': 'lots', 'type': 'expense', 'category_id': categories['expense']},
+        {'op': 'delete', 'id': txn},
+    ])
+    assert r.status_code == 400
+    errors = {res['index']: res['error'] for res in r.get_json()['results']}
+    assert errors[0] is None
+    assert errors[1] == "Invalid amount"
+    assert errors[2] == "Transaction referenced twice"
+    assert _amounts(client, user) == {txn: 10}
+
+def test_batch_cannot_touch_other_users_rows(client, make_user, add_transaction):
+    owner, other = make_user(), make_user()
+    txn = add_transaction(owner)
+
+    r = _batch(client, other, [{'op': 'delete', 'id': txn}])
+    assert r.status_code == 400
+    assert r.get_json()['results'][0]['error'] == "Transaction not found"
+    assert txn in _amounts(client, owner)
+
+def test_batch_size_is_capped(app, client, user):
+    app.config['BATCH_MAX_OPERATIONS'] = 2
+    try:
+        r = _batch(client, user, [{'op': 'delete', 'id': 1}] * 3)
+    finally:
+        app.config['BATCH_MAX_OPERATIONS'] = 1000
+    assert r.status_code == 400
+    assert _batch(client, user, []).status_code == 400
@@ -0,0 +1,51 @@
+import pytest
+
+from extensions import db
+from models import ExchangeRate
+
+@pytest.fixture
+def setup(app, client, make_user, categories, add_transaction):
+    user = make_user(base_currency='CHF')
+    add_transaction(user, amount=40, currency='CHF')
+    add_transaction(user, amount=900, type='income', currency='CHF')
+    r = client.post('/api/budgets/', json={'category_id': categories['expense'], 'limit': 500}, headers=user.headers)
+    assert r.status_code == 201
+    with app.app_context():
+        if not ExchangeRate.query.filter_by(base_currency='CHF', target_currency='XTS').first():
+            db.session.add(ExchangeRate(base_currency='CHF', target_currency='XTS', rate=2.5))
+            db.session.commit()
+    return user
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_bootstrap_matches_the_separate_endpoints(app, client, setup, monkeypatch, parallel):
+    monkeypatch.setitem(app.config, 'BOOTSTRAP_PARALLEL', parallel)
+    headers = setup.headers
+    r = client.get('/api/bootstrap?period=all', headers=headers)
+    assert r.status_code == 200
+    data = r.get_json()
+
+    assert data['user'] == client.get('/api/auth/me', headers=headers).get_json()
+    assert data['categories'] == client.get('/api/categories/', headers=headers).get_json()
+    assert data['budgets'] == client.get('/api/budgets/', headers=headers).get_json()
+    assert data['summary'] == client.get('/api/analytics/summary?period=all', headers=headers).get_json()
+    assert data['summary']['total_income'] == 900 and data['summary']['total_expenses'] == 40
+    assert data['rates']['base'] == 'CHF'
+    assert data['rates']['rates']['XTS'] == 2.5
+
+def test_unchanged_bootstrap_is_a_304(client, setup, add_transaction):
+    first = client.get('/api/bootstrap?period=all', headers=setup.headers)
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    again = client.get('/api/bootstrap?period=all', headers=dict(setup.headers, **{'If-None-Match': etag}))
+    assert again.status_code == 304
+    assert again.data == b''
+
+    add_transaction(setup, amount=5, currency='CHF')
+    changed = client.get('/api/bootstrap?period=all', headers=dict(setup.headers, **{'If-None-Match': etag}))
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['summary']['total_expenses'] == 45
+
+def test_bootstrap_requires_a_token(client):
+    assert client.get('/api/bootstrap').status_code == 401
@@ -0,0 +1,54 @@
+def _rows(client, user):
+    return {row['id']: row for row in client.get('/api/transactions/', headers=user.headers).get_json()}
+
+def test_bulk_recategorize_by_search_filter(client, user, categories, add_transaction):
+    r = client.post('/api/categories/', json={'name': 'Coffee', 'type': 'expense'}, headers=user.headers)
+    coffee = r.get_json()['id']
+    hit = add_transaction(user, description='coffee beans')
+    miss = add_transaction(user, description='rent')
+
+    url = '/api/transactions/bulk/recategorize?search=coffee'
+    r = client.post(url, json={'category_id': coffee, 'dry_run': True}, headers=user.headers)
+    assert r.get_json() == {'matched': 1, 'dry_run': True}
+    assert _rows(client, user)[hit]['category_id'] == categories['expense']
+
+    r = client.post(url, json={'category_id': coffee}, headers=user.headers)
+    assert r.get_json()['matched'] == 1
+    rows = _rows(client, user)
+    assert rows[hit]['category_id'] == coffee
+    assert rows[miss]['category_id'] == categories['expense']
+
+def test_bulk_recategorize_rejects_foreign_category(client, make_user, add_transaction):
+    owner, other = make_user(), make_user()
+    foreign = client.post('/api/categories/', json={'name': 'Mine', 'type': 'expense'}, headers=other.headers).get_json()['id']
+    add_transaction(owner)
+    r = client.post('/api/transactions/bulk/recategorize', json={'category_id': foreign}, headers=owner.headers)
+    assert r.status_code == 400
+
+def test_bulk_retag_replace_and_append(client, user, add_transaction):
+    tagged = add_transaction(user, tags='work')
+    untagged = add_transaction(user, tags='')
+
+    r = client.post('/api/transactions/bulk/retag', json={'tags': 'trip', 'mode': 'append'}, headers=user.headers)
+    assert r.get_json()['matched'] == 2
+    rows = _rows(client, user)
+    assert rows[tagged]['tags'] == 'work,trip'
+    assert rows[untagged]['tags'] == 'trip'
+
+    client.post('/api/transactions/bulk/retag', json={'tags': 'home'}, headers=user.headers)
+    assert {row['tags'] for row in _rows(client, user).values()} == {'home'}
+
+def test_bulk_delete_needs_a_filter(client, user, add_transaction):
+    old = add_transaction(user, date='2023-01-10T00:00:00')
+    new = add_transaction(user, date='2024-06-10T00:00:00')
+
+    assert client.post('/api/transactions/bulk/delete', json={}, headers=user.headers).status_code == 400
+
+    r = client.post('/api/transactions/bulk/delete?end_date=2023-12-31', json={}, headers=user.headers)
+    assert r.get_json()['matched'] == 1
+    assert set(_rows(client, user)) == {new}
+
+    r = client.post('/api/transactions/bulk/delete', json={'all': True}, headers=user.headers)
+    assert r.get_json()['matched'] == 1
+    assert _rows(client, user) == {}
+    assert old not in _rows(client, user)
@@ -0,0 +1,63 @@
+import gzip
+import json
+from datetime import date, datetime, timezone
+
+import pytest
+
+import compression
+import json_provider
+
+@pytest.fixture
+def many(client, user, add_transaction):
+    for i in range(30):
+        add_transaction(user, amount=i + 1, description=f'groceries and more groceries {i}')
+    return user
+
+@pytest.mark.parametrize('provider', ['IsoJSONProvider', 'OrjsonProvider'])
+def test_providers_write_iso_datetimes(app, provider):
+    if provider == 'OrjsonProvider' and json_provider.orjson is None:
+        pytest.skip('orjson is not installed')
+    encoder = getattr(json_provider, provider)(app)
+    payload = {'naive': datetime(2026, 10, 1, 12, 30), 'aware': datetime(2026, 10, 1, 12, 30, tzinfo=timezone.utc),
+               'day': date(2026, 10, 1)}
+    assert json.loads(encoder.dumps(payload)) == {
+        'naive': '2026-10-01T12:30:00+00:00', 'aware': '2026-10-01T12:30:00+00:00', 'day': '2026-10-01',
+    }
+
+def test_summary_dates_are_iso(client, user, add_transaction):
+    add_transaction(user, date='2024-03-15T12:00:00')
+    recent = client.get('/api/analytics/summary?period=all', headers=user.headers).get_json()['recent']
+    assert recent[0]['date'] == '2024-03-15T12:00:00+00:00'
+
+def test_large_api_responses_are_gzipped(client, many):
+    plain = client.get('/api/transactions/', headers=dict(many.headers, **{'Accept-Encoding': 'identity'}))
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    r = client.get('/api/transactions/', headers=dict(many.headers, **{'Accept-Encoding': 'gzip'}))
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert len(r.data) < len(plain.data)
+    assert gzip.decompress(r.data) == plain.data
+
+def test_brotli_preferred_when_installed(client, many):
+    if compression.brotli is None:
+        pytest.skip('brotli is not installed')
+    r = client.get('/api/transactions/', headers=dict(many.headers, **{'Accept-Encoding': 'gzip, br'}))
+    assert r.headers['Content-Encoding'] == 'br'
+    assert json.loads(compression.brotli.decompress(r.data))
+    # q-values are honoured
+    r = client.get('/api/transactions/', headers=dict(many.headers, **{'Accept-Encoding': 'gzip;q=1, br;q=0.5'}))
+    assert r.headers['Content-Encoding'] == 'gzip'
+
+def test_small_and_refused_responses_stay_plain(client, many):
+    r = client.get('/api/categories/', headers=dict(many.headers, **{'Accept-Encoding': 'gzip'}))
+    assert len(r.data) < 1024 and 'Content-Encoding' not in r.headers
+    r = client.get('/api/transactions/', headers=dict(many.headers, **{'Accept-Encoding': 'gzip;q=0'}))
+    assert 'Content-Encoding' not in r.headers
+
+def test_compressed_etags_are_weak(client, many):
+    r = client.get('/api/bootstrap?period=all', headers=dict(many.headers, **{'Accept-Encoding': 'gzip'}))
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert r.headers['ETag'].startswith('W/')
+    plain = client.get('/api/bootstrap?period=all', headers=dict(many.headers, **{'Accept-Encoding': 'identity'}))
+    assert not plain.headers['ETag'].startswith('W/')
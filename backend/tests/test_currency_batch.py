@@ -0,0 +1,106 @@
+from datetime import date, timedelta
+
+import pytest
+
+import fx
+from extensions import db
+from models import ExchangeRate, RateHistory
+from routes import currencies
+
+@pytest.fixture
+def fetched(monkeypatch):
+    """Replace the provider: records each fetch_histories call and serves `fetched.rows`."""
+    calls = []
+    monkeypatch.setattr(currencies, '_history_checked', {})
+
+    def fetch_histories(base, targets, start, end):
+        calls.append((base, sorted(targets)))
+        return {t: fetch_histories.rows.get(t) for t in targets}
+
+    fetch_histories.rows = {}
+    fetch_histories.calls = calls
+    monkeypatch.setattr(fx, 'fetch_histories', fetch_histories)
+    return fetch_histories
+
+def store_history(app, base, target, days, rate):
+    with app.app_context():
+        RateHistory.query.filter_by(base_currency=base, target_currency=target).delete()
+        db.session.add_all([RateHistory(base_currency=base, target_currency=target, date=d, rate=rate) for d in days])
+        db.session.commit()
+
+def test_history_for_many_targets(app, client, user, fetched):
+    today = date.today()
+    window = [today - timedelta(days=i) for i in range(30, -1, -1)]
+    store_history(app, 'XBA', 'XBB', window, 1.5)
+    fetched.rows = {'XBC': [(d, 3.0) for d in window]}
+
+    r = client.get('/api/currencies/history?base=xba&targets=XBB,xbc,XBD,XBC', headers=user.headers)
+    assert r.status_code == 200
+    data = r.get_json()
+    assert data['base'] == 'XBA'
+    assert data['sources'] == {'XBB': 'stored', 'XBC': 'api', 'XBD': 'synthetic'}
+    assert {p['rate'] for p in data['history']['XBB']} == {1.5}
+    assert {p['rate'] for p in data['history']['XBC']} == {3.0}
+    assert len(data['history']['XBD']) == 30
+    # One provider round for the pairs that need it; fresh stored pairs are not fetched
+    assert fetched.calls == [('XBA', ['XBC', 'XBD'])]
+
+    # The fetched pair was stored, and the pair tried a moment ago isn't fetched again
+    data = client.get('/api/currencies/history?base=XBA&targets=XBC,XBD', headers=user.headers).get_json()
+    assert data['sources'] == {'XBC': 'stored', 'XBD': 'synthetic'}
+    assert len(fetched.calls) == 1
+
+def test_single_target_keeps_the_list_shape(client, user, fetched):
+    r = client.get('/api/currencies/history?base=XBA&target=XBE', headers=user.headers)
+    assert isinstance(r.get_json(), list) and len(r.get_json()) == 30
+
+@pytest.mark.parametrize('targets', ['', 'US', 'USD,EURO', 'XAA,XAB,XAC'])
+def test_history_rejects_bad_targets(app, client, user, monkeypatch, targets):
+    monkeypatch.setitem(app.config, 'CURRENCY_HISTORY_MAX_TARGETS', 2)
+    r = client.get('/api/currencies/history?targets=' + targets, headers=user.headers)
+    assert r.status_code == 400
+
+def test_convert_batch(app, client, user):
+    with app.app_context():
+        for target, rate in (('XCB', 4.0), ('XCC', 0.5)):
+            if not ExchangeRate.query.filter_by(base_currency='XCA', target_currency=target).first():
+                db.session.add(ExchangeRate(base_currency='XCA', target_currency=target, rate=rate))
+        db.session.commit()
+    store_history(app, 'XCA', 'XCB', [date(2024, 3, 1), date(2024, 3, 10)], 2.0)
+
+    items = [
+        {'amount': 10, 'from': 'xca', 'to': 'XCB'},
+        {'amount': 10, 'from': 'XCC', 'to': 'XCA'},
+        {'amount': 10, 'from': 'XCA', 'to': 'XCB', 'date': '2024-03-12'},
+        {'amount': 10, 'from': 'XCB', 'to': 'XCA', 'date': '2024-03-05T10:00:00'},
+        {'amount': 10, 'from': 'XCA', 'to': 'XCB', 'date': '2024-06-01'},
+        {'amount': 'ten', 'from': 'XCA', 'to': 'XCB'},
+        {'amount': 10, 'from': 'XCA', 'to': 'XCB', 'date': 'yesterday'},
+        {'amount': 10, 'from': 'XCA', 'to': 'XCA'},
+        'XCA',
+        {'amount': 10, 'from': 'XCZ', 'to': 'XCA'},
+        {'amount': 10, 'from': 'XCZ', 'to': 'XCA', 'date': '2024-03-05'},
+    ]
+    r = client.post('/api/currencies/convert', json={'items': items}, headers=user.headers)
+    assert r.status_code == 200
+    results = r.get_json()['results']
+    assert [item['index'] for item in results] == list(range(len(items)))
+
+    assert (results[0]['rate'], results[0]['converted'], results[0]['rate_date']) == (4.0, 40.0, None)
+    assert results[1]['rate'] == 2.0
+    assert (results[2]['rate'], results[2]['rate_date']) == (2.0, '2024-03-10')
+    assert (results[3]['rate'], results[3]['rate_date'], results[3]['date']) == (0.5, '2024-03-01', '2024-03-05')
+    # More than a week past the last stored day: the current rate
+    assert (results[4]['rate'], results[4]['rate_date']) == (4.0, None)
+    assert [results[i]['error'] for i in (5, 6, 8)] == ['Invalid amount', 'Invalid date', 'Item must be an object']
+    assert all(results[i]['status'] == 'error' for i in (5, 6, 8))
+    assert results[7]['converted'] == 10
+    # No source knows the pair: an error, never a guessed 1.0
+    assert [results[i]['status'] for i in (9, 10)] == ['error', 'error']
+    assert [results[i]['error'] for i in (9, 10)] == ['Unknown currency pair'] * 2
+
+@pytest.mark.parametrize('body', [{}, {'items': []}, {'items': 'XCA'}, {'items': [{'amount': 1, 'from': 'XCA', 'to': 'XCB'}] * 3}])
+def test_convert_rejects_bad_batches(app, client, user, monkeypatch, body):
+    monkeypatch.setitem(app.config, 'CURRENCY_CONVERT_MAX_ITEMS', 2)
+    r = client.post('/api/currencies/convert', json=body, headers=user.headers)
+    assert r.status_code == 400
@@ -0,0 +1,97 @@
+import threading
+import time
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event, text
+
+import embedded
+import fx
+from extensions import db
+from models import ExchangeRate, RateHistory
+
+@pytest.fixture
+def begins(app):
+    """BEGIN statements issued on the app's SQLite engine while the test runs."""
+    with app.app_context():
+        engine = db.engine
+    seen = []
+
+    def record(conn, cursor, statement, *args):
+        if statement.startswith('BEGIN'):
+            seen.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    yield seen
+    event.remove(engine, 'before_cursor_execute', record)
+
+def test_sqlite_connections_use_wal(app):
+    with app.app_context():
+        assert db.session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        # ilike() folds non-ASCII text like Postgres
+        assert db.session.execute(text("SELECT lower('ДОМ')")).scalar() == 'дом'
+
+def test_reads_defer_and_writes_take_the_lock(client, user, begins):
+    client.get('/api/categories/', headers=user.headers)
+    assert begins and set(begins) == {'BEGIN DEFERRED'}
+    begins.clear()
+    client.post('/api/categories/', json={'name': 'Lock', 'type': 'expense'}, headers=user.headers)
+    assert 'BEGIN IMMEDIATE' in begins
+
+def test_get_rates_stores_under_an_immediate_transaction(app, client, monkeypatch, begins):
+    monkeypatch.setattr(fx, 'latest_rates', lambda base: {'USD': 0.011, 'EUR': 0.010} if base == 'QQA' else None)
+    r = client.get('/api/currencies/rates?base=QQA')
+    assert r.get_json()['rates'] == {'USD': 0.011, 'EUR': 0.010}
+    assert 'BEGIN IMMEDIATE' in begins
+    with app.app_context():
+        assert ExchangeRate.query.filter_by(base_currency='QQA').count() == 2
+
+def test_fetched_rate_and_history_are_written_immediate(app, client, user, monkeypatch, begins):
+    days = [(date.today() - timedelta(days=i), 2.0 + i / 100) for i in range(30, -1, -1)]
+    monkeypatch.setattr(fx, 'latest_rates', lambda base: {'QQC': 2.0} if base == 'QQB' else None)
+    monkeypatch.setattr(fx, 'fetch_histories', lambda base, targets, start, end: {t: days for t in targets})
+
+    r = client.get('/api/currencies/history?base=QQB&target=QQC', headers=user.headers)
+    assert r.status_code == 200 and len(r.get_json()) == len(days)
+    assert 'BEGIN IMMEDIATE' in begins
+    with app.app_context():
+        assert RateHistory.query.filter_by(base_currency='QQB', target_currency='QQC').count() == len(days)
+
+    begins.clear()
+    with app.test_request_context('/api/analytics/summary'):
+        from routes.currencies import lookup_rate
+
+        assert lookup_rate('QQB', 'QQC') == 2.0
+        assert 'BEGIN IMMEDIATE' in begins
+        assert ExchangeRate.query.filter_by(base_currency='QQB', target_currency='QQC').one().rate == 2.0
+        db.session.remove()
+
+def test_get_write_waits_for_a_concurrent_writer(app, client, monkeypatch):
+    """A GET that reads, then writes while another connection holds the write lock, still stores its rows."""
+    monkeypatch.setattr(fx, 'latest_rates', lambda base: {'USD': 0.5} if base == 'QQD' else None)
+    with app.app_context():
+        engine = db.engine
+    locked, release = threading.Event(), threading.Event()
+
+    def writer():
+        # Outside a request: BEGIN IMMEDIATE, holding the write lock until released
+        with engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO exchange_rate (base_currency, target_currency, rate) VALUES ('QQD', 'EUR', 1.0)")
+            locked.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    locked.wait(5)
+    threading.Timer(0.3, release.set).start()
+    started = time.monotonic()
+    r = client.get('/api/currencies/rates?base=QQD')
+    thread.join()
+    assert time.monotonic() - started >= 0.25
+    assert r.get_json()['rates'] == {'USD': 0.5, 'EUR': 1.0}
+
+def test_begin_write_is_a_no_op_outside_read_requests(app):
+    with app.test_request_context('/', method='POST'):
+        embedded.begin_write(db.session)
+        assert db.session().in_transaction() is False
+        db.session.remove()
@@ -0,0 +1,148 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+from flask_jwt_extended import decode_token
+
+import events
+from config import Config
+
+@pytest.fixture
+def subscription(user):
+    q = events.broker.subscribe(user.id)
+    yield q
+    events.broker.unsubscribe(user.id, q)
+
+def _drain(q):
+    out = []
+    while True:
+        try:
+            out.append(q.get_nowait())
+        except queue.Empty:
+            return out
+
+def _of_type(evts, evt_type):
+    return [e['data'] for e in evts if e['type'] == evt_type]
+
+def _now():
+    return datetime.utcnow().replace(microsecond=0).isoformat()
+
+def _budget(client, user, category_id, limit):
+    r = client.post('/api/budgets/', json={'category_id': category_id, 'limit': limit}, headers=user.headers)
+    assert r.status_code == 201
+
+def test_single_write_publishes_transaction_balance_and_budget(client, user, categories, add_transaction, subscription):
+    _budget(client, user, categories['expense'], 100)
+    _drain(subscription)
+
+    txn = add_transaction(user, amount=85, date=_now())
+    evts = _drain(subscription)
+    assert _of_type(evts, 'transaction') == [{'op': 'created', 'id': txn}]
+    assert _of_type(evts, 'balance') == [{'delta': -85, 'currency': 'RUB'}]
+    assert [b['threshold'] for b in _of_type(evts, 'budget')] == [80]
+
+def test_batch_publishes_balance_and_budget_events(client, user, categories, add_transaction, subscription):
+    _budget(client, user, categories['expense'], 100)
+    old = add_transaction(user, amount=30, type='income', date='2024-01-01T00:00:00')
+    _drain(subscription)
+
+    r = client.post('/api/transactions/batch', json={'operations': [
+        {'op': 'create', 'amount': 60, 'type': 'expense', 'category_id': categories['expense'], 'date': _now()},
+        {'op': 'create', 'amount': 45, 'type': 'expense', 'category_id': categories['expense'], 'date': _now()},
+        {'op': 'delete', 'id': old},
+    ]}, headers=user.headers)
+    assert r.status_code == 200
+    evts = _drain(subscription)
+    assert _of_type(evts, 'transactions_changed') == [{'created': 2, 'updated': 0, 'deleted': 1}]
+    assert _of_type(evts, 'transaction') == []
+    assert _of_type(evts, 'balance') == [{'delta': -135, 'currency': 'RUB'}]
+    assert [b['threshold'] for b in _of_type(evts, 'budget')] == [80, 100]
+
+def test_batch_update_moves_budget_spend(client, user, categories, add_transaction, subscription):
+    _budget(client, user, categories['expense'], 100)
+    txn = add_transaction(user, amount=50, date=_now())
+    _drain(subscription)
+
+    client.post('/api/transactions/batch', json={'operations': [{'op': 'update', 'id': txn, 'amount': 90}]},
+                headers=user.headers)
+    evts = _drain(subscription)
+    assert _of_type(evts, 'balance') == [{'delta': -40, 'currency': 'RUB'}]
+    assert [b['threshold'] for b in _of_type(evts, 'budget')] == [80]
+
+def test_bulk_delete_publishes_balance(client, user, add_transaction, subscription):
+    add_transaction(user, amount=20, description='taxi')
+    add_transaction(user, amount=70, type='income', description='taxi refund')
+    add_transaction(user, amount=5, description='coffee')
+    _drain(subscription)
+
+    r = client.post('/api/transactions/bulk/delete?search=taxi', json={}, headers=user.headers)
+    assert r.status_code == 200, r.get_json()
+    evts = _drain(subscription)
+    assert _of_type(evts, 'transactions_changed') == [{'deleted': 2}]
+    assert _of_type(evts, 'balance') == [{'delta': -50, 'currency': 'RUB'}]
+
+def test_bulk_recategorize_publishes_budget_crossing(client, user, add_transaction, subscription):
+    travel = client.post('/api/categories/', json={'name': 'Travel', 'type': 'expense'}, headers=user.headers).get_json()['id']
+    _budget(client, user, travel, 100)
+    add_transaction(user, amount=120, description='train', date=_now())
+    _drain(subscription)
+
+    client.post('/api/transactions/bulk/recategorize?search=train', json={'category_id': travel}, headers=user.headers)
+    evts = _drain(subscription)
+    assert _of_type(evts, 'balance') == []
+    assert [(b['category_id'], b['threshold']) for b in _of_type(evts, 'budget')] == [(travel, 80), (travel, 100)]
+
+def _stream_token(client, user):
+    r = client.post('/api/events/token', headers=user.headers)
+    assert r.status_code == 200
+    return r.get_json()['token']
+
+def test_streams_are_capped_below_the_thread_count(app, client, user):
+    assert Config.SSE_MAX_STREAMS == 8 - Config.SSE_RESERVED_THREADS
+
+    app.config['SSE_MAX_STREAMS'] = 0
+    try:
+        r = client.get(f'/api/events/stream?token={_stream_token(client, user)}')
+    finally:
+        app.config['SSE_MAX_STREAMS'] = Config.SSE_MAX_STREAMS
+    assert r.status_code == 503
+    assert r.headers['Retry-After'] == '10'
+
+def test_stream_cap_holds_under_concurrent_connects():
+    broker = events.Broker()
+    barrier = threading.Barrier(16)
+
+    def connect(user_id):
+        barrier.wait()
+        return broker.subscribe(user_id, limit=3)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        queues = list(pool.map(connect, range(16)))
+    assert sum(q is not None for q in queues) == 3
+    assert broker.stream_count() == 3
+
+def test_stream_takes_a_short_lived_stream_token(app, client, user, monkeypatch):
+    monkeypatch.setitem(app.config, 'SSE_MAX_SECONDS', 0)
+    token = _stream_token(client, user)
+    with app.app_context():
+        claims = decode_token(token)
+    assert claims['scope'] == 'events'
+    assert claims['exp'] - claims['iat'] == app.config['SSE_TOKEN_SECONDS']
+
+    r = client.get(f'/api/events/stream?token={token}')
+    assert r.status_code == 200
+    assert r.data == b'retry: 3000\n\n'
+    assert events.broker.stream_count() == 0
+
+def test_stream_rejects_access_tokens(client, user):
+    assert client.get('/api/events/stream?token=nope').status_code == 401
+    assert client.get(f'/api/events/stream?token={user.token}').status_code == 401
+
+def test_stream_tokens_open_nothing_else(client, user):
+    token = _stream_token(client, user)
+    r = client.get('/api/auth/me', headers={'Authorization': 'Bearer ' + token})
+    assert r.status_code == 401
+    # Nor can they mint more stream tokens
+    assert client.post('/api/events/token', headers={'Authorization': 'Bearer ' + token}).status_code == 401
@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy import event
+
+from extensions import db
+
+@pytest.fixture
+def statements(app):
+    with app.app_context():
+        engine = db.engine
+    seen = []
+
+    def record(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    yield seen
+    event.remove(engine, 'before_cursor_execute', record)
+
+def test_sparse_fields_fetch_only_their_columns(client, user, add_transaction, statements):
+    add_transaction(user, amount=12, description='lunch')
+    statements.clear()
+    rows = client.get('/api/transactions/?fields=id,amount', headers=user.headers).get_json()
+    assert rows == [{'id': rows[0]['id'], 'amount': 12}]
+
+    listing = [s for s in statements if 'FROM "transaction"' in s and s.lstrip().startswith('SELECT')]
+    assert len(listing) == 1
+    selected = listing[0].split('FROM')[0]
+    assert '"transaction".amount' in selected and 'description' not in selected and 'category_id' not in selected
+
+def test_unknown_fields_are_rejected(client, user):
+    r = client.get('/api/transactions/?fields=id,secret', headers=user.headers)
+    assert r.status_code == 400
+    assert 'secret' in r.get_json()['msg']
+
+def test_columnar_sends_shared_values_once(client, user, categories, add_transaction):
+    for i in range(40):
+        add_transaction(user, amount=i, description=f'item {i}')
+    rows = client.get('/api/transactions/', headers=user.headers)
+    r = client.get('/api/transactions/?format=columnar', headers=user.headers)
+    data = r.get_json()
+
+    assert data['count'] == 40
+    assert data['base_currency'] == 'RUB'
+    assert set(data['columns']) == {'id', 'amount', 'currency', 'amount_in_base', 'description', 'date', 'type',
+                                    'category_id', 'tags', 'attachment'}
+    assert all(len(values) == 40 for values in data['columns'].values())
+    assert list(data['categories']) == [str(categories['expense'])]
+    assert data['categories'][str(categories['expense'])]['name'] == 'Food'
+    assert set(data['columns']['category_id']) == {categories['expense']}
+    assert sorted(data['columns']['amount']) == sorted(row['amount'] for row in rows.get_json())
+    assert len(r.data) < len(rows.data) / 1.5
+
+def test_columnar_with_fields_adds_category_ids_for_names(client, user, add_transaction):
+    add_transaction(user)
+    data = client.get('/api/transactions/?format=columnar&fields=amount,category_name', headers=user.headers).get_json()
+    assert set(data['columns']) == {'amount', 'category_id'}
+    assert 'base_currency' not in data
+    assert [c['name'] for c in data['categories'].values()] == ['Food']
@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import forecast
+
+def test_recurring_and_seasonal_series(app, client, user, categories, add_transaction):
+    gifts = client.post('/api/categories/', json={'name': 'Gifts', 'type': 'expense'}, headers=user.headers).get_json()['id']
+    # Two full years: rent and salary every month, gifts only in December
+    for year in (2023, 2024):
+        for month in range(1, 13):
+            add_transaction(user, amount=50, date=f'{year}-{month:02d}-10T12:00:00')
+            add_transaction(user, amount=1000, type='income', date=f'{year}-{month:02d}-01T12:00:00')
+        r = client.post('/api/transactions/', json={'amount': 240, 'type': 'expense', 'category_id': gifts,
+                                                    'date': f'{year}-12-20T12:00:00'}, headers=user.headers)
+        assert r.status_code == 201
+
+    # The clock is fixed: the forecast runs from February 2025 to January 2026
+    with app.app_context():
+        result = forecast.compute(user.id, 'RUB', 12, now=datetime(2025, 1, 15))
+    assert result['history_months'] == 24
+
+    series = {(c['category_id'], c['type']): c for c in result['categories']}
+    rent, salary = series[(categories['expense'], 'expense')], series[(categories['income'], 'income')]
+    assert rent['recurring'] and rent['values'] == [50.0] * 12
+    assert salary['recurring'] and salary['values'] == [1000.0] * 12
+    # Not recurring: its trailing mean (240 / 12) scaled by December's seasonal index (12)
+    seasonal = series[(gifts, 'expense')]
+    assert not seasonal['recurring']
+    assert seasonal['values'] == [0.0] * 10 + [240.0, 0.0]
+
+    months = result['months']
+    assert [m['key'] for m in months][:2] == ['2025-02-01', '2025-03-01']
+    assert [m['expense'] for m in months] == [50.0] * 10 + [290.0, 50.0]
+    assert months[0]['net'] == 950.0
+    # Today's balance (24000 - 1200 - 480) carried forward
+    assert months[0]['balance'] == 22320 + 950
+    assert months[-1]['balance'] == 22320 + 12 * 950 - 240
+
+def test_endpoint_projects_recent_history(client, user, add_transaction):
+    now = datetime.utcnow()
+    for back in range(1, 5):
+        month = (now.year * 12 + now.month - 1) - back
+        add_transaction(user, amount=80, date=f'{month // 12}-{month % 12 + 1:02d}-05T12:00:00')
+    r = client.get('/api/analytics/forecast?months=3', headers=user.headers)
+    assert r.status_code == 200
+    assert [m['expense'] for m in r.get_json()['months']] == [80.0] * 3
+
+def test_cache_follows_the_calendar_month(app, user, add_transaction):
+    add_transaction(user, amount=50, date='2024-03-10T12:00:00')
+    with app.app_context():
+        may = forecast.compute(user.id, 'RUB', 2, now=datetime(2024, 5, 20))
+        assert forecast.compute(user.id, 'RUB', 2, now=datetime(2024, 5, 31)) is may
+        june = forecast.compute(user.id, 'RUB', 2, now=datetime(2024, 6, 1))
+        next_year = forecast.compute(user.id, 'RUB', 2, now=datetime(2025, 6, 1))
+    assert [m['key'] for m in may['months']] == ['2024-06-01', '2024-07-01']
+    assert [m['key'] for m in june['months']] == ['2024-07-01', '2024-08-01']
+    assert [m['key'] for m in next_year['months']] == ['2025-07-01', '2025-08-01']
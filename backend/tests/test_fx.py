@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fx
+
+class Provider:
+    """A local fake of both providers: answers every GET with `status`/`body` after `delay`, counting hits."""
+
+    def __init__(self):
+        self.status, self.body, self.delay = 200, {'rates': {'EUR': 0.5}}, 0
+        self.hits = []
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                provider.hits.append(self.path)
+                time.sleep(provider.delay)
+                payload = json.dumps(provider.body).encode()
+                self.send_response(provider.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+@pytest.fixture
+def provider(app, monkeypatch):
+    fake = Provider()
+    for name, value in (('FX_RATES_URL', fake.url + '/latest/{base}'),
+                        ('FX_HISTORY_URL', fake.url + '/{start}..{end}?from={base}&to={target}'),
+                        ('FX_TIMEOUT', 0.5), ('FX_BREAKER_FAILURES', 3), ('FX_BREAKER_OPEN_SECONDS', 0.3),
+                        ('FX_RATES_TTL', 600), ('FX_NEGATIVE_TTL', 600), ('FX_WAIT_SECONDS', 3)):
+        monkeypatch.setitem(app.config, name, value)
+    # Fresh per-worker state: session, pool, breakers and caches are rebuilt on first use
+    for name in ('_pid', '_session', '_pool', '_config', '_breakers', '_cache', '_inflight'):
+        monkeypatch.setattr(fx, name, None if name in ('_pid', '_session', '_pool', '_config') else {})
+    with app.app_context():
+        fx._get()
+        yield fake
+    fake.server.shutdown()
+    fake.server.server_close()
+
+def test_latest_rates_are_cached(provider):
+    assert fx.latest_rates('USD') == {'EUR': 0.5}
+    assert fx.latest_rates('USD') == {'EUR': 0.5}
+    assert fx.latest_rate('USD', 'EUR') == 0.5
+    assert provider.hits == ['/latest/USD']
+
+def test_unknown_currency_is_negatively_cached(provider):
+    provider.status, provider.body = 404, {'error': 'unsupported-code'}
+    assert fx.latest_rates('XXA') is None
+    assert fx.latest_rates('XXA') is None
+    assert len(provider.hits) == 1
+    # A 4xx is the request's fault: the provider stays trusted
+    assert fx.breaker(fx.RATES_PROVIDER).state == fx.CLOSED
+
+def test_history_without_points_is_negatively_cached(provider):
+    provider.body = {'rates': {}}
+    start, end = date(2024, 3, 1), date(2024, 3, 31)
+    assert fx.fetch_history('USD', 'XXB', start, end) is None
+    assert fx.fetch_history('USD', 'XXB', start, end) is None
+    assert len(provider.hits) == 1
+
+    provider.body = {'rates': {'2024-03-02': {'EUR': 0.9}, '2024-03-01': {'EUR': 0.8}}}
+    assert fx.fetch_histories('USD', ['EUR'], start, end) == {'EUR': [(date(2024, 3, 1), 0.8), (date(2024, 3, 2), 0.9)]}
+
+def test_breaker_opens_after_failures_and_recovers(provider):
+    provider.status = 503
+    start, end = date(2024, 3, 1), date(2024, 3, 31)
+    for target in ('EUR', 'GBP', 'JPY'):
+        assert fx.fetch_history('USD', target, start, end) is None
+    cb = fx.breaker(fx.HISTORY_PROVIDER)
+    assert cb.state == fx.OPEN
+
+    # Open: answered at once, without touching the network
+    assert fx.get_json(fx.HISTORY_PROVIDER, provider.url + '/any') is None
+    assert len(provider.hits) == 3
+    # The other provider has its own breaker
+    assert fx.breaker(fx.RATES_PROVIDER).state == fx.CLOSED
+
+    # After FX_BREAKER_OPEN_SECONDS one trial call goes out; a failure opens it again
+    time.sleep(0.35)
+    assert fx.get_json(fx.HISTORY_PROVIDER, provider.url + '/any') is None
+    assert cb.state == fx.OPEN and len(provider.hits) == 4
+
+    time.sleep(0.35)
+    provider.status = 200
+    assert fx.get_json(fx.HISTORY_PROVIDER, provider.url + '/any') == (200, provider.body)
+    assert cb.state == fx.CLOSED and cb.failures == 0
+
+def test_half_open_lets_one_trial_through(provider):
+    cb = fx.breaker(fx.RATES_PROVIDER)
+    for _ in range(3):
+        cb.record(False, 3)
+    time.sleep(0.35)
+    assert cb.allow(0.3) is True
+    assert cb.state == fx.HALF_OPEN
+    assert cb.allow(0.3) is False
+
+def test_timeouts_count_as_failures(provider):
+    provider.delay = 0.7
+    assert fx.get_json(fx.RATES_PROVIDER, provider.url + '/slow') is None
+    assert fx.breaker(fx.RATES_PROVIDER).failures == 1
+
+def test_concurrent_lookups_share_one_call(provider):
+    provider.delay = 0.2
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: fx.latest_rates('CHF'), range(8)))
+    assert results == [{'EUR': 0.5}] * 8
+    assert provider.hits == ['/latest/CHF']
+
+def test_callers_stop_waiting_for_a_slow_provider(app, provider, monkeypatch):
+    monkeypatch.setitem(app.config, 'FX_WAIT_SECONDS', 0.1)
+    provider.delay = 0.3
+    started = time.monotonic()
+    assert fx.latest_rates('NOK') is None
+    assert time.monotonic() - started < 0.3
+    # The call carried on and filled the cache for the next request
+    time.sleep(0.4)
+    assert fx.latest_rates('NOK') == {'EUR': 0.5}
+    assert provider.hits == ['/latest/NOK']
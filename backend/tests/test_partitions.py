@@ -0,0 +1,114 @@
+import os
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import NullPool
+
+import partitions
+
+POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL')
+
+def test_partition_ranges_cover_whole_periods():
+    ranges = list(partitions.partition_ranges(date(2024, 11, 20), date(2025, 1, 5), 'month'))
+    assert [name for name, _, _ in ranges] == ['transaction_m2024_11', 'transaction_m2024_12', 'transaction_m2025_01']
+    assert ranges[1][1:] == (date(2024, 12, 1), date(2025, 1, 1))
+    assert [name for name, _, _ in partitions.partition_ranges(date(2023, 6, 1), date(2024, 2, 1), 'year')] == \
+        ['transaction_y2023', 'transaction_y2024']
+
+def test_sqlite_keeps_single_table(tmp_path, monkeypatch):
+    monkeypatch.setenv('TRANSACTION_PARTITIONING', 'month')
+    engine = create_engine('sqlite:///' + str(tmp_path / 'plain.db'), poolclass=NullPool)
+    assert partitions.maintain(engine) == []
+    assert partitions.mismatch(engine) is None
+    assert partitions.run('convert', engine, 'month') == "not Postgres, single table"
+
+def test_no_migration_converts_the_table():
+    from alembic.script import ScriptDirectory
+
+    script = ScriptDirectory(os.path.join(os.path.dirname(partitions.__file__), 'migrations'))
+    assert len(script.get_heads()) == 1
+    for revision in script.walk_revisions():
+        with open(revision.path) as f:
+            assert 'partitions' not in f.read(), revision.revision
+
+@pytest.fixture
+def pg_engine(monkeypatch):
+    if not POSTGRES_URL:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+    from models import db
+
+    monkeypatch.delenv('TRANSACTION_PARTITIONING', raising=False)
+    engine = create_engine(POSTGRES_URL, poolclass=NullPool)
+    with engine.begin() as conn:
+        conn.execute(text('DROP TABLE IF EXISTS "transaction" CASCADE'))
+    db.metadata.drop_all(engine)
+    # The head schema, as migrations leave it
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO \"user\" (id, email, password_hash) VALUES (1, 'pg@example.com', 'x')"
+        ))
+        conn.execute(text("INSERT INTO category (id, name, type) VALUES (1, 'Food', 'expense')"))
+        for i, day in enumerate([datetime(2023, 5, 2), datetime(2024, 8, 9), datetime.utcnow()], start=1):
+            conn.execute(text(
+                "INSERT INTO \"transaction\" (id, amount, currency, date, type, category_id, user_id, version, "
+                "amount_in_base, base_rate, base_currency) "
+                "VALUES (:id, :amount, 'EUR', :date, 'expense', 1, 1, :id, :in_base, 1.1, 'USD')"
+            ), {'id': i, 'amount': 10.0 * i, 'date': day, 'in_base': 11.0 * i})
+        conn.execute(text("SELECT setval('transaction_id_seq', 3)"))
+    yield engine
+    with engine.begin() as conn:
+        conn.execute(text('DROP TABLE IF EXISTS "transaction" CASCADE'))
+    db.metadata.drop_all(engine)
+    engine.dispose()
+
+def _rows(engine):
+    with engine.connect() as conn:
+        return conn.execute(text(
+            'SELECT id, amount, amount_in_base, base_rate, base_currency FROM "transaction" ORDER BY id'
+        )).all()
+
+def test_convert_and_unconvert_keep_later_columns(pg_engine):
+    before = _rows(pg_engine)
+    assert partitions.run('status', pg_engine) == "not partitioned"
+
+    assert partitions.run('convert', pg_engine, 'year') == "converted, partitioned by year"
+    assert partitions.run('convert', pg_engine, 'month') == "already partitioned by year"
+    assert partitions.run('status', pg_engine) == "partitioned by year"
+    assert _rows(pg_engine) == before
+    with pg_engine.connect() as conn:
+        assert {'transaction_y2023', 'transaction_y2024', partitions.DEFAULT_PARTITION} <= partitions.existing_partitions(conn)
+        assert conn.execute(text('SELECT count(*) FROM transaction_default')).scalar() == 0
+    indexes = {ix['name'] for ix in inspect(pg_engine).get_indexes('transaction')}
+    assert {'ix_transaction_user_version', 'ix_transaction_user_date'} <= indexes
+
+    with pg_engine.begin() as conn:
+        new_id = conn.execute(text(
+            "INSERT INTO \"transaction\" (amount, date, type, category_id, user_id, version) "
+            "VALUES (5, now(), 'expense', 1, 1, 4) RETURNING id"
+        )).scalar()
+    assert new_id == 4
+
+    assert partitions.run('unconvert', pg_engine) == "converted back to a plain table"
+    assert partitions.run('unconvert', pg_engine) == "already a plain table"
+    assert _rows(pg_engine)[:3] == before
+    inspector = inspect(pg_engine)
+    assert inspector.get_pk_constraint('transaction')['constrained_columns'] == ['id']
+    assert {fk['referred_table'] for fk in inspector.get_foreign_keys('transaction')} == {'user', 'category'}
+    assert {ix['name'] for ix in inspector.get_indexes('transaction')} == {'ix_transaction_user_version'}
+
+def test_layout_comes_from_the_catalog(pg_engine, monkeypatch):
+    monkeypatch.setenv('TRANSACTION_PARTITIONING', 'month')
+    assert 'not partitioned' in partitions.mismatch(pg_engine)
+    assert partitions.maintain(pg_engine) == []
+
+    partitions.run('convert', pg_engine, 'month')
+    assert partitions.mismatch(pg_engine) is None
+    monkeypatch.setenv('TRANSACTION_PARTITIONING', 'year')
+    assert 'partitioned by month' in partitions.mismatch(pg_engine)
+    # Upcoming partitions follow the layout in place, not the environment
+    with pg_engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE {max(partitions.existing_partitions(conn) - {partitions.DEFAULT_PARTITION})}"))
+    created = partitions.maintain(pg_engine)
+    assert len(created) == 1 and created[0].startswith('transaction_m')
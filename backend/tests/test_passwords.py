@@ -0,0 +1,96 @@
+import time
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+import passwords
+from extensions import db
+from models import User
+
+@pytest.fixture(autouse=True)
+def clean_throttle():
+    passwords.throttle._attempts.clear()
+    yield
+    passwords.throttle._attempts.clear()
+
+def _login(client, email, password, **headers):
+    return client.post('/api/auth/login', json={'email': email, 'password': password}, headers=headers)
+
+def _set_hash(app, user, pw_hash):
+    import shards
+
+    with app.app_context():
+        shards.use(user.id)
+        db.session.get(User, user.id).password_hash = pw_hash
+        db.session.commit()
+
+def _get_hash(app, user):
+    import shards
+
+    with app.app_context():
+        shards.use(user.id)
+        return db.session.get(User, user.id).password_hash
+
+def test_failed_logins_are_throttled_per_email(client, user):
+    for _ in range(5):
+        assert _login(client, user.email, 'wrong').status_code == 401
+    r = _login(client, user.email, 'secret')
+    assert r.status_code == 429
+    assert int(r.headers['Retry-After']) > 0
+
+def test_forwarded_for_is_ignored_without_proxy_fix(app, client, make_user):
+    app.config['LOGIN_MAX_ATTEMPTS_PER_IP'] = 3
+    try:
+        for i in range(3):
+            email = make_user().email
+            assert _login(client, email, 'wrong', **{'X-Forwarded-For': f'10.0.0.{i}'}).status_code == 401
+        # A fresh forged address does not reset the per-IP budget
+        r = _login(client, make_user().email, 'secret', **{'X-Forwarded-For': '10.0.0.99'})
+        assert r.status_code == 429
+    finally:
+        app.config['LOGIN_MAX_ATTEMPTS_PER_IP'] = 20
+
+def test_login_upgrades_weaker_hash(app, client, user):
+    _set_hash(app, user, generate_password_hash('secret', 'pbkdf2:sha256:500'))
+    assert _login(client, user.email, 'secret').status_code == 200
+    assert _get_hash(app, user).startswith('pbkdf2:sha256:1000$')
+
+def test_scrypt_hashes_are_never_downgraded(app, client, user):
+    scrypt_hash = generate_password_hash('secret', 'scrypt:1024:8:1')
+    _set_hash(app, user, scrypt_hash)
+    assert _login(client, user.email, 'secret').status_code == 200
+    assert _get_hash(app, user) == scrypt_hash
+
+def test_needs_rehash_treats_werkzeug_default_as_current(app):
+    with app.app_context():
+        app.config['PASSWORD_HASH_METHOD'] = 'scrypt'
+        try:
+            assert not passwords.needs_rehash(generate_password_hash('x'))
+            assert passwords.needs_rehash(generate_password_hash('x', 'pbkdf2:sha256:1000'))
+        finally:
+            app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+
+def test_slow_hash_returns_503(app, client, user, monkeypatch):
+    def slow_check(pw_hash, password):
+        time.sleep(0.3)
+        return True
+
+    monkeypatch.setattr(passwords, 'check_password_hash', slow_check)
+    app.config['PASSWORD_HASH_TIMEOUT'] = 0.05
+    try:
+        r = _login(client, user.email, 'secret')
+    finally:
+        app.config['PASSWORD_HASH_TIMEOUT'] = 10
+    assert r.status_code == 503
+    assert r.headers['Retry-After'] == '1'
+
+def test_busy_rehash_does_not_fail_a_valid_login(app, client, user, monkeypatch):
+    weak = generate_password_hash('secret', 'pbkdf2:sha256:500')
+    _set_hash(app, user, weak)
+
+    def busy(password):
+        raise passwords.HashingBusy()
+
+    monkeypatch.setattr(passwords, 'hash_password', busy)
+    assert _login(client, user.email, 'secret').status_code == 200
+    assert _get_hash(app, user) == weak
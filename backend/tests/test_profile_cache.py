@@ -0,0 +1,57 @@
+from flask_jwt_extended import decode_token
+from sqlalchemy import event
+
+import profile_cache
+from extensions import db
+
+def _user_queries(app, fn):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        if 'FROM user' in statement or 'FROM "user"' in statement:
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        result = fn()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return result, statements
+
+def test_token_carries_profile_claim(app, user):
+    with app.app_context():
+        claims = decode_token(user.token)
+    assert claims['sub'] == str(user.id)
+    assert claims['profile']['email'] == user.email
+    assert claims['profile']['base_currency'] == 'RUB'
+    assert claims['profile']['v'] >= 1
+
+def test_me_does_not_query_user_table(app, client, user):
+    r, statements = _user_queries(app, lambda: client.get('/api/auth/me', headers=user.headers))
+    assert r.status_code == 200
+    assert r.get_json()['email'] == user.email
+    assert statements == []
+
+def test_profile_update_overrides_older_tokens(client, user):
+    r = client.put('/api/settings/profile', json={'name': 'Renamed'}, headers=user.headers)
+    assert r.status_code == 200
+    assert r.get_json()['token'] != user.token
+
+    # The old token still carries the old name; the worker knows a newer version
+    me = client.get('/api/auth/me', headers=user.headers).get_json()
+    assert me['name'] == 'Renamed'
+
+def test_remember_keeps_newest_version_and_evicts_oldest(app):
+    with app.app_context():
+        app.config['PROFILE_CACHE_SIZE'] = 2
+        try:
+            profile_cache.remember(-1, {'v': 3, 'name': 'new'})
+            assert profile_cache.remember(-1, {'v': 2, 'name': 'old'})['name'] == 'new'
+            profile_cache.remember(-2, {'v': 1})
+            profile_cache.remember(-3, {'v': 1})
+            assert -1 not in profile_cache._cache
+            assert -3 in profile_cache._cache
+        finally:
+            app.config['PROFILE_CACHE_SIZE'] = 1024
@@ -0,0 +1,110 @@
+import os
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+import metrics
+import ratelimit
+
+POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL')
+
+@pytest.fixture
+def limiter(app, monkeypatch):
+    """A small, barely refilling bucket and a fresh local backend."""
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_CAPACITY', 15)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_REFILL_PER_SECOND', 0.01)
+    monkeypatch.setitem(app.extensions, 'ratelimit_backend', ratelimit.LocalBackend())
+    return app.config
+
+def test_take_refills_and_caps():
+    assert ratelimit.take(0, 5, capacity=10, rate=1, cost=3) == (2, 0)
+    assert ratelimit.take(10, 100, capacity=10, rate=1, cost=3) == (7, 0)
+    assert ratelimit.take(1, 0, capacity=10, rate=2, cost=6) == (1, 3)
+    # Above capacity costs a full bucket; refunds always fit
+    assert ratelimit.take(10, 0, capacity=10, rate=1, cost=50) == (0, 0)
+    assert ratelimit.take(0, 0, capacity=10, rate=1, cost=-4) == (4, 0)
+    assert ratelimit.take(8, 0, capacity=10, rate=1, cost=-4) == (10, 0)
+
+def test_all_time_summary_is_limited_per_user(client, make_user, limiter):
+    first, second = make_user(), make_user()
+    url = '/api/analytics/summary?period=all'
+    before = metrics.get('ratelimit_decisions_total', endpoint='analytics.get_summary', result='limited') or 0
+
+    assert client.get(url, headers=first.headers).status_code == 200
+    r = client.get(url, headers=first.headers)
+    assert r.status_code == 429
+    assert int(r.headers['Retry-After']) >= 1
+    assert metrics.get('ratelimit_decisions_total', endpoint='analytics.get_summary', result='limited') == before + 1
+
+    # Cheaper ranged requests still fit, and other users have their own bucket
+    assert client.get('/api/analytics/summary?period=month', headers=first.headers).status_code == 200
+    assert client.get(url, headers=second.headers).status_code == 200
+
+def test_cost_overrides(client, user, limiter, monkeypatch):
+    monkeypatch.setitem(limiter, 'RATE_LIMIT_COSTS', {'analytics.get_summary': 0})
+    for _ in range(3):
+        assert client.get('/api/analytics/summary?period=all', headers=user.headers).status_code == 200
+
+def test_admission_gate_queues_then_rejects():
+    gate = ratelimit.AdmissionGate()
+    assert gate.enter(1, 1, 1) == 'admitted'
+    assert gate.enter(1, 0, 1) == 'rejected'
+    assert gate.enter(1, 1, 0.01) == 'timeout'
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(gate.enter(1, 1, 5)))
+    waiter.start()
+    while not gate.waiting:
+        pass
+    gate.leave()
+    waiter.join()
+    assert results == ['queued'] and gate.running == 1
+
+def test_busy_worker_answers_503_and_refunds(client, user, limiter, monkeypatch):
+    monkeypatch.setitem(limiter, 'ADMISSION_QUEUE_DEPTH', 0)
+    monkeypatch.setattr(ratelimit.gate, 'running', limiter['ADMISSION_MAX_CONCURRENT'])
+
+    r = client.get('/api/analytics/summary?period=all', headers=user.headers)
+    assert r.status_code == 503
+    assert r.headers['Retry-After'] == str(limiter['ADMISSION_RETRY_AFTER'])
+
+    monkeypatch.setattr(ratelimit.gate, 'running', 0)
+    # The rejected request's tokens were given back
+    assert client.get('/api/analytics/summary?period=all', headers=user.headers).status_code == 200
+
+def test_refunds_never_overfill_a_bucket(client, user, limiter, monkeypatch):
+    # A cost above capacity is charged as a full bucket, and only that is given back
+    monkeypatch.setitem(limiter, 'RATE_LIMIT_COSTS', {'analytics.get_summary': 50})
+    monkeypatch.setitem(limiter, 'ADMISSION_QUEUE_DEPTH', 0)
+    monkeypatch.setattr(ratelimit.gate, 'running', limiter['ADMISSION_MAX_CONCURRENT'])
+    backend = client.application.extensions['ratelimit_backend']
+
+    for _ in range(5):
+        assert client.get('/api/analytics/summary?period=all', headers=user.headers).status_code == 503
+        tokens, _ = backend._buckets[f'user:{user.id}']
+        assert tokens <= limiter['RATE_LIMIT_CAPACITY']
+    assert tokens == pytest.approx(limiter['RATE_LIMIT_CAPACITY'], abs=0.1)
+
+def test_postgres_backend_shares_buckets():
+    if not POSTGRES_URL:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+    engine = create_engine(POSTGRES_URL, poolclass=NullPool)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_bucket "
+            "(key VARCHAR(64) PRIMARY KEY, tokens FLOAT NOT NULL, updated_at TIMESTAMP NOT NULL)"
+        ))
+        conn.execute(text("DELETE FROM rate_limit_bucket WHERE key = 'user:test'"))
+    try:
+        # Two backends stand in for two workers
+        workers = ratelimit.PostgresBackend(engine), ratelimit.PostgresBackend(engine)
+        assert workers[0].consume('user:test', 8, 10, 0.001) == 0
+        assert workers[1].consume('user:test', 8, 10, 0.001) > 0
+        assert workers[1].consume('user:test', 2, 10, 0.001) == 0
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text('DROP TABLE rate_limit_bucket'))
+        engine.dispose()
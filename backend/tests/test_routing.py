@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+import metrics
+import routing
+
+def _replicate(urls):
+    """Bring the replica up to date with the primary (SQLite online backup)."""
+    primary = sqlite3.connect(urls['primary'].removeprefix('sqlite:///'))
+    replica = sqlite3.connect(urls['replica'].removeprefix('sqlite:///'))
+    primary.backup(replica)
+    primary.close()
+    replica.close()
+
+def _register(client):
+    r = client.post('/api/auth/register', json={'email': 'replica@example.com', 'password': 'secret', 'name': 'R'})
+    assert r.status_code == 201
+    return {'Authorization': 'Bearer ' + r.get_json()['token']}
+
+def _add(client, headers, amount):
+    r = client.post('/api/transactions/', json={'amount': amount, 'type': 'expense', 'category_id': 1,
+                                                 'date': '2024-03-15T12:00:00'}, headers=headers)
+    assert r.status_code == 201
+
+def _expenses(client, headers):
+    return client.get('/api/analytics/summary?period=all', headers=headers).get_json()['total_expenses']
+
+def test_listed_reads_go_to_the_replica(build_app):
+    app, urls = build_app(replica=True, DATABASE_REPLICA_STICKY_SECONDS=0)
+    client = app.test_client()
+    headers = _register(client)
+    _add(client, headers, 10)
+    _replicate(urls)
+    _add(client, headers, 5)
+
+    before = metrics.get('db_route_total', target='replica') or 0
+    # The replica lags behind the second write; writes and unlisted routes use the primary
+    assert _expenses(client, headers) == 10
+    assert metrics.get('db_route_total', target='replica') == before + 1
+    assert len(client.get('/api/sync', headers=headers).get_json()['transactions']) == 2
+
+def test_writers_read_their_writes(build_app):
+    app, urls = build_app(replica=True, DATABASE_REPLICA_STICKY_SECONDS=60)
+    client = app.test_client()
+    headers = _register(client)
+    _replicate(urls)
+    _add(client, headers, 7)
+
+    # Pinned by the cookie, and in the worker for clients without it
+    assert client.get_cookie(routing.STICKY_COOKIE) is not None
+    assert _expenses(client, headers) == 7
+    assert _expenses(app.test_client(), headers) == 7
+
+def test_statement_timeouts_resolve_most_specific_route(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'DB_STATEMENT_TIMEOUT_MS', 5000)
+    monkeypatch.setitem(app.config, 'DB_STATEMENT_TIMEOUTS',
+                        {'analytics': 20000, 'analytics.get_timeseries': 30000})
+    for path, expected in (('/api/analytics/summary', 20000), ('/api/analytics/timeseries', 30000),
+                           ('/api/categories/', 5000)):
+        with app.test_request_context(path):
+            from flask import request
+
+            request.url_rule, request.view_args = app.url_map.bind('').match(path, return_rule=True)
+            assert routing.statement_timeout() == expected
+
+@pytest.mark.parametrize('env, expected', [
+    ({'DB_PGBOUNCER': '1'}, "{'poolclass': <class 'sqlalchemy.pool.impl.NullPool'>}"),
+    ({'DB_POOL_SIZE': '3', 'DB_POOL_PRE_PING': '0'}, "3 False"),
+])
+def test_engine_options_for_postgres(env, expected):
+    script = ("from config import Config; o = Config.SQLALCHEMY_ENGINE_OPTIONS; "
+              "print(o if 'poolclass' in o else f\"{o['pool_size']} {o['pool_pre_ping']}\")")
+    result = subprocess.run(
+        [sys.executable, '-c', script], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(routing.__file__),
+        env=dict(os.environ, DATABASE_URL='postgresql://db/finance', **env),
+    )
+    assert result.stdout.strip() == expected
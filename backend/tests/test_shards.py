@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import create_engine, func, select, text
+
+import shards
+from extensions import db
+from models import Category, Transaction, User
+
+@pytest.fixture
+def sharded(build_app, monkeypatch):
+    # move_user waits for worker directory caches to expire; nothing caches here
+    monkeypatch.setattr(shards.time, 'sleep', lambda seconds: None)
+    app, urls = build_app(shard_names=('a', 'b'), SHARD_DIRECTORY_TTL=0)
+    return app, {name: create_engine(url) for name, url in urls.items()}
+
+def _register(client, email):
+    r = client.post('/api/auth/register', json={'email': email, 'password': 'secret', 'name': 'S'})
+    assert r.status_code == 201
+    return {'Authorization': 'Bearer ' + r.get_json()['token']}
+
+def _count(engine, table, user_id):
+    with engine.connect() as conn:
+        return conn.execute(text(f'SELECT count(*) FROM "{table}" WHERE {"id" if table == "user" else "user_id"} = :id'),
+                            {'id': user_id}).scalar()
+
+def test_new_users_spread_over_shards_and_log_in_through_the_directory(sharded):
+    app, engines = sharded
+    client = app.test_client()
+    for i in range(3):
+        _register(client, f'spread{i}@example.com')
+
+    with app.app_context():
+        placed = {shards.find_email(f'spread{i}@example.com').shard for i in range(3)}
+        assert placed == {'default', 'a', 'b'}
+        entry = shards.find_email('spread1@example.com')
+    home = engines['primary' if entry.shard == 'default' else entry.shard]
+    assert _count(home, 'user', entry.id) == 1
+    assert sum(_count(e, 'user', entry.id) for e in engines.values()) == 1
+
+    r = client.post('/api/auth/login', json={'email': 'spread1@example.com', 'password': 'secret'})
+    assert r.status_code == 200
+    assert client.post('/api/auth/register', json={'email': 'spread1@example.com', 'password': 'x'}).status_code == 400
+
+def test_reference_data_is_on_every_shard(sharded):
+    _, engines = sharded
+    for engine in engines.values():
+        with engine.connect() as conn:
+            names = conn.execute(select(Category.name).where(Category.user_id == None).order_by(Category.id)).scalars()
+            assert list(names) == ['Food', 'Salary']
+
+def test_user_tables_need_a_shard(sharded):
+    app, _ = sharded
+    with app.app_context():
+        with pytest.raises(shards.NoShardSelected):
+            db.session.query(func.count(Transaction.id)).scalar()
+        # Reference tables fall back to the default database
+        assert db.session.query(func.count(Category.id)).scalar() == 2
+
+def test_move_user_between_shards(sharded):
+    app, engines = sharded
+    client = app.test_client()
+    headers = _register(client, 'mover@example.com')
+    category = client.post('/api/categories/', json={'name': 'Mine', 'type': 'expense'}, headers=headers).get_json()['id']
+    for amount in (1, 2):
+        r = client.post('/api/transactions/', json={'amount': amount, 'type': 'expense', 'category_id': category,
+                                                     'date': '2024-03-15T12:00:00'}, headers=headers)
+        assert r.status_code == 201
+
+    with app.app_context():
+        entry = shards.find_email('mover@example.com')
+        target = 'b' if entry.shard != 'b' else 'a'
+        shards.move_user(entry.id, target, log=lambda message: None)
+        assert shards.find_email('mover@example.com').shard == target
+
+    source = engines['primary' if entry.shard == 'default' else entry.shard]
+    assert _count(source, 'user', entry.id) == 0 and _count(source, 'transaction', entry.id) == 0
+    assert _count(engines[target], 'transaction', entry.id) == 2
+
+    # Category ids were reallocated on the target and the transactions follow them
+    rows = client.get('/api/transactions/', headers=headers).get_json()
+    categories = {c['id']: c['name'] for c in client.get('/api/categories/', headers=headers).get_json()}
+    assert sorted(r['amount'] for r in rows) == [1, 2]
+    assert {categories[r['category_id']] for r in rows} == {'Mine'}
+    with engines[target].connect() as conn:
+        floor = conn.execute(select(User.sync_floor).where(User.id == entry.id)).scalar()
+    assert floor > 0
+
+def test_writes_pause_while_moving(sharded):
+    app, _ = sharded
+    client = app.test_client()
+    headers = _register(client, 'paused@example.com')
+    with app.app_context():
+        shards._set_directory(shards.find_email('paused@example.com').id, status=shards.MOVING)
+
+    r = client.post('/api/transactions/', json={'amount': 1, 'type': 'expense', 'category_id': 1,
+                                                 'date': '2024-03-15T12:00:00'}, headers=headers)
+    assert r.status_code == 503
+    assert 'Retry-After' in r.headers
+    assert client.get('/api/transactions/', headers=headers).status_code == 200
@@ -0,0 +1,56 @@
+import pytest
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, text
+
+import metrics
+import startup
+
+class _DownEngine:
+    def __init__(self):
+        self.attempts = 0
+
+    def connect(self):
+        self.attempts += 1
+        raise OSError("connection refused")
+
+def test_wait_for_db_returns_once_reachable(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'up.db'}")
+    startup.wait_for_db(engine, timeout=1)
+
+def test_wait_for_db_retries_then_gives_up():
+    engine = _DownEngine()
+    with pytest.raises(RuntimeError, match="not ready"):
+        startup.wait_for_db(engine, timeout=0.3, interval=0.05)
+    assert engine.attempts > 1
+
+def test_needs_upgrade_only_when_behind_head(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+    assert startup.needs_upgrade(engine)
+
+    heads = ScriptDirectory(startup.MIGRATIONS_DIR).get_heads()
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)"))
+        for head in heads:
+            conn.execute(text("INSERT INTO alembic_version VALUES (:v)"), {'v': head})
+    assert not startup.needs_upgrade(engine)
+
+def test_metrics_render_prometheus_text():
+    metrics.inc('test_requests_total', 2, route='a')
+    metrics.set_gauge('test_ready', 1)
+    text_format = metrics.render()
+    assert '# TYPE test_requests_total counter' in text_format
+    assert 'test_requests_total{route="a"} 2' in text_format
+    assert 'test_ready 1' in text_format
+
+def test_metrics_endpoint_needs_token(app, client):
+    assert client.get('/api/metrics').status_code == 404
+
+    app.config['METRICS_TOKEN'] = 'scrape-secret'
+    try:
+        assert client.get('/api/metrics').status_code == 401
+        assert client.get('/api/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+        r = client.get('/api/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        assert r.status_code == 200
+        assert 'app_build_seconds' in r.get_data(as_text=True)
+    finally:
+        app.config['METRICS_TOKEN'] = None
@@ -0,0 +1,118 @@
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+
+import storage
+from extensions import db
+from models import StoredFile
+
+def _upload(client, user, categories, content, amount=10):
+    data = {
+        'amount': str(amount), 'type': 'expense', 'category_id': str(categories['expense']),
+        'file': (io.BytesIO(content), 'receipt.pdf'),
+    }
+    return client.post('/api/transactions/', data=data, headers=user.headers, content_type='multipart/form-data')
+
+def _stored(app, key):
+    with app.app_context():
+        row = db.session.get(StoredFile, key)
+        return (row.ref_count if row else None), storage.get_storage().exists(key)
+
+def _attachment(client, user, txn_id):
+    rows = client.get('/api/transactions/', headers=user.headers).get_json()
+    return next(row['attachment'] for row in rows if row['id'] == txn_id)
+
+@pytest.fixture
+def receipt():
+    # Fresh content per test, so tests never share a blob
+    return b'%PDF-1.4 receipt ' + os.urandom(16)
+
+def test_identical_uploads_share_one_counted_blob(app, client, user, categories, receipt, inline_tasks):
+    first = _upload(client, user, categories, receipt).get_json()['id']
+    second = _upload(client, user, categories, receipt).get_json()['id']
+    key = _attachment(client, user, first)
+    assert storage.is_cas_key(key)
+    assert _attachment(client, user, second) == key
+    assert _stored(app, key) == (2, True)
+
+    client.delete(f'/api/transactions/{first}', headers=user.headers)
+    assert _stored(app, key) == (1, True)
+
+    client.delete(f'/api/transactions/{second}', headers=user.headers)
+    assert _stored(app, key) == (None, False)
+
+def test_upload_after_collection_writes_the_blob_again(app, client, user, categories, receipt, inline_tasks):
+    first = _upload(client, user, categories, receipt).get_json()['id']
+    key = _attachment(client, user, first)
+    client.delete(f'/api/transactions/{first}', headers=user.headers)
+    assert _stored(app, key) == (None, False)
+
+    _upload(client, user, categories, receipt)
+    assert _stored(app, key) == (1, True)
+
+def test_collector_keeps_blob_referenced_again_before_it_ran(app, client, user, categories, receipt):
+    first = _upload(client, user, categories, receipt).get_json()['id']
+    key = _attachment(client, user, first)
+    with app.app_context():
+        storage.release([key])
+        db.session.commit()
+    _upload(client, user, categories, receipt)
+
+    with app.app_context():
+        storage.collect_garbage([key])
+    assert _stored(app, key) == (1, True)
+
+def test_upload_racing_the_collector_keeps_its_blob(app, client, user, categories, receipt, monkeypatch):
+    first = _upload(client, user, categories, receipt).get_json()['id']
+    key = _attachment(client, user, first)
+    with app.app_context():
+        storage.release([key])
+        db.session.commit()
+        backend = type(storage.get_storage())
+
+    # The same content is uploaded again while the collector is removing the blob
+    unlink = backend.delete
+    racer = {}
+
+    def delete(self, k):
+        if k == key and 'thread' not in racer:
+            upload = lambda: racer.setdefault('status', _upload(app.test_client(), user, categories, receipt).status_code)
+            racer['thread'] = threading.Thread(target=upload)
+            racer['thread'].start()
+            racer['thread'].join(0.5)
+        unlink(self, k)
+
+    monkeypatch.setattr(backend, 'delete', delete)
+    with app.app_context():
+        storage.collect_garbage([key])
+    racer['thread'].join(10)
+    assert racer['status'] == 201
+    assert _stored(app, key) == (1, True)
+
+def test_invalid_amount_stores_no_blob(app, client, user, categories, receipt):
+    r = _upload(client, user, categories, receipt, amount='lots')
+    assert r.status_code == 400
+    with app.app_context():
+        root = storage.get_storage().root
+    blobs = [name for _, _, names in os.walk(root) for name in names if not name.startswith('.')]
+    assert not any(name.startswith(hashlib.sha256(receipt).hexdigest()) for name in blobs)
+
+def test_files_are_sent_by_the_app_unless_x_accel_is_on(app, client, user, categories, receipt):
+    txn = _upload(client, user, categories, receipt).get_json()['id']
+    key = _attachment(client, user, txn)
+
+    r = client.get(f'/api/files/{key}')
+    assert r.status_code == 200
+    assert r.data == receipt
+
+    app.config['STORAGE_X_ACCEL'] = True
+    try:
+        r = client.get(f'/api/files/{key}')
+    finally:
+        app.config['STORAGE_X_ACCEL'] = False
+    assert r.data == b''
+    assert r.headers['X-Accel-Redirect'].endswith('/' + key)
+    assert r.headers['Cache-Control'] == storage.IMMUTABLE_CACHE
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+@pytest.fixture
+def five(client, user, add_transaction):
+    for i in range(5):
+        add_transaction(user, amount=i + 1, date=f'2024-03-{i + 10}T12:00:00')
+    return user
+
+def test_streamed_array_matches_the_buffered_listing(client, five):
+    listing = client.get('/api/transactions/', headers=five.headers).get_json()
+    r = client.get('/api/transactions/?stream=1', headers=five.headers)
+    assert r.mimetype == 'application/json'
+    assert json.loads(r.data) == listing
+
+def test_streams_in_batches(app, client, five, monkeypatch):
+    monkeypatch.setitem(app.config, 'STREAM_BATCH_SIZE', 2)
+    r = client.get('/api/transactions/?stream=1&fields=id', headers=dict(five.headers, **{'Accept-Encoding': 'gzip'}),
+                   buffered=False)
+    assert r.is_streamed
+    assert r.headers['X-Accel-Buffering'] == 'no'
+    # Streamed bodies are never compressed
+    assert 'Content-Encoding' not in r.headers
+    chunks = [c for c in r.response if c]
+    r.close()
+    # "[", three batches of at most two rows, "]"
+    assert len(chunks) == 5
+    assert len(json.loads(b''.join(c if isinstance(c, bytes) else c.encode() for c in chunks))) == 5
+
+@pytest.mark.parametrize('how', [{'query': '&format=ndjson'}, {'headers': {'Accept': 'application/x-ndjson'}}])
+def test_ndjson(client, five, how):
+    r = client.get('/api/transactions/?stream=1&fields=id,amount' + how.get('query', ''),
+                   headers=dict(five.headers, **how.get('headers', {})))
+    assert r.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in r.data.decode().splitlines()]
+    assert sorted(row['amount'] for row in rows) == [1, 2, 3, 4, 5]
+    assert set(rows[0]) == {'id', 'amount'}
+
+def test_empty_and_columnar_streams(client, user):
+    assert client.get('/api/transactions/?stream=1', headers=user.headers).get_json() == []
+    assert client.get('/api/transactions/?stream=1&format=columnar', headers=user.headers).status_code == 400
@@ -0,0 +1,52 @@
+def _sync(client, user, since=None):
+    r = client.get('/api/sync', query_string={'since': since} if since else {}, headers=user.headers)
+    assert r.status_code == 200
+    return r.get_json()
+
+def test_full_sync_includes_rows_and_system_categories(client, user, add_transaction):
+    txn = add_transaction(user)
+    data = _sync(client, user)
+    assert data['full'] is True
+    assert [t['id'] for t in data['transactions']] == [txn]
+    assert any(c['is_system'] for c in data['categories'])
+
+def test_delta_returns_only_newer_changes_and_tombstones(client, user, categories, add_transaction):
+    kept = add_transaction(user, amount=1)
+    dropped = add_transaction(user, amount=2)
+    token = _sync(client, user)['token']
+
+    assert _sync(client, user, token)['transactions'] == []
+
+    client.put(f'/api/transactions/{kept}', json={'amount': 5}, headers=user.headers)
+    client.delete(f'/api/transactions/{dropped}', headers=user.headers)
+    data = _sync(client, user, token)
+    assert data['full'] is False
+    assert [(t['id'], t['amount']) for t in data['transactions']] == [(kept, 5)]
+    assert data['deleted']['transactions'] == [dropped]
+    assert int(data['token']) > int(token)
+
+def test_bulk_paths_stamp_versions_and_leave_tombstones(client, user, categories, add_transaction):
+    add_transaction(user, description='coffee')
+    other = add_transaction(user, description='rent')
+    token = _sync(client, user)['token']
+
+    client.post('/api/transactions/bulk/retag?search=coffee', json={'tags': 'x'}, headers=user.headers)
+    created = client.post('/api/transactions/batch', json={'operations': [
+        {'op': 'create', 'amount': 3, 'type': 'expense', 'category_id': categories['expense']},
+    ]}, headers=user.headers).get_json()['results'][0]['id']
+    client.post('/api/transactions/bulk/delete?search=rent', json={}, headers=user.headers)
+
+    data = _sync(client, user, token)
+    assert {t['id'] for t in data['transactions']} == {created} | {
+        t['id'] for t in data['transactions'] if t['tags'] == 'x'}
+    assert len(data['transactions']) == 2
+    assert data['deleted']['transactions'] == [other]
+
+def test_versions_are_per_user(client, make_user, add_transaction):
+    alice, bob = make_user(), make_user()
+    token = _sync(client, alice)['token']
+    add_transaction(bob)
+    assert _sync(client, alice, token)['transactions'] == []
+
+def test_invalid_token_is_rejected(client, user):
+    assert client.get('/api/sync?since=abc', headers=user.headers).status_code == 400
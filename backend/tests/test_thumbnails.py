@@ -0,0 +1,82 @@
+import io
+import random
+
+from PIL import Image
+
+import storage
+import thumbnails
+
+def _png(width, height):
+    image = Image.new('RGB', (width, height), tuple(random.randrange(256) for _ in range(3)))
+    out = io.BytesIO()
+    image.save(out, 'PNG')
+    return out.getvalue()
+
+def _upload_avatar(client, user, content, name='me.png'):
+    return client.post('/api/settings/avatar', data={'file': (io.BytesIO(content), name)},
+                       headers=user.headers, content_type='multipart/form-data')
+
+def test_avatar_upload_renders_every_size(app, client, user, inline_tasks):
+    key = _upload_avatar(client, user, _png(1600, 800)).get_json()['avatar']
+    with app.app_context():
+        backend = storage.get_storage()
+        for size in app.config['THUMBNAIL_SIZES']:
+            with backend.open(thumbnails.thumb_key(key, size)) as f:
+                assert max(Image.open(f).size) == size
+
+def test_size_parameter_serves_smallest_covering_thumbnail(client, user, inline_tasks):
+    key = _upload_avatar(client, user, _png(1600, 800)).get_json()['avatar']
+    r = client.get(f'/api/files/{key}?size=100')
+    assert r.status_code == 200
+    assert Image.open(io.BytesIO(r.data)).size == (128, 64)
+
+def test_missing_thumbnail_is_rendered_on_request(client, user):
+    # Without inline tasks the background render may not have run yet
+    key = _upload_avatar(client, user, _png(700, 700)).get_json()['avatar']
+    r = client.get(f'/api/files/{key}?size=512')
+    assert Image.open(io.BytesIO(r.data)).size == (512, 512)
+
+def test_non_images_fall_back_to_the_original(app):
+    with app.app_context():
+        assert thumbnails.pick_size('300') == 512
+        assert thumbnails.pick_size('5000') == 1024
+        assert thumbnails.pick_size('abc') is None
+        assert not thumbnails.can_thumbnail('a' * 64 + '.pdf')
+
+def test_thumbnails_are_deleted_with_the_original(app, client, user, inline_tasks):
+    old = _upload_avatar(client, user, _png(300, 300)).get_json()['avatar']
+    _upload_avatar(client, user, _png(200, 200), name='new.png')
+    with app.app_context():
+        backend = storage.get_storage()
+        assert not backend.exists(old)
+        assert not any(backend.exists(thumbnails.thumb_key(old, size)) for size in app.config['THUMBNAIL_SIZES'])
+
+def test_oversized_images_are_served_as_uploaded(app, client, user, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'generate_later', lambda key: None)
+    monkeypatch.setitem(app.config, 'THUMBNAIL_MAX_PIXELS', 600 * 600)
+    key = _upload_avatar(client, user, _png(700, 700)).get_json()['avatar']
+    decoded = []
+    monkeypatch.setattr(Image.Image, 'load', lambda self: decoded.append(self))
+
+    for _ in range(2):
+        r = client.get(f'/api/files/{key}?size=128')
+        assert r.status_code == 200
+        assert r.data.startswith(b'\x89PNG')
+    # Refused from the header alone, and remembered
+    assert decoded == []
+    assert thumbnails._is_known(thumbnails.thumb_key(key, 128)) is False
+
+def test_decompression_bombs_are_remembered(client, user, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'generate_later', lambda key: None)
+    key = _upload_avatar(client, user, _png(300, 300)).get_json()['avatar']
+    # PIL refuses images above twice MAX_IMAGE_PIXELS with DecompressionBombError
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 100 * 100)
+    opened = []
+    real_open = Image.open
+    monkeypatch.setattr(Image, 'open', lambda *args, **kwargs: opened.append(args) or real_open(*args, **kwargs))
+
+    for _ in range(2):
+        r = client.get(f'/api/files/{key}?size=512')
+        assert r.status_code == 200
+    assert len(opened) == 1
+    assert thumbnails._is_known(thumbnails.thumb_key(key, 512)) is False
@@ -0,0 +1,49 @@
+from datetime import date, datetime
+
+def _series(client, user, **params):
+    r = client.get('/api/analytics/timeseries', query_string=params, headers=user.headers)
+    assert r.status_code == 200, r.get_json()
+    return r.get_json()['series']
+
+def test_month_buckets_are_gap_filled(client, user, add_transaction):
+    add_transaction(user, amount=10, date='2024-01-05T10:00:00')
+    add_transaction(user, amount=5, date='2024-01-20T10:00:00')
+    add_transaction(user, amount=100, type='income', date='2024-03-02T10:00:00')
+
+    series = _series(client, user, bucket='month', start_date='2024-01-01', end_date='2024-04-30')
+    assert [(b['key'], b['income'], b['expense']) for b in series] == [
+        ('2024-01-01', 0, 15), ('2024-02-01', 0, 0), ('2024-03-01', 100, 0), ('2024-04-01', 0, 0),
+    ]
+
+def test_week_buckets_start_on_monday(client, user, add_transaction):
+    # 2024-03-17 is a Sunday, 2024-03-18 a Monday
+    add_transaction(user, amount=1, date='2024-03-17T23:00:00')
+    add_transaction(user, amount=2, date='2024-03-18T01:00:00')
+
+    series = _series(client, user, bucket='week', start_date='2024-03-11', end_date='2024-03-24')
+    assert [(b['key'], b['expense']) for b in series] == [('2024-03-11', 1), ('2024-03-18', 2)]
+
+def test_open_end_runs_to_the_current_bucket(client, user, add_transaction):
+    add_transaction(user, amount=7, date='2020-06-10T00:00:00')
+    this_year = datetime.utcnow().year
+
+    series = _series(client, user, bucket='year', start_date='2020-01-01')
+    assert series[0] == {'key': '2020-01-01', 'name': '2020', 'income': 0, 'expense': 7}
+    assert series[-1]['key'] == date(this_year, 1, 1).isoformat()
+    assert len(series) == this_year - 2020 + 1
+
+def test_start_after_all_data_gives_an_empty_series(client, user, add_transaction):
+    add_transaction(user, date='2024-01-05T10:00:00')
+    assert _series(client, user, bucket='month', start_date='2999-01-01') == []
+
+def test_end_only_starts_at_the_first_row(client, user, add_transaction):
+    add_transaction(user, amount=3, date='2024-02-10T00:00:00')
+    series = _series(client, user, bucket='month', end_date='2024-04-01')
+    assert [b['key'] for b in series] == ['2024-02-01', '2024-03-01', '2024-04-01']
+
+def test_no_rows_and_no_range_gives_an_empty_series(client, user):
+    assert _series(client, user, bucket='month', period='all') == []
+
+def test_unknown_bucket_is_rejected(client, user):
+    r = client.get('/api/analytics/timeseries?bucket=decade', headers=user.headers)
+    assert r.status_code == 400
@@ -0,0 +1,143 @@
+import pytest
+
+import valuation
+from extensions import db
+from models import ExchangeRate, Transaction
+
+@pytest.fixture
+def ctx(app):
+    """Run a call in its own app context, so requests in between get their own session."""
+    def run(fn, *args, **kwargs):
+        with app.app_context():
+            return fn(*args, **kwargs)
+    return run
+
+def _stored(transaction_id):
+    t = db.session.get(Transaction, transaction_id)
+    return t.amount_in_base, t.base_rate, t.base_currency
+
+def _set_rate(source, target, rate):
+    ExchangeRate.query.filter_by(base_currency=source, target_currency=target).update({'rate': rate})
+    db.session.commit()
+
+def _manual_rate(client, user, source, target, rate):
+    r = client.post('/api/currencies/manual', json={'base': source, 'target': target, 'rate': rate}, headers=user.headers)
+    assert r.status_code == 200
+
+def test_writes_store_the_base_amount(ctx, client, user, add_transaction):
+    _manual_rate(client, user, 'AAA', 'RUB', 90)
+    valued = add_transaction(user, amount=10, currency='AAA')
+    pending = add_transaction(user, amount=10, currency='ZZQ')
+    assert ctx(_stored, valued) == (900, 90, 'RUB')
+    assert ctx(_stored, pending) == (None, None, None)
+
+def test_revalue_user_leaves_unknown_rates_pending(ctx, client, make_user, add_transaction):
+    from routes.currencies import get_conversion_rate, lookup_rate
+
+    user = make_user()
+    unknown = add_transaction(user, amount=10, currency='ZZR')
+    assert ctx(lookup_rate, 'ZZR', 'RUB') is None
+    assert ctx(get_conversion_rate, 'ZZR', 'RUB') == 1.0
+
+    ctx(valuation.revalue_user, user.id)
+    assert ctx(_stored, unknown) == (None, None, None)
+
+def test_rate_revaluation_touches_only_affected_rows(ctx, client, user, add_transaction, inline_tasks):
+    _manual_rate(client, user, 'BBB', 'RUB', 50)
+    row = add_transaction(user, amount=2, currency='BBB')
+    ctx(_set_rate, 'BBB', 'RUB', 60)
+
+    # New-pair revaluation only fills rows that have no value yet
+    assert ctx(valuation.revalue_pair, 'BBB', 'RUB', pending_only=True) == 0
+    assert ctx(_stored, row) == (100, 50, 'RUB')
+
+    # The scheduled job catches rows up with the moved rate, once
+    assert ctx(valuation.revalue_rates) >= 1
+    assert ctx(_stored, row) == (120, 60, 'RUB')
+    assert ctx(valuation.revalue_pair, 'BBB', 'RUB') == 0
+
+def test_new_rate_fills_pending_rows(ctx, client, user, add_transaction, inline_tasks):
+    row = add_transaction(user, amount=3, currency='CCC')
+    assert ctx(_stored, row) == (None, None, None)
+    _manual_rate(client, user, 'CCC', 'RUB', 10)
+    assert ctx(_stored, row) == (30, 10, 'RUB')
+
+@pytest.mark.parametrize('engine', ['sql', 'columnar'])
+def test_summary_sums_stored_amounts(ctx, client, make_user, add_transaction, engine):
+    user = make_user()
+    _manual_rate(client, user, 'DDD', 'RUB', 4)
+    add_transaction(user, amount=10, currency='DDD')
+    add_transaction(user, amount=5)
+    add_transaction(user, amount=100, type='income')
+    # A rate move after the write doesn't change what was recorded
+    ctx(_set_rate, 'DDD', 'RUB', 5)
+
+    r = client.get(f'/api/analytics/summary?period=all&engine={engine}', headers=user.headers).get_json()
+    assert r['total_expenses'] == 45
+    assert r['total_income'] == 100
+    assert r['pie_data'] == [{'name': 'Food', 'value': 45, 'color': r['pie_data'][0]['color']}]
+    assert len(r['recent']) == 3
+
+def test_columnar_matches_sql_across_revaluation(ctx, client, make_user, add_transaction):
+    user = make_user()
+    _manual_rate(client, user, 'EEE', 'RUB', 4)
+    add_transaction(user, amount=10, currency='EEE')
+    add_transaction(user, amount=1, currency='ZZS')
+
+    def totals():
+        return [client.get(f'/api/analytics/summary?period=all&engine={engine}', headers=user.headers)
+                .get_json()['total_expenses'] for engine in ('sql', 'columnar')]
+
+    # The pending row converts at the 1.0 fallback in both engines
+    assert totals() == [41, 41]
+    ctx(_set_rate, 'EEE', 'RUB', 5)
+    assert totals() == [41, 41]
+    # Revaluation bumps the data version, so the cached columns are rebuilt
+    ctx(valuation.revalue_pair, 'EEE', 'RUB')
+    assert totals() == [51, 51]
+
+def _undate(user_id, transaction_ids):
+    import shards
+    from models import User
+
+    shards.use(user_id)
+    Transaction.query.filter(Transaction.id.in_(transaction_ids)).update({'date': None}, synchronize_session=False)
+    User.query.filter(User.id == user_id).update({'sync_version': User.sync_version + 1})
+    db.session.commit()
+
+def test_engines_agree_on_undated_rows(ctx, client, make_user, add_transaction):
+    user = make_user()
+    add_transaction(user, amount=10, date='2024-03-15T12:00:00')
+    add_transaction(user, amount=100, type='income', date='2024-03-20T12:00:00')
+    undated = [add_transaction(user, amount=7), add_transaction(user, amount=3, type='income')]
+    ctx(_undate, user.id, undated)
+
+    def summary(engine, period):
+        r = client.get(f'/api/analytics/summary?period={period}&engine={engine}', headers=user.headers)
+        assert r.status_code == 200, r.get_json()
+        data = r.get_json()
+        return data['total_income'], data['total_expenses'], data['pie_data'], data['bar_data']
+
+    sql, columnar = summary('sql', 'all'), summary('columnar', 'all')
+    assert sql == columnar
+    # All-time totals count undated rows; the chart has no bucket for them
+    assert sql[:2] == (103, 17)
+    assert [(b['income'], b['expense']) for b in sql[3]] == [(100, 10)]
+    assert summary('sql', 'year') == summary('columnar', 'year')
+
+    r = client.get('/api/analytics/forecast', headers=user.headers)
+    assert r.status_code == 200
+
+def test_mapped_columns_keep_stored_amounts(app, client, make_user, add_transaction, tmp_path, monkeypatch):
+    import columnar
+
+    user = make_user()
+    _manual_rate(client, user, 'FFF', 'RUB', 3)
+    add_transaction(user, amount=10, currency='FFF')
+    monkeypatch.setitem(app.config, 'ANALYTICS_CACHE_DIR', str(tmp_path))
+    with app.app_context():
+        built = columnar.in_base(columnar.load(user.id), 'RUB', {})
+        columnar._cache.pop(user.id)
+        mapped = columnar.load(user.id)
+        assert mapped.base_currency == 'RUB'
+        assert columnar.in_base(mapped, 'RUB', {}).tolist() == built.tolist() == [30]
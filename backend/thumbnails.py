@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+from flask import current_app
+from PIL import Image, ImageOps
+import metrics
+import storage
+import tasks
+
+# Fixed-size thumbnails for image uploads, stored next to the original as
+# "<sha256>_<size>.<ext>". They are rendered in the background right after
+# upload; a request for a size that is not there yet (older uploads, failed
+# jobs) renders it on the spot. A per-worker set of keys known to exist
+# spares the storage lookup on the hot path; undecodable uploads are
+# remembered there too so they are not retried on every request. Images
+# above THUMBNAIL_MAX_PIXELS are refused from their header, before any
+# pixel data is decoded.
+
+THUMBNAIL_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+PIL_FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'gif': 'GIF'}
+# Not a decodable image, or one too large to decode
+RENDER_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+_known_lock = threading.Lock()
+_known = OrderedDict()
+_KNOWN_MAX = 10000
+
+def sizes():
+    return current_app.config['THUMBNAIL_SIZES']
+
+def can_thumbnail(key):
+    return storage.is_cas_key(key) and key.rsplit('.', 1)[1] in THUMBNAIL_EXTENSIONS
+
+def pick_size(requested):
+    """Smallest configured size that covers the request (largest if none does)."""
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return None
+    available = sorted(sizes())
+    for size in available:
+        if size >= requested:
+            return size
+    return available[-1]
+
+def thumb_key(key, size):
+    digest, ext = key.split('.', 1)
+    return f"{digest}_{size}.{ext}"
+
+def _mark_known(tkey, exists=True):
+    with _known_lock:
+        _known[tkey] = exists
+        _known.move_to_end(tkey)
+        if len(_known) > _KNOWN_MAX:
+            _known.popitem(last=False)
+
+def _is_known(tkey):
+    """True/False if the outcome for this thumbnail is cached, None otherwise."""
+    with _known_lock:
+        return _known.get(tkey)
+
+def forget(key):
+    with _known_lock:
+        for size in sizes():
+            _known.pop(thumb_key(key, size), None)
+
+def render(backend, key, size):
+    tkey = thumb_key(key, size)
+    ext = key.rsplit('.', 1)[1]
+    with backend.open(key) as src:
+        image = Image.open(src)
+        width, height = image.size
+        if width * height > current_app.config['THUMBNAIL_MAX_PIXELS']:
+            raise ValueError(f"{width}x{height} exceeds THUMBNAIL_MAX_PIXELS")
+        image = ImageOps.exif_transpose(image)  # camera photos carry rotation in EXIF
+        image.thumbnail((size, size))
+        if PIL_FORMATS[ext] == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        with backend.temp_file() as tmp:
+            image.save(tmp, PIL_FORMATS[ext], optimize=True)
+            tmp_path = tmp.name
+    backend.put(tmp_path, tkey)
+    metrics.inc('thumbnails_rendered_total', size=size)
+    _mark_known(tkey)
+    return tkey
+
+def generate_all(key):
+    backend = storage.get_storage()
+    for size in sizes():
+        tkey = thumb_key(key, size)
+        if backend.exists(tkey):
+            _mark_known(tkey)
+            continue
+        try:
+            render(backend, key, size)
+        except RENDER_ERRORS as e:
+            print(f"Thumbnail Error for {key}: {e}")
+            _mark_known(tkey, exists=False)
+            return
+
+def generate_later(key):
+    if can_thumbnail(key):
+        tasks.submit_with_app(current_app._get_current_object(), generate_all, key)
+
+def ensure(backend, key, size):
+    """Key of the requested thumbnail, rendering it first if missing. None if not applicable."""
+    if not can_thumbnail(key):
+        return None
+    tkey = thumb_key(key, size)
+    known = _is_known(tkey)
+    if known is not None:
+        metrics.inc('thumbnail_requests_total', result='cached')
+        return tkey if known else None
+    if backend.exists(tkey):
+        _mark_known(tkey)
+        metrics.inc('thumbnail_requests_total', result='stored')
+        return tkey
+    if not backend.exists(key):
+        return None
+    metrics.inc('thumbnail_requests_total', result='rendered')
+    try:
+        return render(backend, key, size)
+    except RENDER_ERRORS as e:
+        # Not a decodable image (or too large): fall back to the original
+        print(f"Thumbnail Error for {key}: {e}")
+        _mark_known(tkey, exists=False)
+        return None
+
+def delete_all(backend, key):
+    if can_thumbnail(key):
+        for size in sizes():
+            backend.delete(thumb_key(key, size))
+        forget(key)
@@ -0,0 +1,252 @@
+"""
+Transaction amounts stored in the owner's base currency.
+
+Every transaction carries amount_in_base, the rate used and the base
+currency it was valued in. Writes fill them from rates already in the
+database; they never call the rates API mid-flush. When no stored rate
+exists the columns stay NULL. Reads treat a row as stale when its
+base_currency differs from the user's current one or is NULL, and convert
+it on the fly as before. Sums therefore come straight from the column and
+only stale rows need a rate.
+
+Revaluation recomputes the columns with set-based UPDATEs, one per
+currency, and only touches rows whose stored value would change. It runs in
+the background after a base-currency switch, a manual rate, or when a newly
+stored rate can value rows that had none. Rate moves fetched from the
+provider are caught up by a scheduled `python valuation.py --rates`.
+`python valuation.py [--user ID ...] [--workers N]` revalues everyone,
+chunked by user across a process pool.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sqlalchemy import event, update, select, func, case, and_, or_, inspect
+from sqlalchemy.orm import Session
+from flask import current_app
+from extensions import db
+from models import Transaction, User, UserDirectory
+import metrics
+import shards
+import sync
+import tasks
+
+VALUATION_FIELDS = ('amount', 'currency')
+CHUNK_SIZE = 50
+
+def _rate(currency, base_currency, rate_cache, lookup):
+    if currency == base_currency:
+        return 1.0
+    k = f"{currency}_{base_currency}"
+    if k not in rate_cache:
+        rate_cache[k] = lookup(currency, base_currency)
+    return rate_cache[k]
+
+def stamp(values, base_currency, rate_cache):
+    """Fill the stored base amount of a bulk insert/update payload from stored rates."""
+    from routes.currencies import stored_rate
+
+    rate = _rate(values['currency'], base_currency, rate_cache, stored_rate)
+    if rate is None:
+        values.update(amount_in_base=None, base_rate=None, base_currency=None)
+    else:
+        values.update(amount_in_base=values['amount'] * rate, base_rate=rate, base_currency=base_currency)
+    return values
+
+@event.listens_for(Session, 'before_flush')
+def _value_transactions(session, flush_context, instances):
+    base_currencies = {}
+    rate_cache = {}
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Transaction) or not obj.user_id or obj.amount is None:
+            continue
+        if obj not in session.new:
+            state = inspect(obj)
+            if not any(state.attrs[f].history.has_changes() for f in VALUATION_FIELDS):
+                continue
+        user_id = int(obj.user_id)
+        if user_id not in base_currencies:
+            base_currencies[user_id] = session.query(User.base_currency).filter(User.id == user_id).scalar() or 'RUB'
+        values = stamp({'amount': obj.amount, 'currency': (obj.currency or 'RUB').upper()},
+                       base_currencies[user_id], rate_cache)
+        obj.amount_in_base = values['amount_in_base']
+        obj.base_rate = values['base_rate']
+        obj.base_currency = values['base_currency']
+
+# --- Reads ----------------------------------------------------------------
+
+def is_fresh(t, base_currency):
+    return t.base_currency == base_currency and t.amount_in_base is not None
+
+def in_base(t, base_currency, rate_cache):
+    """A transaction's amount in base currency, converting on the fly only if the stored value is stale."""
+    from routes.currencies import get_conversion_rate
+
+    if is_fresh(t, base_currency):
+        return t.amount_in_base
+    return t.amount * _rate(t.currency, base_currency, rate_cache, get_conversion_rate)
+
+def sum_columns(base_currency):
+    """
+    (stored, pending) aggregate columns: the summed stored base amounts of
+    fresh rows and the raw amounts of stale ones. Group by Transaction.currency
+    alongside them and combine with to_base().
+    """
+    fresh = and_(Transaction.base_currency == base_currency, Transaction.amount_in_base != None)
+    return (
+        func.sum(case((fresh, Transaction.amount_in_base), else_=0)).label('stored'),
+        func.sum(case((fresh, 0), else_=Transaction.amount)).label('pending'),
+    )
+
+def to_base(stored, pending, currency, base_currency, rate_cache):
+    from routes.currencies import get_conversion_rate
+
+    total = stored or 0
+    if pending:
+        total += pending * _rate(currency, base_currency, rate_cache, get_conversion_rate)
+    return total
+
+# --- Revaluation ----------------------------------------------------------
+
+def revalue_user(user_id):
+    """Recompute stored base amounts of one user's transactions. Returns the number of rows updated."""
+    from routes.currencies import lookup_rate
+
+    shards.use(user_id)
+    base_currency = db.session.query(User.base_currency).filter(User.id == user_id).scalar() or 'RUB'
+    currencies = db.session.scalars(
+        select(Transaction.currency).where(Transaction.user_id == user_id).distinct()
+    ).all()
+    # Rates first: lookup_rate may commit when it fetches a new one
+    rates = {c: lookup_rate(c, base_currency) for c in currencies if c}
+    count = 0
+    for currency, rate in rates.items():
+        # No rate anywhere: leave the rows pending rather than store a guess
+        if rate is None:
+            continue
+        count += db.session.execute(
+            update(Transaction)
+            .where(Transaction.user_id == user_id, Transaction.currency == currency)
+            .values(amount_in_base=Transaction.amount * rate, base_rate=rate, base_currency=base_currency)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    if count:
+        # Cached analytics columns are keyed by the data version (see columnar.py)
+        sync.next_version(user_id)
+    db.session.commit()
+    metrics.inc('revalued_transactions_total', count)
+    return count
+
+def revalue_pair(source, target, pending_only=False):
+    """
+    Recompute rows in `source` owned by users whose base currency is `target`
+    from the stored rate: rows valued at another rate, or with pending_only
+    just the rows that have no value in `target` yet.
+    """
+    from routes.currencies import stored_rate
+
+    rate = stored_rate(source, target)
+    if rate is None:
+        return 0
+    affected = or_(Transaction.amount_in_base == None, Transaction.base_currency == None,
+                   Transaction.base_currency != target)
+    if not pending_only:
+        affected = or_(affected, Transaction.base_rate != rate)
+    rows = and_(
+        Transaction.currency == source,
+        Transaction.user_id.in_(select(User.id).where(User.base_currency == target)),
+        affected
+    )
+    count = 0
+    for shard in shards.names():
+        shards.use_shard(shard)
+        # Cached analytics columns are keyed by the data version (see columnar.py)
+        db.session.execute(
+            update(User)
+            .where(User.id.in_(select(Transaction.user_id).where(rows)))
+            .values(sync_version=User.sync_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        count += db.session.execute(
+            update(Transaction)
+            .where(rows)
+            .values(amount_in_base=Transaction.amount * rate, base_rate=rate, base_currency=target)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+    metrics.inc('revalued_transactions_total', count)
+    return count
+
+def revalue_rates():
+    """Catch every stored pair up with its current rate (scheduled). Returns the number of rows updated."""
+    from routes.currencies import rate_snapshot
+
+    pairs = set()
+    for source, target in rate_snapshot():
+        if source != target:
+            pairs.update({(source, target), (target, source)})
+    return sum(revalue_pair(source, target) for source, target in sorted(pairs))
+
+def revalue_user_later(user_id):
+    tasks.submit_with_app(current_app._get_current_object(), revalue_user, user_id)
+
+def revalue_pairs_later(pairs, pending_only=False):
+    """Revalue both directions of each changed (source, target) rate in the background."""
+    def job():
+        for source, target in pairs:
+            revalue_pair(source, target, pending_only)
+            revalue_pair(target, source, pending_only)
+    if pairs:
+        tasks.submit_with_app(current_app._get_current_object(), job)
+
+# --- Command --------------------------------------------------------------
+
+def _init_worker():
+    from app import app
+
+    # Connections inherited from the parent must not be shared after fork
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+def _revalue_chunk(user_ids):
+    from app import app
+
+    with app.app_context():
+        return len(user_ids), sum(revalue_user(user_id) for user_id in user_ids)
+
+def revalue_all(user_ids=None, workers=None):
+    if user_ids is None:
+        user_ids = db.session.scalars(select(UserDirectory.id).order_by(UserDirectory.id)).all()
+    db.session.remove()
+    db.engine.dispose()
+    chunks = [user_ids[i:i + CHUNK_SIZE] for i in range(0, len(user_ids), CHUNK_SIZE)]
+
+    started = time.perf_counter()
+    users_done = rows_done = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(_revalue_chunk, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            users, rows = future.result()
+            users_done += users
+            rows_done += rows
+            print(f"[{users_done}/{len(user_ids)} users] {rows_done} transactions revalued "
+                  f"({time.perf_counter() - started:.1f}s)")
+    return rows_done
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recompute stored base-currency amounts of transactions")
+    parser.add_argument('--user', type=int, action='append', help="only this user (repeatable)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--rates', action='store_true',
+                        help="only rows valued at a rate that has changed since (schedule this)")
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.rates:
+            print(f"{revalue_rates()} transactions revalued")
+        else:
+            revalue_all(args.user, args.workers)
+    sys.exit(0)
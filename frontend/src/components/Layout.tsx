@@ -31,7 +31,7 @@ const Layout = ({ children }: LayoutProps) => {
   ];
 
   const avatarUrl = user?.avatar 
-    ? `/uploads/${user.avatar}` 
+    ? `/api/files/${user.avatar}?size=128` 
     : null;
 
   return (
@@ -7,7 +7,7 @@ import { useSettingsStore } from '../store/settingsStore';
 import { translations } from '../i18n/translations';
 
 const Settings = () => {
-  const { user, updateUser } = useAuthStore();
+  const { user, updateUser, setAccessToken } = useAuthStore();
   const [activeTab, setActiveTab] = useState('profile');
   const { register, handleSubmit, setValue, reset, watch } = useForm();
   const { language } = useSettingsStore();
@@ -31,6 +31,8 @@ const Settings = () => {
     try {
         setPassError('');
         const res = await api.put('/settings/profile', data);
+        // Profile fields are embedded in the token, so swap in the fresh one
+        if (res.data.token) setAccessToken(res.data.token);
         updateUser({
             name: res.data.user.name,
             currency: res.data.user.currency
@@ -50,6 +52,7 @@ const Settings = () => {
       formData.append('file', e.target.files[0]);
       try {
           const res = await api.post(`/settings/${endpoint}`, formData);
+          if (res.data.token) setAccessToken(res.data.token);
           updateUser({ [updateKey]: res.data[updateKey] });
       } catch(e) { alert("Upload failed"); }
   };
@@ -79,7 +82,7 @@ const Settings = () => {
       } catch(e) { alert("Export failed"); }
   }
 
-  const avatarUrl = user?.avatar ? `/uploads/${user.avatar}` : null;
+  const avatarUrl = user?.avatar ? `/api/files/${user.avatar}?size=128` : null;
 
   return (
     <div className="space-y-6">
@@ -13,6 +13,7 @@ interface AuthState {
   user: User | null;
   setToken: (token: string, user: User) => void;
   updateUser: (user: Partial<User>) => void;
+  setAccessToken: (token: string) => void;
   logout: () => void;
 }
 
@@ -25,6 +26,7 @@ export const useAuthStore = create<AuthState>()(
       updateUser: (updates) => set((state) => ({
         user: state.user ? { ...state.user, ...updates } : null
       })),
+      setAccessToken: (token) => set({ token }),
       logout: () => set({ token: null, user: null }),
     }),
     {